@@ -0,0 +1,168 @@
+"""
+Cache of fact-checker verdicts for claims that were already checked.
+
+The personas repeat their talking points turn after turn, and every repetition used to be judged from scratch.
+The cache answers a claim with the verdict of an earlier, equivalent claim:
+- claims are first compared by their normalized text (case, punctuation and whitespace ignored)
+- otherwise by the cosine similarity of their embeddings from a local Ollama embedding model, above a threshold
+- two claims only match if they contain the same numbers, "crime rose 30%" is not "crime rose 3%"
+
+Verdicts are kept per namespace: fact_checker_persona.py stores its claim judgements under the fact-checker model,
+the frontend the text of its fact checks of whole turns and chunks in a namespace of its own. Those are only
+matched by their normalized text (semantic=False), since two long answers that say different things can still have
+similar embeddings. If the embedding model is not available, only normalized text is matched until it is tried
+again.
+"""
+
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from evidence_lookup import normalize_claim
+from ollama_pool import ollama_pool
+
+# local embedding model, e.g. pulled with "ollama pull nomic-embed-text"
+EMBED_MODEL = os.environ.get("POLITIKAI_EMBED_MODEL", "nomic-embed-text")
+
+# cosine similarity above which two claims count as the same, 1 to only match normalized text
+SIMILARITY_THRESHOLD = float(os.environ.get("POLITIKAI_CLAIM_SIMILARITY", 0.92))
+
+# verdicts kept per namespace, the least recently used are dropped
+MAX_ENTRIES = 2048
+
+# seconds after a failed embedding call during which only normalized text is matched
+EMBED_RETRY_S = 60.0
+
+
+def numbers_in(text: str) -> set:
+    return set(re.findall(r"\d+(?:[.,]\d+)*", text))
+
+
+def unit_vector(vector: list) -> list:
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return [x / norm for x in vector]
+
+
+class ClaimCache:
+    def __init__(self, embed_model: str = EMBED_MODEL, threshold: float = SIMILARITY_THRESHOLD,
+                 max_entries: int = MAX_ENTRIES, client=ollama_pool):
+        """
+        Args:
+            embed_model: Ollama embedding model, empty to only match normalized text
+            threshold: Cosine similarity above which two claims count as the same
+            client: An ollama.Client, the ollama module itself or an OllamaPool
+        """
+        self.embed_model = embed_model
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.client = client
+        self.entries = {}  # namespace -> OrderedDict of normalized claim -> (vector, numbers, verdict, seconds)
+        self.vectors = OrderedDict()  # normalized claim -> embedding, so put does not embed again after get
+        self.counts = Counter()  # exact hits, semantic hits and misses
+        self.seconds_saved = 0.0  # time the cached verdicts took to compute the first time
+        self.embed_seconds = 0.0  # time spent embedding claims
+        self.embed_retry_at = 0.0  # after an embedding error, the time to try the embedding model again
+        self._lock = threading.Lock()
+
+    def _embedding(self, key: str):
+        if not (self.embed_model and self.threshold < 1) or time.monotonic() < self.embed_retry_at:
+            return None
+        with self._lock:
+            if key in self.vectors:
+                return self.vectors[key]
+
+        start = time.perf_counter()
+        try:
+            response = self.client.embed(model=self.embed_model, input=key)
+            vector = unit_vector(response["embeddings"][0])
+        except Exception as e:
+            print(f"[claim cache] embedding with {self.embed_model} failed, only matching normalized text for "
+                  f"{EMBED_RETRY_S:.0f}s: {e}")
+            self.embed_retry_at = time.monotonic() + EMBED_RETRY_S
+            return None
+        self.embed_seconds += time.perf_counter() - start
+
+        with self._lock:
+            self.vectors[key] = vector
+            if len(self.vectors) > self.max_entries:
+                self.vectors.popitem(last=False)
+        return vector
+
+    def get(self, claim: str, namespace: str = "", semantic: bool = True, accept=None):
+        """
+        Returns the verdict of an equivalent claim, or None.
+
+        Args:
+            semantic: False to only match the normalized text
+            accept: Function telling whether a verdict can be used, other verdicts are neither returned nor counted
+        """
+        key = normalize_claim(claim)
+        entries = self.entries.setdefault(namespace, OrderedDict())
+
+        def usable(entry) -> bool:
+            return accept is None or accept(entry[2])
+
+        with self._lock:
+            if key in entries and usable(entries[key]):
+                entries.move_to_end(key)
+                return self._hit("exact", entries[key])
+
+        vector = self._embedding(key) if semantic else None
+        if vector is None:
+            self.counts["miss"] += 1
+            return None
+
+        numbers = numbers_in(key)
+        best, best_similarity = None, self.threshold
+        with self._lock:
+            for other_key, entry in entries.items():
+                other_vector, other_numbers = entry[0], entry[1]
+                if other_vector is None or other_numbers != numbers or not usable(entry):
+                    continue
+                similarity = sum(a * b for a, b in zip(vector, other_vector))
+                if similarity >= best_similarity:
+                    best, best_similarity = other_key, similarity
+            if best is not None:
+                entries.move_to_end(best)
+                return self._hit("semantic", entries[best])
+        self.counts["miss"] += 1
+        return None
+
+    def _hit(self, kind: str, entry):
+        self.counts[kind] += 1
+        self.seconds_saved += entry[3]
+        return entry[2]
+
+    def put(self, claim: str, verdict, seconds: float = 0.0, namespace: str = "", semantic: bool = True) -> None:
+        """
+        Args:
+            seconds: How long the verdict took to compute, counted as saved on every hit
+            semantic: False to not embed the claim, so it is only matched by its normalized text
+        """
+        key = normalize_claim(claim)
+        vector = self._embedding(key) if semantic else None
+        with self._lock:
+            entries = self.entries.setdefault(namespace, OrderedDict())
+            entries[key] = (vector, numbers_in(key), verdict, seconds)
+            entries.move_to_end(key)
+            if len(entries) > self.max_entries:
+                entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        lookups = sum(self.counts.values())
+        hits = self.counts["exact"] + self.counts["semantic"]
+        return {
+            "lookups": lookups,
+            "exact_hits": self.counts["exact"],
+            "semantic_hits": self.counts["semantic"],
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "seconds_saved": round(self.seconds_saved, 2),
+            "embed_seconds": round(self.embed_seconds, 2),
+        }
+
+
+# shared by fact_checker_persona.py and the frontend
+claim_cache = ClaimCache()
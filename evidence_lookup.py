@@ -0,0 +1,280 @@
+"""
+Evidence for the fact-checker from previous fact checks.
+
+Before a claim is judged, the lookup searches a local corpus of fact-checked claims (JSONL, one record per line
+with the keys claim, rating, publisher and url) with BM25:
+- lookups are cached per normalized claim, so a repeated claim is answered from memory without any search
+- the BM25 index is built once per corpus and stored as JSON next to the response cache, in a file per corpus
+  path, along with the size and modification time of the corpus it was built from; remote results added to the
+  corpus are added to the stored index too, so it is not rebuilt on the next start
+- only if the local index has nothing on a claim, the remote lookup (Google Fact Check Tools, see
+  external_fact_check.py) is asked; its results are added to the corpus, so the same claim is local next time
+- if a fact check is about the same claim (same terms) and has a plain true or false rating, confident_verdict
+  turns it into a judgement, so the claim does not have to be judged by the model at all
+
+The remote lookup is any function taking a claim and returning evidence records. Pass remote=None, or set
+POLITIKAI_REMOTE_FACT_CHECK=0, to stay offline, e.g. in tests.
+"""
+
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from external_fact_check import google_fact_check
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+
+# corpus of fact-checked claims, e.g. an export of ClaimReview data
+CORPUS_PATH = os.environ.get("POLITIKAI_EVIDENCE_CORPUS", os.path.join(CACHE_DIR, "fact_check_corpus.jsonl"))
+
+
+REMOTE_ENABLED = os.environ.get("POLITIKAI_REMOTE_FACT_CHECK", "1") != "0"
+
+# number of claims whose evidence is kept in memory
+LOOKUP_CACHE_SIZE = 4096
+
+# share of the claim's terms a corpus entry has to contain to count as evidence
+MIN_TERM_OVERLAP = 0.5
+
+MAX_EVIDENCE = 3
+
+# ratings that settle a claim on their own; qualified ones like "Mostly false" or "Half true" do not
+RATING_VERDICTS = {
+    "true": "TRUE", "correct": "TRUE", "accurate": "TRUE",
+    "false": "FALSE", "incorrect": "FALSE", "pants on fire": "FALSE", "fake": "FALSE", "wrong": "FALSE",
+}
+
+# BM25 parameters
+K1 = 1.5
+B = 0.75
+
+STOPWORDS = {
+    "a", "an", "the", "and", "or", "of", "to", "in", "on", "for", "is", "are", "was", "were", "be", "been", "by",
+    "with", "that", "this", "it", "as", "at", "from", "has", "have", "had", "not", "than", "more", "most",
+}
+
+
+def normalize_claim(claim: str) -> str:
+    return " ".join(re.findall(r"\w+", claim.lower().replace("%", " percent")))
+
+
+def tokenize(text: str) -> list:
+    return [term for term in re.findall(r"\w+", text.lower()) if term not in STOPWORDS]
+
+
+class BM25Index:
+    def __init__(self, records: list = ()):
+        self.records = []
+        self.lengths = []
+        self.postings = {}  # term -> {record index: term frequency}
+        for record in records:
+            self.add(record)
+
+    def add(self, record: dict) -> None:
+        doc_id = len(self.records)
+        terms = Counter(tokenize(record.get("claim", "")))
+        self.records.append(record)
+        self.lengths.append(sum(terms.values()))
+        for term, count in terms.items():
+            self.postings.setdefault(term, {})[doc_id] = count
+
+    def to_dict(self) -> dict:
+        return {"records": self.records, "lengths": self.lengths, "postings": self.postings}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "BM25Index":
+        index = cls()
+        index.records = data["records"]
+        index.lengths = data["lengths"]
+        # JSON object keys are strings
+        index.postings = {
+            term: {int(doc_id): tf for doc_id, tf in postings.items()} for term, postings in data["postings"].items()
+        }
+        return index
+
+    def search(self, query: str, k: int = MAX_EVIDENCE, min_overlap: float = MIN_TERM_OVERLAP) -> list:
+        terms = set(tokenize(query))
+        if not terms or not self.records:
+            return []
+
+        count = len(self.records)
+        avg_length = sum(self.lengths) / count
+        scores = Counter()
+        matched = Counter()
+        for term in terms:
+            postings = self.postings.get(term, {})
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, tf in postings.items():
+                norm = K1 * (1 - B + B * self.lengths[doc_id] / avg_length)
+                scores[doc_id] += idf * tf * (K1 + 1) / (tf + norm)
+                matched[doc_id] += 1
+
+        return [
+            self.records[doc_id]
+            for doc_id, _ in scores.most_common()
+            if matched[doc_id] / len(terms) >= min_overlap
+        ][:k]
+
+
+def corpus_signature(path: str):
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return [os.path.abspath(path), stat.st_size, stat.st_mtime_ns]
+
+
+def index_path_for(corpus_path: str) -> str:
+    """The stored index of a corpus, one file per corpus path so that corpora do not overwrite each other."""
+    digest = hashlib.sha256(os.path.abspath(corpus_path).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(CACHE_DIR, f"evidence_index_{digest}.json")
+
+
+def store_index(index: BM25Index, corpus_path: str, index_path: str = None) -> None:
+    index_path = index_path or index_path_for(corpus_path)
+    os.makedirs(os.path.dirname(os.path.abspath(index_path)), exist_ok=True)
+    with open(index_path, "w", encoding="utf-8") as f:
+        json.dump({"signature": corpus_signature(corpus_path), **index.to_dict()}, f, ensure_ascii=False)
+
+
+def load_index(corpus_path: str = CORPUS_PATH, index_path: str = None) -> BM25Index:
+    """Loads the stored index of the corpus, or builds and stores it if the corpus has changed since."""
+    index_path = index_path or index_path_for(corpus_path)
+    signature = corpus_signature(corpus_path)
+    if signature is None:
+        return BM25Index()
+
+    if os.path.exists(index_path):
+        try:
+            with open(index_path, "r", encoding="utf-8") as f:
+                stored = json.load(f)
+            if stored["signature"] == signature:
+                return BM25Index.from_dict(stored)
+        except (ValueError, KeyError, TypeError, AttributeError):
+            pass  # an unreadable index is built again
+
+    records = []
+    with open(corpus_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                records.append(json.loads(line))
+    index = BM25Index(records)
+
+    store_index(index, corpus_path, index_path)
+    print(f"[evidence] indexed {len(records)} fact checks from {corpus_path}")
+    return index
+
+
+def confident_verdict(claim: str, evidence: list):
+    """
+    Returns a judgement (Claim, Judgement, Explanation) from a fact check of the same claim with a plain true or
+    false rating, or None if the model has to judge the claim.
+    """
+    terms = set(tokenize(normalize_claim(claim)))
+    for e in evidence:
+        verdict = RATING_VERDICTS.get(normalize_claim(e.get("rating") or ""))
+        if verdict and terms and set(tokenize(normalize_claim(e["claim"]))) == terms:
+            return {
+                "Claim": claim,
+                "Judgement": verdict,
+                "Explanation": f'Rated {e["rating"]} by {e.get("publisher") or "unknown"}'
+                               + (f' ({e["url"]})' if e.get("url") else "") + ".",
+            }
+    return None
+
+
+def format_evidence(evidence: list) -> str:
+    if not evidence:
+        return ""
+    lines = [
+        f'- "{e["claim"]}" rated {e.get("rating") or "unrated"} by {e.get("publisher") or "unknown"}'
+        + (f' ({e["url"]})' if e.get("url") else "")
+        for e in evidence
+    ]
+    return "\nEvidence from previous fact checks:\n" + "\n".join(lines)
+
+
+class EvidenceLookup:
+    def __init__(self, corpus_path: str = CORPUS_PATH, remote=google_fact_check if REMOTE_ENABLED else None,
+                 cache_size: int = LOOKUP_CACHE_SIZE, index_path: str = None):
+        """
+        Args:
+            corpus_path: JSONL file of fact-checked claims; remote results are appended to it
+            remote: Function claim -> evidence records used when the local index has nothing, None to stay offline
+            cache_size: Number of claims whose evidence is kept in memory
+            index_path: JSON file the index of the corpus is stored in, by default one in CACHE_DIR per corpus
+        """
+        self.corpus_path = corpus_path
+        self.index_path = index_path
+        self.remote = remote
+        self.cache_size = cache_size
+        self.cache = OrderedDict()  # normalized claim -> evidence
+        self.counts = Counter()  # where the lookups were answered: cache, local, remote, none
+        self.seconds = Counter()  # time spent per source
+        self._index = None
+        self._lock = threading.Lock()
+
+    @property
+    def index(self) -> BM25Index:
+        if self._index is None:
+            self._index = load_index(self.corpus_path, self.index_path)
+        return self._index
+
+    def lookup(self, claim: str) -> list:
+        """Returns up to MAX_EVIDENCE fact checks related to the claim, most relevant first."""
+        start = time.perf_counter()
+        key = normalize_claim(claim)
+
+        with self._lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self._done("cache", start, self.cache[key])
+            evidence = self.index.search(claim)
+        source = "local"
+
+        if not evidence and self.remote is not None:
+            evidence = self.remote(claim)
+            source = "remote"
+            self._add_to_corpus(evidence)
+
+        with self._lock:
+            self.cache[key] = evidence
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+            return self._done(source if evidence else "none", start, evidence)
+
+    def _done(self, source: str, start: float, evidence: list) -> list:
+        self.counts[source] += 1
+        self.seconds[source] += time.perf_counter() - start
+        return evidence
+
+    def _add_to_corpus(self, evidence: list) -> None:
+        if not evidence:
+            return
+        with self._lock:
+            os.makedirs(os.path.dirname(os.path.abspath(self.corpus_path)), exist_ok=True)
+            with open(self.corpus_path, "a", encoding="utf-8") as f:
+                for record in evidence:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    self.index.add(record)
+            # stored with the new size of the corpus, so the next start does not build the index again
+            store_index(self.index, self.corpus_path, self.index_path)
+
+    def stats(self) -> dict:
+        lookups = sum(self.counts.values())
+        return {
+            "lookups": lookups,
+            **{source: self.counts[source] for source in ("cache", "local", "remote", "none")},
+            "cache_hit_rate": self.counts["cache"] / lookups if lookups else 0.0,
+            "mean_ms": {
+                source: 1000 * self.seconds[source] / self.counts[source] for source in self.counts
+            },
+        }
+
+
+# shared by all entry points of the project
+evidence_lookup = EvidenceLookup()
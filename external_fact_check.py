@@ -0,0 +1,50 @@
+"""
+Remote fact-check lookup through the Google Fact Check Tools API (claims:search).
+
+This is the slow path of the evidence lookup: one network round trip per claim. It is only used for claims the
+local index in evidence_lookup.py has nothing on, and without POLITIKAI_GOOGLE_FACT_CHECK_KEY it does nothing.
+"""
+
+import os
+
+import httpx
+
+API_URL = "https://factchecktools.googleapis.com/v1alpha1/claims:search"
+
+API_KEY = os.environ.get("POLITIKAI_GOOGLE_FACT_CHECK_KEY", "")
+
+TIMEOUT_S = 5
+
+
+def google_fact_check(claim: str, max_results: int = 3) -> list:
+    """
+    Returns:
+        Evidence records with the keys claim, rating, publisher and url; an empty list if there is no key,
+        no match or the request failed
+    """
+    if not API_KEY:
+        return []
+
+    try:
+        response = httpx.get(
+            API_URL,
+            params={"query": claim, "key": API_KEY, "pageSize": max_results, "languageCode": "en"},
+            timeout=TIMEOUT_S
+        )
+        response.raise_for_status()
+        # an HTML error page or a truncated body is not JSON
+        claims = response.json().get("claims", [])
+    except (httpx.HTTPError, ValueError) as e:
+        print(f"[evidence] Google fact check failed: {e}")
+        return []
+
+    evidence = []
+    for item in claims:
+        for review in item.get("claimReview", []):
+            evidence.append({
+                "claim": item.get("text", ""),
+                "rating": review.get("textualRating", ""),
+                "publisher": review.get("publisher", {}).get("name", ""),
+                "url": review.get("url", ""),
+            })
+    return evidence[:max_results]
@@ -1,10 +1,75 @@
 """
 Analyze fact-checker results for false positives, false negatives, etc.
+Also reports the latency of the fact-checker and compares it between two results files.
 """
 
+import argparse
 import json
+import sys
 from pathlib import Path
 
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from percentiles import percentile
+
+# per-claim timings in the results, with their unit; older results files only have response_time
+PERFORMANCE_METRICS = {
+    'response_time': 's',
+    'server_time': 's',
+    'queue_wait': 's',
+    'time_to_first_token': 's',
+    'tokens_per_second': 'tok/s',
+}
+
+# metrics where a higher value is better, for all others lower is better
+HIGHER_IS_BETTER = {'tokens_per_second'}
+
+# change in percent from which a slowdown is reported as a regression
+REGRESSION_THRESHOLD = 10
+
+
+def distribution(values: list) -> dict:
+    return {
+        'n': len(values),
+        'mean': sum(values) / len(values) if values else 0,
+        'p50': percentile(values, 50),
+        'p90': percentile(values, 90),
+        'p99': percentile(values, 99),
+        'max': max(values, default=0),
+    }
+
+
+def performance_groups(results: list) -> dict:
+    """The results split into the groups the latency is reported for."""
+    return {
+        'all': results,
+        'DEM': [r for r in results if r['party'] == 'DEM'],
+        'REP': [r for r in results if r['party'] == 'REP'],
+        'expected TRUE': [r for r in results if r['expected'] == 'TRUE'],
+        'expected FALSE': [r for r in results if r['expected'] == 'FALSE'],
+    }
+
+
+def analyze_performance(results: list) -> dict:
+    """Print the latency distribution per party and per expected label."""
+    print("\n" + "=" * 70)
+    print("PERFORMANCE ANALYSIS")
+    print("=" * 70)
+
+    performance = {}
+    for metric, unit in PERFORMANCE_METRICS.items():
+        if not any(metric in r for r in results):
+            continue
+        performance[metric] = {}
+        print(f"\n{metric} ({unit}):")
+        print(f"  {'group':<16}{'n':>5}{'mean':>9}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}")
+        for group, group_results in performance_groups(results).items():
+            d = distribution([r[metric] for r in group_results if metric in r])
+            performance[metric][group] = d
+            print(f"  {group:<16}{d['n']:>5}{d['mean']:>9.2f}{d['p50']:>9.2f}{d['p90']:>9.2f}{d['p99']:>9.2f}"
+                  f"{d['max']:>9.2f}")
+
+    return performance
+
 
 def analyze_results(json_file: str = "fact_checker_results.json"):
     """Analyze fact-checker results and compute confusion matrix metrics."""
@@ -106,6 +171,8 @@ def analyze_results(json_file: str = "fact_checker_results.json"):
         print(f"  Total: {p_total}, Correct: {p_correct}, Accuracy: {p_accuracy:.2f}%")
         print(f"  TP: {len(party_tp)}, TN: {len(party_tn)}, FP: {len(party_fp)}, FN: {len(party_fn)}")
 
+    performance = analyze_performance(results)
+
     print("\n" + "=" * 70)
 
     return {
@@ -116,9 +183,77 @@ def analyze_results(json_file: str = "fact_checker_results.json"):
         'accuracy': accuracy,
         'precision': precision,
         'recall': recall,
-        'f1': f1
+        'f1': f1,
+        'performance': performance
     }
 
 
+def compare_results(old_file: str, new_file: str) -> dict:
+    """
+    Compare the accuracy and latency of two results files, e.g. of two versions of the modelfile.
+
+    Returns:
+        Per metric and statistic: (old value, new value, change in percent)
+    """
+    with open(old_file, 'r', encoding='utf-8') as f:
+        old = json.load(f)
+    with open(new_file, 'r', encoding='utf-8') as f:
+        new = json.load(f)
+    old_results = old['evaluation_results']
+    new_results = new['evaluation_results']
+
+    print("=" * 70)
+    print("FACT-CHECKER COMPARISON")
+    print("=" * 70)
+    print(f"  old: {old_file} ({old['model_info'].get('modelfile')})")
+    print(f"  new: {new_file} ({new['model_info'].get('modelfile')})")
+
+    old_accuracy = sum(r['correct'] for r in old_results) / len(old_results) * 100 if old_results else 0
+    new_accuracy = sum(r['correct'] for r in new_results) / len(new_results) * 100 if new_results else 0
+    print(f"\n  Accuracy: {old_accuracy:.2f}% -> {new_accuracy:.2f}% ({new_accuracy - old_accuracy:+.2f} points)")
+
+    changes = {}
+    regressions = []
+    for metric, unit in PERFORMANCE_METRICS.items():
+        old_values = [r[metric] for r in old_results if metric in r]
+        new_values = [r[metric] for r in new_results if metric in r]
+        if not old_values or not new_values:
+            continue
+
+        print(f"\n{metric} ({unit}):")
+        changes[metric] = {}
+        old_distribution = distribution(old_values)
+        new_distribution = distribution(new_values)
+        for statistic in ('mean', 'p50', 'p90', 'p99', 'max'):
+            old_value = old_distribution[statistic]
+            new_value = new_distribution[statistic]
+            change = (new_value - old_value) / old_value * 100 if old_value else 0
+            changes[metric][statistic] = (old_value, new_value, change)
+
+            slower = -change if metric in HIGHER_IS_BETTER else change
+            flag = "  REGRESSION" if slower > REGRESSION_THRESHOLD else ""
+            if flag:
+                regressions.append(f"{metric} {statistic}")
+            print(f"  {statistic:<5}{old_value:>9.2f} -> {new_value:>9.2f}  ({change:+.1f}%){flag}")
+
+    print("\n" + "-" * 70)
+    if regressions:
+        print(f"  Slower by more than {REGRESSION_THRESHOLD}%: {', '.join(regressions)}")
+    else:
+        print(f"  No metric is slower by more than {REGRESSION_THRESHOLD}%")
+    print("=" * 70)
+
+    return changes
+
+
 if __name__ == "__main__":
-    analyze_results()
+    parser = argparse.ArgumentParser(description="Analyze fact-checker results, or compare two results files.")
+    parser.add_argument("results", nargs="?", default="fact_checker_results.json", help="results file to analyze")
+    parser.add_argument("--compare", metavar="OLD_RESULTS",
+                        help="earlier results file to compare the latency and accuracy against")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare_results(args.compare, args.results)
+    else:
+        analyze_results(args.results)
@@ -4,27 +4,64 @@ Uses HammerAI/mistral-nemo-uncensored:latest with fact-checker.mf system prompt
 Evaluates performance on claims.txt
 """
 
-import ollama
+import os
+import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Dict, List, Tuple
 import json
 import re
 
+# the response cache is shared with the chat app and the persona evaluation, it lives in the repository root
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from ollama_pool import ollama_pool
+from percentiles import percentile
+from persona_construction.checkpoint import append_record, checkpoint_path, remove_checkpoint
+from response_cache import response_cache
+
+# how many claims are checked at the same time; Ollama only runs them in parallel up to its OLLAMA_NUM_PARALLEL
+WORKERS = int(os.environ.get("POLITIKAI_EVAL_WORKERS", 4))
+
+
+def token_metrics(response) -> Dict:
+    """
+    Generation speed from the durations Ollama reports (in nanoseconds). The time to first token is the time
+    the server spent before generating: loading the model and processing the prompt. The server time is the
+    time the server spent on the request, without the time it waited for a free slot.
+    """
+    eval_count = response.get('eval_count') or 0
+    eval_duration = response.get('eval_duration') or 0
+    if not eval_duration:
+        return {}
+    return {
+        'eval_count': eval_count,
+        'tokens_per_second': eval_count / (eval_duration / 1e9),
+        'time_to_first_token': (
+            (response.get('load_duration') or 0) + (response.get('prompt_eval_duration') or 0)
+        ) / 1e9,
+        'server_time': (response.get('total_duration') or 0) / 1e9
+    }
+
 
 class FactCheckerEvaluator:
     """Evaluates a fact-checker model using claims from a file."""
     
-    def __init__(self, model_name: str = "fact-checker", modelfile_path: str = "model_files/fact-checker.mf"):
+    def __init__(self, model_name: str = "fact-checker", modelfile_path: str = "model_files/fact-checker.mf",
+                 use_cache: bool = False):
         """
         Initialize the evaluator.
         
         Args:
             model_name: Name to give the created model
             modelfile_path: Path to the modelfile with system prompt
+            use_cache: Answer claims that were already checked with the same model from the response cache.
+                Off by default: a cache hit keeps the recorded durations and token counts but returns at once,
+                which would make the response times, percentiles and throughput meaningless
         """
         self.model_name = model_name
         self.modelfile_path = Path(modelfile_path)
+        self.use_cache = use_cache
         self.results = []
         
     def parse_modelfile(self) -> dict:
@@ -66,7 +103,7 @@ class FactCheckerEvaluator:
             config = self.parse_modelfile()
 
             # Create the model using ollama
-            ollama.create(
+            ollama_pool.create(
                 model=self.model_name,
                 from_=config.get('from_'),
                 system=config.get('system'),
@@ -108,7 +145,7 @@ class FactCheckerEvaluator:
         
         return claims
     
-    def check_claim(self, claim_text: str) -> Tuple[str, float]:
+    def check_claim(self, claim_text: str) -> Tuple[str, float, Dict]:
         """
         Send a claim to the fact-checker model and get response.
         
@@ -116,29 +153,31 @@ class FactCheckerEvaluator:
             claim_text: The claim to fact-check
             
         Returns:
-            Tuple of (response_text, response_time)
+            Tuple of (response_text, response_time, token metrics reported by Ollama)
         """
         start_time = time.time()
         
         try:
-            response = ollama.chat(
+            response = response_cache.chat(
+                ollama_pool,
                 model=self.model_name,
                 messages=[
                     {
                         'role': 'user',
                         'content': claim_text
                     }
-                ]
+                ],
+                use_cache=self.use_cache
             )
             
             response_time = time.time() - start_time
             response_text = response['message']['content'].strip()
             
-            return response_text, response_time
+            return response_text, response_time, token_metrics(response)
             
         except Exception as e:
             print(f"Error checking claim: {e}")
-            return f"ERROR: {e}", time.time() - start_time
+            return f"ERROR: {e}", time.time() - start_time, {}
     
     def evaluate_response(self, response: str, expected: str) -> Dict:
         """
@@ -173,51 +212,77 @@ class FactCheckerEvaluator:
             'no_verifiable_claims_detected': no_verifiable_claims
         }
     
-    def evaluate_all_claims(self, claims_file: str = "claims.txt") -> Dict:
+    def evaluate_all_claims(self, claims_file: str = "claims.txt", workers: int = WORKERS,
+                            output_file: str = None) -> Dict:
         """
         Evaluate all claims in the file.
         
         Args:
             claims_file: Path to claims file
+            workers: Number of claims checked at the same time (1 checks them one after the other)
+            output_file: If set, every result is appended to its checkpoint file as soon as it is in, and all
+                results are written there once every claim is checked
             
         Returns:
             Dictionary with evaluation statistics
         """
         print(f"\nEvaluating claims from {claims_file}...")
         claims = self.parse_claims_file(claims_file)
-        print(f"Found {len(claims)} claims to evaluate\n")
+        print(f"Found {len(claims)} claims to evaluate ({workers} at a time)\n")
         
         correct_count = 0
         total_time = 0
+        start_time = time.time()
+        checkpoint = open(checkpoint_path(output_file), 'w', encoding='utf-8') if output_file else None
         
-        for idx, claim in enumerate(claims, 1):
-            print(f"[{idx}/{len(claims)}] Evaluating: {claim['text'][:60]}...")
-            
-            response, response_time = self.check_claim(claim['text'])
-            evaluation = self.evaluate_response(response, claim['expected'])
-            
-            # Store result
-            result = {
-                'claim_number': idx,
-                'party': claim['party'],
-                'claim': claim['text'],
-                'expected': claim['expected'],
-                'response': response,
-                'response_time': response_time,
-                **evaluation
-            }
-            self.results.append(result)
-            
-            if evaluation['correct']:
-                correct_count += 1
-                status = "✓ CORRECT"
-            else:
-                status = "✗ INCORRECT"
-            
-            print(f"  {status} (Expected: {claim['expected']}, Time: {response_time:.2f}s)")
-            print(f"  Response: {response[:100]}{'...' if len(response) > 100 else ''}\n")
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(self.check_claim, claim['text']) for claim in claims]
             
-            total_time += response_time
+            # results are taken in claim order, the later claims keep running meanwhile
+            for idx, (claim, future) in enumerate(zip(claims, futures), 1):
+                print(f"[{idx}/{len(claims)}] Evaluating: {claim['text'][:60]}...")
+                
+                response, response_time, metrics = future.result()
+                evaluation = self.evaluate_response(response, claim['expected'])
+                if metrics.get('server_time'):
+                    # with several workers, requests wait at the server until it has a free slot
+                    metrics['queue_wait'] = max(0.0, response_time - metrics['server_time'])
+                
+                # Store result
+                result = {
+                    'claim_number': idx,
+                    'party': claim['party'],
+                    'claim': claim['text'],
+                    'expected': claim['expected'],
+                    'response': response,
+                    'response_time': response_time,
+                    **metrics,
+                    **evaluation
+                }
+                self.results.append(result)
+                
+                if evaluation['correct']:
+                    correct_count += 1
+                    status = "✓ CORRECT"
+                else:
+                    status = "✗ INCORRECT"
+                
+                print(f"  {status} (Expected: {claim['expected']}, Time: {response_time:.2f}s)")
+                print(f"  Response: {response[:100]}{'...' if len(response) > 100 else ''}\n")
+                
+                total_time += response_time
+                
+                if checkpoint:
+                    append_record(checkpoint, result)
+        
+        wall_time = time.time() - start_time
+        if checkpoint:
+            checkpoint.close()
+            self.save_results(output_file)
+            remove_checkpoint(output_file)
+        response_times = [r['response_time'] for r in self.results]
+        server_times = [r['server_time'] for r in self.results if r.get('server_time')]
+        queue_waits = [r['queue_wait'] for r in self.results if 'queue_wait' in r]
         
         # Calculate statistics
         accuracy = (correct_count / len(claims)) * 100 if claims else 0
@@ -243,7 +308,15 @@ class FactCheckerEvaluator:
             'incorrect': len(claims) - correct_count,
             'overall_accuracy': accuracy,
             'average_response_time': avg_time,
+            'p50_response_time': percentile(response_times, 50),
+            'p95_response_time': percentile(response_times, 95),
+            'p50_server_time': percentile(server_times, 50),
+            'p95_server_time': percentile(server_times, 95),
+            'average_queue_wait': sum(queue_waits) / len(queue_waits) if queue_waits else 0,
             'total_time': total_time,
+            'wall_time': wall_time,
+            'throughput': len(claims) / wall_time if wall_time else 0,
+            'workers': workers,
             'dem_accuracy': dem_accuracy,
             'rep_accuracy': rep_accuracy,
             'true_claim_accuracy': true_accuracy,
@@ -277,7 +350,12 @@ class FactCheckerEvaluator:
         print(f"FALSE Claims: {stats['false_claims_count']} (Accuracy: {stats['false_claim_accuracy']:.2f}%)")
         print("-"*70)
         print(f"Average Response Time: {stats['average_response_time']:.2f}s")
+        print(f"Response Time p50 / p95: {stats['p50_response_time']:.2f}s / {stats['p95_response_time']:.2f}s")
+        print(f"Server Time p50 / p95: {stats['p50_server_time']:.2f}s / {stats['p95_server_time']:.2f}s "
+              f"(average wait for a server slot: {stats['average_queue_wait']:.2f}s)")
         print(f"Total Evaluation Time: {stats['total_time']:.2f}s ({stats['total_time']/60:.2f} minutes)")
+        print(f"Wall-Clock Time: {stats['wall_time']:.2f}s with {stats['workers']} worker(s) "
+              f"({stats['throughput']:.2f} claims/s)")
         print("="*70 + "\n")
     
     def save_results(self, output_file: str = "fact_checker_results.json"):
@@ -291,8 +369,11 @@ class FactCheckerEvaluator:
             'evaluation_results': self.results
         }
         
-        with open(output_file, 'w', encoding='utf-8') as f:
+        # written to a temporary file first, so a crash while saving keeps the previous results
+        tmp_file = f"{output_file}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
             json.dump(results_data, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_file, output_file)
         
         print(f"✓ Detailed results saved to {output_file}")
 
@@ -308,14 +389,11 @@ def main():
     # Create the model
     evaluator.create_model()
     
-    # Evaluate all claims
-    stats = evaluator.evaluate_all_claims("claims.txt")
+    # Evaluate all claims, the results are saved once all are checked
+    stats = evaluator.evaluate_all_claims("claims.txt", output_file="fact_checker_results.json")
     
     # Print summary
     evaluator.print_summary(stats)
-    
-    # Save results
-    evaluator.save_results("fact_checker_results.json")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,286 @@
+"""
+Incremental parser for the output of the fact-checker model.
+
+The fact-checker works through its tasks (claim extraction, judgement, response) in one output, and only the
+part after the "FACT CHECKER RESPONSE" heading is meant for the user. The parser is fed the output token by
+token, finds the heading as soon as it has been generated and from then on exposes the response text, so the
+sidebar can be filled while the model is still writing.
+
+If the heading never shows up (e.g. the model only answers "No verifiable claims in the text."), the whole
+output is used as the response once the generation has finished.
+
+The SentenceChunker does the same for the persona streams: it cuts them into chunks of whole sentences, which
+can be fact-checked while the persona is still generating.
+
+The JsonObjectStream does the same for the JSON tasks of fact_checker_persona.py: it returns every claim or
+judgement as soon as its object is closed, so judging can start while the claims are still being extracted.
+"""
+
+import json
+import re
+
+# matches both "FACT CHECKER RESPONSE" and "Fact Checker Response"
+SEPARATOR = re.compile(r"fact checker response", re.IGNORECASE)
+
+# markdown and punctuation that follows the heading, e.g. "**:\n" or "\n----\n"
+HEADING_TRAIL = '*:-"#\n\r\t '
+
+
+def clean_response(text: str) -> str:
+    text = text.lstrip(HEADING_TRAIL)
+    return text.replace('"', '')  # strip " from beginning and end of content
+
+
+class FactCheckStreamParser:
+    def __init__(self):
+        self.buffer = ""
+        self.response_start = None  # index in buffer right after the separator
+
+    @property
+    def found_separator(self) -> bool:
+        return self.response_start is not None
+
+    def feed(self, token: str):
+        """
+        Add a token of the model output.
+
+        Returns:
+            The response text so far, or None while the separator has not been generated yet
+        """
+        # only the tail can contain a separator that was split across tokens
+        search_from = max(0, len(self.buffer) - len(SEPARATOR.pattern))
+        self.buffer += token
+
+        if not self.found_separator:
+            match = SEPARATOR.search(self.buffer, search_from)
+            if not match:
+                return None
+            self.response_start = match.end()
+
+        return self.response
+
+    @property
+    def response(self) -> str:
+        if not self.found_separator:
+            return ""
+        return clean_response(self.buffer[self.response_start:])
+
+    def finish(self) -> str:
+        """Returns the final response, falling back to the whole output if the separator never appeared."""
+        if self.found_separator and self.response.strip():
+            return self.response
+        return clean_response(self.buffer).strip()
+
+
+def has_corrections(response: str) -> bool:
+    """False for the fixed answers the fact-checker gives when there is nothing to correct."""
+    response_lower = response.lower()
+    return not ("no false claims" in response_lower or "no verifiable claims" in response_lower)
+
+
+# end of a sentence: punctuation, optional closing quotes/brackets, then whitespace
+SENTENCE_END = re.compile(r"[.!?]+[\"')\]]*\s")
+
+# words ending in a period that do not end a sentence
+ABBREVIATIONS = {"mr.", "mrs.", "ms.", "dr.", "st.", "vs.", "jr.", "sr.", "no.", "e.g.", "i.e.", "etc."}
+
+
+class SentenceChunker:
+    """
+    Splits a token stream into chunks of whole sentences, so the fact-checker can start on the first
+    statements of a persona while the persona is still generating the rest.
+    """
+
+    def __init__(self, sentences_per_chunk: int = 2):
+        self.sentences_per_chunk = sentences_per_chunk
+        self.buffer = ""
+        self.sentences = []
+
+    @staticmethod
+    def _is_sentence_end(text: str, match) -> bool:
+        last_word = text[:match.start() + 1].split()[-1].lower()
+        # abbreviations and initials such as "U.S." or "J."
+        return last_word not in ABBREVIATIONS and not re.fullmatch(r"(?:[a-z]\.)+", last_word)
+
+    def feed(self, token: str) -> list:
+        """Add a token. Returns the chunks that were completed by it."""
+        self.buffer += token
+
+        start = 0
+        for match in SENTENCE_END.finditer(self.buffer):
+            if self._is_sentence_end(self.buffer, match):
+                self.sentences.append(self.buffer[start:match.end()].strip())
+                start = match.end()
+        self.buffer = self.buffer[start:]
+
+        chunks = []
+        while len(self.sentences) >= self.sentences_per_chunk:
+            chunks.append(" ".join(self.sentences[:self.sentences_per_chunk]))
+            self.sentences = self.sentences[self.sentences_per_chunk:]
+        return chunks
+
+    def flush(self) -> str:
+        """Returns whatever is left once the stream has ended."""
+        rest = " ".join(self.sentences + [self.buffer.strip()]).strip()
+        self.buffer = ""
+        self.sentences = []
+        return rest
+
+
+# Python literals the models write instead of JSON ones
+PYTHON_LITERALS = {"True": "true", "False": "false", "None": "null"}
+
+
+def split_strings(text: str) -> list:
+    """Splits text into (is_string, part) pairs, so repairs can leave the content of strings alone."""
+    parts = []
+    start = 0
+    in_string = False
+    escaped = False
+    for i, char in enumerate(text):
+        if escaped:
+            escaped = False
+        elif char == "\\" and in_string:
+            escaped = True
+        elif char == '"':
+            if in_string:
+                parts.append((True, text[start:i + 1]))
+                start = i + 1
+            else:
+                parts.append((False, text[start:i]))
+                start = i
+            in_string = not in_string
+    parts.append((in_string, text[start:]))
+    return parts
+
+
+def close_truncated(text: str) -> str:
+    """Closes the string, objects and arrays that are still open at the end of text, e.g. a cut-off output."""
+    closers = []
+    for is_string, part in split_strings(text):
+        if is_string:
+            continue
+        for char in part:
+            if char in "{[":
+                closers.append("}" if char == "{" else "]")
+            elif char in "}]" and closers:
+                closers.pop()
+    if split_strings(text)[-1][0]:
+        text += '"'
+    return text.rstrip().rstrip(",") + "".join(reversed(closers))
+
+
+def repair_json(text: str) -> str:
+    """
+    Fixes the mistakes models commonly make when writing JSON:
+    - single or typographic quotes instead of double quotes (only if there are no double quotes at all)
+    - unquoted keys, trailing commas, True/False/None
+    - line breaks and tabs inside strings
+    """
+    if '"' not in text:
+        text = re.sub(r"[“”]", '"', text)
+    if '"' not in text:
+        text = text.replace("'", '"')
+
+    repaired = []
+    for is_string, part in split_strings(text):
+        if is_string:
+            part = part.replace("\n", "\\n").replace("\r", "\\r").replace("\t", "\\t")
+        else:
+            part = re.sub(r"([{,]\s*)([A-Za-z_][\w ]*?)(\s*:)", r'\1"\2"\3', part)
+            part = re.sub(r",\s*(?=[}\]])", "", part)
+            part = re.sub(r"\b(True|False|None)\b", lambda m: PYTHON_LITERALS[m.group(1)], part)
+        repaired.append(part)
+    return "".join(repaired)
+
+
+def parse_lenient(text: str):
+    """json.loads, and if that fails json.loads of the repaired text. Raises ValueError if both fail."""
+    try:
+        return json.loads(text)
+    except ValueError:
+        return json.loads(repair_json(text))
+
+
+def json_extent(text: str, start: int) -> int:
+    """End index of the object or array starting at start, the end of text if it is never closed."""
+    depth = 0
+    for is_string, part in split_strings(text[start:]):
+        if not is_string:
+            for i, char in enumerate(part):
+                if char in "{[":
+                    depth += 1
+                elif char in "}]":
+                    depth -= 1
+                    if depth == 0:
+                        return start + i + 1
+        start += len(part)
+    return len(text)
+
+
+class JsonObjectStream:
+    """
+    Finds the JSON objects in a model output while it is being generated.
+
+    Every object that contains no other object (a claim, a judgement, a response) is returned as soon as its
+    closing brace arrives, no matter whether the model wraps them in an array, in another object, in markdown
+    code fences or in prose. Objects that are not valid JSON are repaired with repair_json; those that cannot
+    be repaired are counted in errors and skipped.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.position = 0  # next character of buffer to scan
+        self.open = []  # [start index, contains another object] of every object that is still open
+        self.in_string = False
+        self.escaped = False
+        self.errors = 0
+
+    def feed(self, token: str) -> list:
+        """Add a token. Returns the objects that were completed by it."""
+        self.buffer += token
+        objects = []
+        for i in range(self.position, len(self.buffer)):
+            char = self.buffer[i]
+            if self.escaped:
+                self.escaped = False
+            elif self.in_string:
+                if char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char == "{":
+                if self.open:
+                    self.open[-1][1] = True
+                self.open.append([i, False])
+            elif char == "}" and self.open:
+                start, has_children = self.open.pop()
+                if not has_children:
+                    objects.extend(self._parse(self.buffer[start:i + 1]))
+        self.position = len(self.buffer)
+
+        # nothing before the oldest open object is needed anymore
+        keep_from = self.open[0][0] if self.open else self.position
+        self.buffer = self.buffer[keep_from:]
+        self.position -= keep_from
+        for entry in self.open:
+            entry[0] -= keep_from
+        return objects
+
+    def _parse(self, text: str) -> list:
+        try:
+            value = parse_lenient(text)
+        except ValueError:
+            self.errors += 1
+            return []
+        return [value] if isinstance(value, dict) else []
+
+    def finish(self) -> list:
+        """Returns the last object if the output ended before it was closed."""
+        if not self.open or self.open[-1][1]:
+            return []
+        text = close_truncated(self.buffer[self.open[-1][0]:])
+        self.open = []
+        return self._parse(text)
@@ -1,19 +1,43 @@
-from ollama import chat, ChatResponse
-from typing import Literal, TypedDict
+from ollama import ChatResponse
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator, Literal, NotRequired, Optional, TypedDict, Union, get_args, get_origin, get_type_hints
 import json
+import queue
 import re
-from external_fact_check import google_fact_check
+import threading
+import time
+from claim_cache import ClaimCache, claim_cache
+from evidence_lookup import EvidenceLookup, confident_verdict, evidence_lookup, format_evidence
+from fact_check_stream import JsonObjectStream, json_extent, parse_lenient
+from ollama_pool import ollama_pool
+from response_cache import response_cache
 
-def extract_json(text: str) -> dict:
-    # Remove markdown code fences if present
-    text = re.sub(r"```(?:json)?", "", text)
-    text = text.replace("```", "").strip()
+def extract_json(text: str) -> Union[dict, list]:
+    """
+    Finds the JSON in a model output, ignoring code fences and prose around it and repairing common mistakes.
+    Several objects or arrays in a row are returned as a list.
+    """
+    values = []
+    position = 0
+    while True:
+        match = re.compile(r"[\[{]").search(text, position)
+        if not match:
+            break
+        end = json_extent(text, match.start())
+        try:
+            value = parse_lenient(text[match.start():end])
+        except ValueError:
+            value = None
+        # every task answers with objects, anything else is a bracket in the prose, e.g. a "[1]" footnote
+        if isinstance(value, dict) or (isinstance(value, list) and all(isinstance(v, dict) for v in value)):
+            values.append(value)
+            position = end
+        else:
+            position = match.start() + 1
 
-    match = re.search(r"\{[\s\S]*}", text)
-    if not match:
+    if not values:
         raise ValueError("No JSON object found in model output.")
-
-    return json.loads(match.group())
+    return values[0] if len(values) == 1 else values
 
 # Define clear data models
 Verdict = Literal["TRUE", "FALSE", "UNVERIFIABLE"]
@@ -27,55 +51,479 @@ class ClaimJudgement(TypedDict):
 class ModeratorResponse(TypedDict):
     Response: str
 
+class ExtractedClaim(TypedDict):
+    Claim: str
+    Party: NotRequired[Party]
+
+def json_schema(model) -> dict:
+    """JSON schema of a TypedDict, or of one of the types it uses."""
+    if get_origin(model) is Literal:
+        return {"type": "string", "enum": list(get_args(model))}
+    if model is str:
+        return {"type": "string"}
+    hints = get_type_hints(model)
+    return {
+        "type": "object",
+        "properties": {key: json_schema(hint) for key, hint in hints.items()},
+        "required": [key for key in hints if key in model.__required_keys__]
+    }
+
+def array_schema(key: str, model) -> dict:
+    # the lists are wrapped in an object, which every model supports as structured output
+    return {
+        "type": "object",
+        "properties": {key: {"type": "array", "items": json_schema(model)}},
+        "required": [key]
+    }
+
+# structured output format per task
+SCHEMAS = {
+    "Extract:": array_schema("Claims", ExtractedClaim),
+    "Judge:": json_schema(ClaimJudgement),
+    "Judge batch": array_schema("Judgements", ClaimJudgement),
+    "Generate:": json_schema(ModeratorResponse),
+}
+
+# how often a task is regenerated when the output does not match its schema
+MAX_RETRIES = 2
+
+# the model created by setup.sh from model_files/fact-checker.mf, also used by the frontend
+FACT_CHECKER_MODEL = "fact-checker:latest"
+
+# what the Extract task answers for a text without verifiable claims
+NO_CLAIMS = "no verifiable claims"
+
+def schema_errors(value, schema: dict, path: str = "$") -> list:
+    """
+    Validates value against the subset of JSON schema used in SCHEMAS. Enum values are matched ignoring case
+    and replaced by their canonical spelling.
+    """
+    if schema["type"] == "object":
+        if not isinstance(value, dict):
+            return [f"{path} is not an object"]
+        errors = [f"{path}.{key} is missing" for key in schema["required"] if key not in value]
+        for key, subschema in schema["properties"].items():
+            if key not in value:
+                continue
+            if "enum" in subschema and isinstance(value[key], str):
+                value[key] = next((e for e in subschema["enum"] if e == value[key].upper()), value[key])
+            errors += schema_errors(value[key], subschema, f"{path}.{key}")
+        return errors
+    if schema["type"] == "array":
+        if not isinstance(value, list):
+            return [f"{path} is not an array"]
+        return [e for i, item in enumerate(value) for e in schema_errors(item, schema["items"], f"{path}[{i}]")]
+    if not isinstance(value, str):
+        return [f"{path} is not a string"]
+    if "enum" in schema and value not in schema["enum"]:
+        return [f"{path} is not one of {schema['enum']}"]
+    return []
+
+def conform(value, schema: dict):
+    # free-form output often leaves out the wrapper object around a list, or the list around a single item
+    if schema["type"] == "object" and len(schema["properties"]) == 1:
+        key, = schema["properties"]
+        items = schema["properties"][key]
+        if items["type"] == "array":
+            if isinstance(value, list):
+                return {key: value}
+            if isinstance(value, dict) and key not in value and all(k in value for k in items["items"]["required"]):
+                return {key: [value]}
+    return value
+
+def extracted_claim(value) -> Optional[dict]:
+    """
+    One item of the Extract output, conformed to ExtractedClaim, or None if it has no claim. A Party outside the
+    enum (e.g. "Democrat") is read as "UNK" instead of failing the whole output along with its other claims.
+    """
+    if not isinstance(value, dict) or not isinstance(value.get("Claim"), str):
+        return None
+    value = dict(value)
+    if schema_errors(value, SCHEMAS["Extract:"]["properties"]["Claims"]["items"]):
+        value["Party"] = "UNK"
+    return value
+
+def parse_output(content: str, schema: dict):
+    try:
+        output = conform(extract_json(content), schema)
+    except ValueError:
+        # the modelfile asks for this sentence instead of an empty list when there is nothing to extract
+        if schema is SCHEMAS["Extract:"] and NO_CLAIMS in content.lower():
+            return {"Claims": []}
+        raise
+    # claims are validated one by one, a malformed claim is dropped and the others kept
+    if schema is SCHEMAS["Extract:"] and isinstance(output, dict) and isinstance(output.get("Claims"), list):
+        output["Claims"] = [claim for claim in map(extracted_claim, output["Claims"]) if claim is not None]
+    return output
+
+def is_claim_judgement(value) -> bool:
+    return (
+        isinstance(value, dict)
+        and all(isinstance(value.get(key), str) for key in ClaimJudgement.__annotations__)
+        and value["Judgement"].upper() in get_args(Verdict)
+    )
+
+class ClaimResult(TypedDict):
+    Claim: str
+    Judgement: ClaimJudgement
+    ModeratorResponse: Optional[ModeratorResponse]
+
 class FactChecker:
-    def __init__(self, model: str = "fact-checker-model:latest"):
+    def __init__(self, model: str = FACT_CHECKER_MODEL, use_cache: bool = True, max_workers: int = 4,
+                 judge_batch_size: int = 1, evidence: EvidenceLookup = None, dedup_cache: ClaimCache = None,
+                 dedup: bool = True, structured: bool = False):
         self.model = model
+        # identical task + prompt pairs are answered from the shared response cache
+        self.use_cache = use_cache
+        # how many claims are judged at the same time
+        self.max_workers = max_workers
+        # how many claims are judged in one model call (1 judges every claim on its own)
+        self.judge_batch_size = judge_batch_size
+        # previous fact checks given to the model with each claim (local index first, Google Fact Check as fallback)
+        self.evidence = evidence or evidence_lookup
+        # judgements of equivalent claims that were judged before are reused, unless dedup is False
+        self.claim_cache = (dedup_cache or claim_cache) if dedup else None
+        # constrain the output of every task to its JSON schema, instead of asking for JSON in free text
+        self.structured = structured
+
+        # round trips and tokens per judging path, to compare batched with per-claim judging
+        self.metrics = {}
+        # outputs that did not match the schema and the tokens spent on them, per output mode
+        self.parse_metrics = {}
+        self._metrics_lock = threading.Lock()
+
+    def _record(self, metric_key: str, response, claims: int) -> None:
+        with self._metrics_lock:
+            metrics = self.metrics.setdefault(
+                metric_key, {"round_trips": 0, "claims": 0, "prompt_tokens": 0, "eval_tokens": 0,
+                             "cache_hits": 0, "cached_claims": 0}
+            )
+            # a response from the response cache cost no model call, its recorded tokens were spent earlier
+            if response_cache.last_was_hit():
+                metrics["cache_hits"] += 1
+                metrics["cached_claims"] += claims
+                return
+            metrics["round_trips"] += 1
+            metrics["claims"] += claims
+            metrics["prompt_tokens"] += response.get("prompt_eval_count") or 0
+            metrics["eval_tokens"] += response.get("eval_count") or 0
+
+    def _record_parse(self, response, failed: bool) -> None:
+        with self._metrics_lock:
+            metrics = self.parse_metrics.setdefault(
+                "structured" if self.structured else "free_form",
+                {"calls": 0, "parse_failures": 0, "wasted_tokens": 0, "eval_tokens": 0}
+            )
+            # generated tokens of outputs that were thrown away
+            tokens = response.get("eval_count") or 0
+            metrics["calls"] += 1
+            metrics["eval_tokens"] += tokens
+            if failed:
+                metrics["parse_failures"] += 1
+                metrics["wasted_tokens"] += tokens
 
-    def _call_model(self, task_trigger: str, prompt: str) -> dict:
-        response: ChatResponse = chat(
+    def _call_model(self, task_trigger: str, prompt: str, metric_key: str = None, claims: int = 1,
+                    schema_key: str = None, validate: bool = True) -> dict:
+        """
+        Runs a task and validates the output against the schema of the task. An output that does not match is
+        regenerated up to MAX_RETRIES times, and ValueError is raised if none matches.
+
+        Args:
+            validate: False to only require JSON, for callers that validate the parts of the output themselves
+        """
+        schema = SCHEMAS[schema_key or task_trigger]
+        messages = [{
+            "role": "user",
+            "content": f"{task_trigger} {prompt}"
+        }]
+
+        errors = []
+        for attempt in range(MAX_RETRIES + 1):
+            response: ChatResponse = response_cache.chat(
+                ollama_pool,
+                model=self.model,
+                messages=messages,
+                format=schema if self.structured else None,
+                # a cached output that did not match would only be returned again
+                use_cache=self.use_cache and attempt == 0
+            )
+            self._record(metric_key or task_trigger, response, claims if attempt == 0 else 0)
+
+            try:
+                output = parse_output(response.message.content, schema)
+                errors = schema_errors(output, schema) if validate else []
+            except ValueError as e:
+                errors = [str(e)]
+            self._record_parse(response, failed=bool(errors))
+            if not errors:
+                return output
+            response_cache.forget(self.model, messages, format=schema if self.structured else None)
+
+        raise ValueError(f"{task_trigger} output does not match its schema: {'; '.join(errors)}")
+
+    def extract_claims(self, text: str) -> list:
+        claims = self._call_model("Extract:", text)
+        # some models wrap the claims in an object, e.g. {"Claims": [...]}
+        if isinstance(claims, dict):
+            claims = next((v for v in claims.values() if isinstance(v, list)), [claims])
+        return [claim for claim in claims if isinstance(claim, dict) and isinstance(claim.get("Claim"), str)]
+
+    def stream_claims(self, text: str) -> Iterator[str]:
+        """
+        Streams the Extract task and yields every claim as soon as the model has closed its object. The claims are
+        validated like those of extract_claims; if the output has no valid claim and does not match the schema
+        either, the claims of extract_claims are yielded, which regenerates the output.
+        """
+        schema = SCHEMAS["Extract:"]
+        messages = [{"role": "user", "content": f"Extract: {text}"}]
+        stream = JsonObjectStream()
+        content = []
+        seen = set()
+        for chunk in response_cache.chat_stream(
+            ollama_pool,
             model=self.model,
-            messages=[{
-                "role": "user",
-                "content": f"{task_trigger} {prompt}"
-            }]
+            messages=messages,
+            format=schema if self.structured else None,
+            use_cache=self.use_cache
+        ):
+            content.append(chunk.message.content or "")
+            objects = stream.feed(chunk.message.content or "")
+            if chunk.done:
+                self._record("Extract:", chunk, 0)
+                objects += stream.finish()
+            for claim in filter(None, map(extracted_claim, objects)):
+                if claim["Claim"] not in seen:
+                    seen.add(claim["Claim"])
+                    yield claim["Claim"]
+        if seen:
+            return
+
+        try:
+            errors = schema_errors(parse_output("".join(content), schema), schema)
+        except ValueError as e:
+            errors = [str(e)]
+        if errors:
+            response_cache.forget(self.model, messages, format=schema if self.structured else None)
+            yield from (claim["Claim"] for claim in self.extract_claims(text))
+
+    def cached_judgement(self, claim: str) -> Optional[dict]:
+        if self.claim_cache is None:
+            return None
+        judgement = self.claim_cache.get(claim, namespace=self.model, accept=is_claim_judgement)
+        return {**judgement, "Claim": claim} if judgement is not None else None
+
+    def cache_judgement(self, claim: str, judgement: dict, seconds: float) -> None:
+        if self.claim_cache is not None and is_claim_judgement(judgement):
+            self.claim_cache.put(claim, judgement, seconds, namespace=self.model)
+
+    def judge_claim(self, claim: str, metric_key: str = "per_claim") -> dict:
+        # Reuse the judgement of an equivalent claim
+        judgement = self.cached_judgement(claim)
+        if judgement is not None:
+            return judgement
+
+        start = time.perf_counter()
+        # Use previous fact checks of the claim if there are any
+        evidence = self.evidence.lookup(claim)
+
+        # A fact check of the same claim with a plain rating settles it, otherwise the model judges the claim,
+        # based on its training data if there is no evidence
+        judgement = confident_verdict(claim, evidence) or self._call_model(
+            "Judge:", claim + format_evidence(evidence), metric_key=metric_key
         )
+        self.cache_judgement(claim, judgement, time.perf_counter() - start)
+        return judgement
 
-        return extract_json(response.message.content)
+    def judge_claims(self, claims: list) -> list:
+        """
+        Judges several claims in one model call, so the system prompt is only processed once for all of them.
+        Claims whose judgement is missing or malformed in the output are judged again on their own.
+        """
+        # claims judged before or settled by a fact check of the same claim are left out of the model call
+        cached = {
+            claim: self.cached_judgement(claim) or confident_verdict(claim, self.evidence.lookup(claim))
+            for claim in claims
+        }
+        uncached = [claim for claim in claims if cached[claim] is None]
+        if not uncached:
+            return [cached[claim] for claim in claims]
+        judgements = dict(zip(uncached, self._judge_uncached(uncached)))
+        return [cached[claim] or judgements[claim] for claim in claims]
 
-    def extract_claims(self, text: str) -> dict:
-        return self._call_model("Extract:", text)
+    def _judge_uncached(self, claims: list) -> list:
+        start = time.perf_counter()
+        items = []
+        for claim in claims:
+            evidence = self.evidence.lookup(claim)
+            items.append({"Claim": claim, "Evidence": format_evidence(evidence).strip()} if evidence else claim)
+        prompt = (
+            "Judge each of the following claims on its own. Answer with a JSON array that contains one object "
+            "with the keys Claim, Judgement and Explanation per claim, in the same order as the claims.\n"
+            + json.dumps(items, ensure_ascii=False)
+        )
+        try:
+            output = self._call_model("Judge:", prompt, metric_key="batched", claims=len(claims),
+                                      schema_key="Judge batch", validate=False)
+        except ValueError:
+            output = []
 
-    def judge_claim(self, claim: str) -> dict:
-        # Use Google Fact Checker if claim is political
-        google_result = google_fact_check(claim)
+        # some models wrap the array in an object, e.g. {"Judgements": [...]}
+        if isinstance(output, dict):
+            output = next((v for v in output.values() if isinstance(v, list)), [output])
+        valid = [j for j in output if is_claim_judgement(j)]
 
-        # If no return or other type of claim, judge based on training data
+        # split the output back per claim: by position if nothing is missing, by claim text otherwise
+        if len(valid) == len(output) == len(claims):
+            by_claim = dict(zip(claims, valid))
+        else:
+            by_claim = {j["Claim"]: j for j in valid}
 
-        # If training data evaluated to unverifiable, execute web search
-        return self._call_model("Judge:", claim)
+        # the fallback calls count as round trips of the batched path, but the claims were already counted
+        judgements = [
+            by_claim.get(claim) or self._call_model(
+                "Judge:", claim + format_evidence(self.evidence.lookup(claim)), metric_key="batched", claims=0
+            )
+            for claim in claims
+        ]
+        # the claims of a batch share the time of the call
+        seconds = (time.perf_counter() - start) / len(claims)
+        for claim, judgement in zip(claims, judgements):
+            self.cache_judgement(claim, judgement, seconds)
+        return judgements
 
-    def generate_response(self, judgement: ClaimJudgement) -> dict:
-        pass # make sure true and unverifiable claims are dropped before feeding to the model since they're not needed
+    def generate_response(self, judgement: ClaimJudgement) -> Optional[dict]:
+        # true and unverifiable claims are dropped before feeding to the model since they're not needed
+        if str(judgement.get("Judgement", "")).upper() != "FALSE":
+            return None
 
         return self._call_model("Generate:", json.dumps(judgement))
 
-def handle_persona_output(text: str, fact_checker: FactChecker):
-    claims = fact_checker.extract_claims(text)
+    def check_claim(self, claim: str) -> ClaimResult:
+        judgement = self.judge_claim(claim)
+        return {
+            "Claim": claim,
+            "Judgement": judgement,
+            "ModeratorResponse": self.generate_response(judgement)
+        }
+
+    def check_claim_batch(self, claims: list) -> list:
+        return [
+            {
+                "Claim": claim,
+                "Judgement": judgement,
+                "ModeratorResponse": self.generate_response(judgement)
+            }
+            for claim, judgement in zip(claims, self.judge_claims(claims))
+        ]
+
+    def check_claims(self, claims: Iterable[str]) -> Iterator[tuple]:
+        """
+        Judges the claims concurrently, at most max_workers at a time, and generates a response for the false ones.
+        With judge_batch_size > 1, each worker judges a batch of claims in one model call.
+
+        Args:
+            claims: A list, or a generator such as stream_claims; every claim is submitted as soon as it arrives,
+                from a separate thread, so results are yielded while the generator is still producing claims
+
+        Yields:
+            (index of the claim, ClaimResult) in the order the claims finish
+        """
+        finished = queue.Queue()  # (index of the first claim, future) as they finish, None once all are submitted
+        submitted = 0
+        errors = []
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            def submit(task, arg, index):
+                nonlocal submitted
+                pool.submit(task, arg).add_done_callback(lambda future: finished.put((index, future)))
+                submitted += 1
 
-    judgements = []
-    for claim in claims:
-        judgement = fact_checker.judge_claim(claim["Claim"])
-        judgements.append(judgement)
+            def feed():
+                try:
+                    if self.judge_batch_size > 1:
+                        batch = []
+                        for index, claim in enumerate(claims):
+                            batch.append(claim)
+                            if len(batch) == self.judge_batch_size:
+                                submit(self.check_claim_batch, batch, index + 1 - len(batch))
+                                batch = []
+                        if batch:
+                            submit(self.check_claim_batch, batch, index + 1 - len(batch))
+                    else:
+                        for index, claim in enumerate(claims):
+                            submit(self.check_claim, claim, index)
+                except Exception as e:
+                    errors.append(e)
+                finally:
+                    finished.put(None)
 
-    moderator_responses = []
-    for j in judgements:
-        response = fact_checker.generate_response(j)
-        if response:
-            moderator_responses.append(response)
+            threading.Thread(target=feed, daemon=True).start()
+            done = 0
+            all_submitted = False
+            while not all_submitted or done < submitted:
+                item = finished.get()
+                if item is None:
+                    all_submitted = True
+                    continue
+                index, future = item
+                done += 1
+                if self.judge_batch_size > 1:
+                    for offset, result in enumerate(future.result()):
+                        yield index + offset, result
+                else:
+                    yield index, future.result()
 
+        # e.g. the extraction stream failed, the claims extracted until then have been yielded
+        if errors:
+            raise errors[0]
+
+    def parse_report(self) -> dict:
+        """Outputs that did not match their schema and the tokens spent on them, structured vs. free-form."""
+        return {
+            mode: {
+                **metrics,
+                "failure_rate": metrics["parse_failures"] / metrics["calls"] if metrics["calls"] else 0.0,
+                "wasted_token_share": metrics["wasted_tokens"] / max(metrics["eval_tokens"], 1)
+            }
+            for mode, metrics in self.parse_metrics.items()
+        }
+
+    def judge_metrics(self) -> dict:
+        """Round trips and tokens per claim for the per-claim and the batched judging path."""
+        report = {}
+        for key in ("per_claim", "batched"):
+            metrics = self.metrics.get(key)
+            if not metrics or not metrics["claims"]:
+                continue
+            report[key] = {
+                **metrics,
+                "round_trips_per_claim": metrics["round_trips"] / metrics["claims"],
+                "tokens_per_claim": (metrics["prompt_tokens"] + metrics["eval_tokens"]) / metrics["claims"]
+            }
+        return report
+
+def handle_persona_output(text: str, fact_checker: FactChecker, on_result=None, stream: bool = True):
+    """
+    Args:
+        on_result: Called with every ClaimResult as soon as its claim is checked
+        stream: Start judging every claim as soon as it is extracted, instead of waiting for all of them
+    """
+    if stream:
+        claims = fact_checker.stream_claims(text)
+    else:
+        claims = [claim["Claim"] for claim in fact_checker.extract_claims(text)]
+
+    results = {}
+    for index, result in fact_checker.check_claims(claims):
+        results[index] = result
+        if on_result:
+            on_result(result)
+
+    # judgements and responses are returned in the order of the claims
+    results = [results[index] for index in sorted(results)]
     return {
-        "judgements": judgements,
-        "moderator_responses": moderator_responses
+        "judgements": [r["Judgement"] for r in results],
+        "moderator_responses": [r["ModeratorResponse"] for r in results if r["ModeratorResponse"]]
     }
 
 def main():
@@ -86,7 +534,11 @@ def main():
         "and it eliminated U.S. fossil fuel production."
     )
 
-    result = handle_persona_output(political_output, fact_checker)
+    result = handle_persona_output(
+        political_output,
+        fact_checker,
+        on_result=lambda r: print(f"{r['Judgement'].get('Judgement')}: {r['Claim']}")
+    )
 
     print(json.dumps(result, indent=2))
 
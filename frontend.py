@@ -1,9 +1,57 @@
+import asyncio
+import os
+import time
+
 import chainlit as cl
 from chainlit.input_widget import Select
-import ollama
 
-# Initialize the async client
-client = ollama.AsyncClient()
+from claim_cache import claim_cache
+from fact_check_stream import FactCheckStreamParser, SentenceChunker, has_corrections
+from fact_checker_persona import FACT_CHECKER_MODEL
+from model_residency import ModelResidencyManager
+from ollama_pool import AsyncOllamaPool
+from scheduler import BACKGROUND, FACT_CHECK, PERSONA, SchedulerBusy, scheduler
+from transcript_window import SUMMARY_MODEL, TranscriptWindow
+from turn_tracing import tracer
+
+# Async client over all configured Ollama hosts
+client = AsyncOllamaPool()
+
+# The scheduler hands out the generation slots, so its queues are exported with the turn metrics
+tracer.collectors.append(scheduler.metrics)
+tracer.collectors.append(client.metrics)
+
+# Decides per model how long Ollama keeps it loaded, shared by all sessions since they share the host
+residency = ModelResidencyManager()
+
+# Minimum time between two sidebar refreshes while the fact check is streaming
+SIDEBAR_REFRESH_S = 0.25
+
+# In pipelined mode, the persona streams are sent to the fact checker in chunks of this many sentences
+PIPELINE_CHUNK_SENTENCES = int(os.environ.get("POLITIKAI_PIPELINE_CHUNK_SENTENCES", 2))
+
+# Claim cache namespace of the fact checks of whole turns and chunks, which are only reused for the same text:
+# two long answers saying different things can still have similar embeddings
+FACT_CHECK_NAMESPACE = f"{FACT_CHECKER_MODEL} turns"
+
+
+def agents_for(persona_choice):
+    agents = []
+    if persona_choice in ["Democrat", "Both"]:
+        agents.append({"name": "Democrat", "model": "dem-model:latest"})
+    if persona_choice in ["Republican", "Both"]:
+        agents.append({"name": "Republican", "model": "rep-model:latest"})
+    return agents
+
+
+def prewarm(settings):
+    # Load the selected personas and the fact checker in the background so the first turn skips the cold load
+    models = [agent["model"] for agent in agents_for(settings.get("Persona"))] + [FACT_CHECKER_MODEL]
+    # the loads wait for background slots, so they do not hold up the first requests of other sessions
+    session_id = cl.user_session.get("id")
+    asyncio.create_task(residency.prewarm(
+        client, models, slot=lambda model: scheduler.slot(model, session_id, BACKGROUND)
+    ))
 
 
 @cl.on_chat_start
@@ -14,6 +62,9 @@ async def start():
 
     # Initialize the transcript and settings
     cl.user_session.set("transcript", [])
+    # Only a token-budgeted window of the transcript is sent to the personas
+    cl.user_session.set("transcript_window", TranscriptWindow())
+    cl.user_session.set("prompt_tokens_saved", [])
 
     settings = await cl.ChatSettings([
         Select(
@@ -21,116 +72,379 @@ async def start():
             label="Who should answer?",
             values=["Republican", "Democrat", "Both"],
             initial_index=2
+        ),
+        Select(
+            id="Execution",
+            label="How should both personas answer?",
+            values=["Concurrent", "Sequential"],
+            initial_index=0
+        ),
+        Select(
+            id="FactCheck",
+            label="How should the fact check be shown?",
+            values=["Streaming", "Blocking", "Pipelined"],
+            initial_index=0
         )
     ]).send()
     cl.user_session.set("settings", settings)
+    prewarm(settings)
 
     await cl.Message(content="Welcome to Politikai! History is being recorded.").send()
 
+async def run_agent(agent, context, agent_msg, trace, pipeline=None):
+    """
+    Stream one persona's answer into its message. Returns the full response, or None on error.
+    If a FactCheckPipeline is given, the tokens are also passed on to it.
+    """
+    full_response = ""
+    try:
+        with trace.call(agent["name"], agent["model"]) as span:
+            async with scheduler.slot(agent["model"], cl.user_session.get("id"), PERSONA):
+                span.sent()
+                stream = await client.chat(
+                    model=agent["model"],
+                    messages=context,
+                    stream=True,
+                    keep_alive=residency.keep_alive_for(agent["model"])
+                )
+
+                async for chunk in stream:
+                    token = chunk.get('message', {}).get('content', '')
+                    if token:
+                        span.token()
+                        full_response += token
+                        await agent_msg.stream_token(token)
+                        if pipeline:
+                            pipeline.feed(agent["name"], token)
+                    if chunk.get('done'):
+                        residency.record_response(agent["model"], chunk)
+                        span.done(chunk)
+
+        if pipeline:
+            pipeline.flush(agent["name"])
+
+        # Update message with final content
+        if not full_response:
+            agent_msg.content = "*Chose to remain silent.*"
+        await agent_msg.update()
+
+        return full_response
+
+    except Exception as e:
+        await cl.Message(content=f"Error with {agent['name']}: {str(e)}", author="System").send()
+        return None
+
+async def show_fact_check(element, content):
+    element.content = content
+    # Use ElementSidebar instead of display="side"
+    await cl.ElementSidebar.set_elements([element])
+
+def fact_check_prompt(statements):
+    # Create a condensed prompt of only what was just said
+    return (f"Analyze the following debate statement or statements for factual accuracy and logical "
+            f"fallacies. Be objective and brief:\n\n{statements}")
+
+async def run_fact_checker(current_turn_responses, trace, streaming=True):
+    await cl.ElementSidebar.set_title("Fact Check Analysis")
+    element = cl.Text(name="Fact Checker", content="")
+    parser = FactCheckStreamParser()
+
+    await show_fact_check(element, "*Checking the claims...*")
+
+    # a turn that repeats an earlier one is not checked again
+    statements = "\n\n".join(current_turn_responses)
+    cached = claim_cache.get(statements, FACT_CHECK_NAMESPACE, semantic=False)
+    if cached is not None:
+        with trace.call("Fact Checker", FACT_CHECKER_MODEL) as span:
+            span.cached = True
+        await show_fact_check(element, cached)
+        return
+
+    start = time.perf_counter()
+    try:
+        # Use client.chat() instead of client.generate()
+        # The fact checker gets NO conversation history (stateless)
+        with trace.call("Fact Checker", FACT_CHECKER_MODEL) as span:
+            async with scheduler.slot(FACT_CHECKER_MODEL, cl.user_session.get("id"), FACT_CHECK):
+                span.sent()
+                response = await client.chat(
+                    model=FACT_CHECKER_MODEL,
+                    messages=[{"role": "user", "content": fact_check_prompt(current_turn_responses)}],
+                    stream=streaming,
+                    keep_alive=residency.keep_alive_for(FACT_CHECKER_MODEL)
+                )
+
+                if streaming:
+                    last_refresh = 0.0
+                    async for chunk in response:
+                        span.token()
+                        with span.timed("parse"):
+                            partial = parser.feed(chunk.get('message', {}).get('content', ''))
+                        # Re-sending the element on every token floods the socket, so refresh at a fixed rate
+                        if partial and time.monotonic() - last_refresh >= SIDEBAR_REFRESH_S:
+                            await show_fact_check(element, partial)
+                            last_refresh = time.monotonic()
+                        if chunk.get('done'):
+                            residency.record_response(FACT_CHECKER_MODEL, chunk)
+                            span.done(chunk)
+                else:
+                    with span.timed("parse"):
+                        parser.feed(response['message']['content'])
+                    residency.record_response(FACT_CHECKER_MODEL, response)
+                    span.done(response)
+
+            with span.timed("parse"):
+                verdict = parser.finish()
+
+        # Falls back to the whole output if the model never wrote the FACT CHECKER RESPONSE heading
+        await show_fact_check(element, verdict or "*The fact checker returned no response.*")
+        if verdict:
+            claim_cache.put(statements, verdict, time.perf_counter() - start, FACT_CHECK_NAMESPACE, semantic=False)
+
+    except Exception as e:
+        print(f"Fact Checker Error: {e}")
+        await show_fact_check(element, f"*Fact check failed: {e}*")
+
+class FactCheckPipeline:
+    """
+    Fact-checks the persona streams while they are still being generated.
+
+    Each persona stream is cut into chunks of whole sentences, and every chunk is fact-checked on its own as soon
+    as it is complete. The verdicts are merged into the sidebar, grouped by persona in the order of the agents.
+    """
+
+    def __init__(self, agent_names, trace, sentences_per_chunk=PIPELINE_CHUNK_SENTENCES):
+        self.agent_names = agent_names
+        self.trace = trace
+        self.sentences_per_chunk = sentences_per_chunk
+        self.chunkers = {}
+        self.verdicts = {name: [] for name in agent_names}  # agent -> verdict per chunk, None while pending
+        self.tasks = []
+        self.cancelled = False
+        self.element = cl.Text(name="Fact Checker", content="")
+
+    async def start(self):
+        await cl.ElementSidebar.set_title("Fact Check Analysis")
+        await show_fact_check(self.element, "*Checking the claims...*")
+
+    def feed(self, agent_name, token):
+        chunker = self.chunkers.setdefault(agent_name, SentenceChunker(self.sentences_per_chunk))
+        for chunk in chunker.feed(token):
+            self._submit(agent_name, chunk)
+
+    def flush(self, agent_name):
+        if agent_name in self.chunkers:
+            rest = self.chunkers[agent_name].flush()
+            if rest:
+                self._submit(agent_name, rest)
+
+    def _submit(self, agent_name, chunk):
+        if self.cancelled:
+            return
+        index = len(self.verdicts[agent_name])
+        self.verdicts[agent_name].append(None)
+        self.tasks.append(asyncio.create_task(self._check(agent_name, index, chunk)))
+
+    async def _check(self, agent_name, index, chunk):
+        span = self.trace.call(f"Fact Checker ({agent_name})", FACT_CHECKER_MODEL)
+
+        # the personas repeat themselves, a statement checked in an earlier turn is not checked again
+        cached = claim_cache.get(chunk, FACT_CHECK_NAMESPACE, semantic=False)
+        if cached is not None:
+            span.cached = True
+            with span:
+                self.verdicts[agent_name][index] = cached
+            await self._render()
+            return
+
+        parser = FactCheckStreamParser()
+        start = time.perf_counter()
+        try:
+            with span:
+                async with scheduler.slot(FACT_CHECKER_MODEL, cl.user_session.get("id"), FACT_CHECK):
+                    span.sent()
+                    response = await client.chat(
+                        model=FACT_CHECKER_MODEL,
+                        messages=[{"role": "user", "content": fact_check_prompt([chunk])}],
+                        stream=False,
+                        keep_alive=residency.keep_alive_for(FACT_CHECKER_MODEL)
+                    )
+                residency.record_response(FACT_CHECKER_MODEL, response)
+                span.done(response)
+                with span.timed("parse"):
+                    parser.feed(response['message']['content'])
+                    self.verdicts[agent_name][index] = parser.finish()
+            claim_cache.put(
+                chunk, self.verdicts[agent_name][index], time.perf_counter() - start, FACT_CHECK_NAMESPACE,
+                semantic=False
+            )
+        except Exception as e:
+            print(f"Fact Checker Error: {e}")
+            self.verdicts[agent_name][index] = f"*Fact check failed: {e}*"
+        await self._render()
+
+    async def _render(self):
+        if self.cancelled:
+            return
+
+        sections = []
+        pending = 0
+        for name in self.agent_names:
+            pending += self.verdicts[name].count(None)
+            corrections = [v for v in self.verdicts[name] if v and has_corrections(v)]
+            if corrections:
+                sections.append(f"**{name}:** " + "\n\n".join(corrections))
+
+        if pending:
+            sections.append(f"*Checking {pending} more statement(s)...*")
+        elif not sections:
+            sections.append("No false claims in the text.")
+        await show_fact_check(self.element, "\n\n".join(sections))
+
+    async def finish(self):
+        """Wait for all chunks to be checked."""
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        await self._render()
+
+    def cancel(self):
+        self.cancelled = True
+        for task in self.tasks:
+            task.cancel()
+
 @cl.on_message
 async def main(message: cl.Message):
+    # A new message makes the fact checks still running for the previous turn pointless
+    previous_pipeline = cl.user_session.get("fact_check_pipeline")
+    if previous_pipeline:
+        previous_pipeline.cancel()
+
     # Clear the sidebar from the previous turn
     await cl.ElementSidebar.set_elements([])
 
+    # Too many requests are already waiting for the Ollama host, answering now would only make everyone wait longer
+    if scheduler.busy():
+        await cl.Message(content=f"Sorry, {SchedulerBusy()}.", author="System").send()
+        return
+
     transcript = cl.user_session.get("transcript")
+    window = cl.user_session.get("transcript_window")
     settings = cl.user_session.get("settings")
     persona_choice = settings.get("Persona")
+    execution_mode = settings.get("Execution", "Concurrent")
+    fact_check_mode = settings.get("FactCheck", "Streaming")
+
+    # Where the time of this turn goes, exported when the turn is done
+    trace = tracer.turn(cl.user_session.get("id"), settings)
 
     # 1. Add user message to history
     transcript.append({"role": "user", "content": message.content})
 
-    agents_to_run = []
-    if persona_choice in ["Democrat", "Both"]:
-        agents_to_run.append({"name": "Democrat", "model": "dem-model:latest"})
-    if persona_choice in ["Republican", "Both"]:
-        agents_to_run.append({"name": "Republican", "model": "rep-model:latest"})
+    agents_to_run = agents_for(persona_choice)
+
+    # In pipelined mode the fact checker starts on the first sentences while the personas are still generating
+    pipeline = None
+    if fact_check_mode == "Pipelined":
+        pipeline = FactCheckPipeline([agent["name"] for agent in agents_to_run], trace)
+        cl.user_session.set("fact_check_pipeline", pipeline)
+        await pipeline.start()
 
     # Store the current turn's responses here to pass to the Fact Checker
     current_turn_responses = []
 
-    # 2. Sequential execution of models
-    for i, agent in enumerate(agents_to_run):
-        # The author parameter will automatically use the matching avatar
-        # from public/avatars/{author}.png
-        agent_msg = cl.Message(content=f"{agent['name']}: ", author=agent["name"])
-        await agent_msg.send()
-
-        # If this is NOT the first agent, nudge the model
-        current_context = list(transcript)
-        if i > 0:
-            current_context.append({
-                "role": "user",
-                "content": message.content,
-            })
-
-        full_response = ""
-        try:
-            stream = await client.chat(
-                model=agent["model"],
-                messages=current_context,
-                stream=True,
-                keep_alive=0
-            )
+    # Prompt tokens each persona did not have to process thanks to the transcript window
+    turn_tokens_saved = {}
+
+    # The author parameter will automatically use the matching avatar
+    # from public/avatars/{author}.png
+    agent_msgs = [cl.Message(content=f"{agent['name']}: ", author=agent["name"]) for agent in agents_to_run]
+
+    # 2a. Concurrent execution: every persona answers the same transcript at the same time
+    if execution_mode == "Concurrent" and len(agents_to_run) > 1:
+        # Send the messages up front so they show up in a fixed order regardless of who finishes first
+        for agent_msg in agent_msgs:
+            await agent_msg.send()
 
-            async for chunk in stream:
-                token = chunk.get('message', {}).get('content', '')
-                if token:
-                    full_response += token
-                    await agent_msg.stream_token(token)
+        # No nudge needed here, every context already ends with the user's message
+        contexts = []
+        for agent in agents_to_run:
+            context, saved = window.build(transcript, agent["model"])
+            contexts.append(context)
+            turn_tokens_saved[agent["name"]] = saved
 
+        responses = await asyncio.gather(*[
+            run_agent(agent, context, agent_msg, trace, pipeline)
+            for agent, context, agent_msg in zip(agents_to_run, contexts, agent_msgs)
+        ])
+
+        # Save the responses in agent order, not completion order
+        for agent, full_response in zip(agents_to_run, responses):
+            if full_response is None:
+                continue
             # pass current response to fact-checker
             current_turn_responses.append(full_response)
+            transcript.append({"role": "assistant", "author": agent["name"], "content": full_response})
+
+    # 2b. Sequential execution of models
+    else:
+        for i, (agent, agent_msg) in enumerate(zip(agents_to_run, agent_msgs)):
+            await agent_msg.send()
+
+            # If this is NOT the first agent, nudge the model
+            nudge = None
+            if i > 0:
+                nudge = {
+                    "role": "user",
+                    "content": message.content,
+                }
+            current_context, turn_tokens_saved[agent["name"]] = window.build(transcript, agent["model"], nudge)
+
+            full_response = await run_agent(agent, current_context, agent_msg, trace, pipeline)
+            if full_response is None:
+                continue
 
-            # Update message with final content
-            if not full_response:
-                agent_msg.content = "*Chose to remain silent.*"
-            await agent_msg.update()
+            # pass current response to fact-checker
+            current_turn_responses.append(full_response)
 
             # Save the response to the transcript
             transcript.append({"role": "assistant", "author": agent["name"], "content": full_response})
 
-        except Exception as e:
-            await cl.Message(content=f"Error with {agent['name']}: {str(e)}", author="System").send()
-
     # 3. SIDE PANEL: Fact Checker (Stateless)
-    if current_turn_responses:
-        # Create a condensed prompt of only what was just said
-        fact_check_prompt = (f"Analyze the following debate statement or statements for factual accuracy and logical "
-                             f"fallacies. Be objective and brief:\n\n{current_turn_responses}")
-
-        try:
-            # Use client.chat() instead of client.generate()
-            # The fact checker gets NO conversation history (stateless)
-            response = await client.chat(
-                model='fact-checker:latest',
-                messages=[{"role": "user", "content": fact_check_prompt}],
-                stream=False,
-                keep_alive=0
-            )
+    if pipeline:
+        await pipeline.finish()
+    elif current_turn_responses:
+        await run_fact_checker(current_turn_responses, trace, streaming=fact_check_mode == "Streaming")
 
-            fact_check_content = response['message']['content']
-            separators = ["FACT CHECKER RESPONSE", "Fact Checker Response"]
-            if separators[0] in fact_check_content:
-                separator = separators[0]
-            else:
-                separator = separators[1]
-            fact_check_response = fact_check_content.split(separator, 1)[1][3:] # [3:] ignores ** at the beginning
-            fact_check_response = fact_check_response.replace('"','') # strip " from beginning and end of content
-
-            # Use ElementSidebar instead of display="side"
-            await cl.ElementSidebar.set_title("Fact Check Analysis")
-            await cl.ElementSidebar.set_elements([
-                cl.Text(
-                    name="Fact Checker",
-                    content=fact_check_response
-                )
-            ])
+    cl.user_session.set("transcript", transcript)
+    cl.user_session.get("prompt_tokens_saved").append(turn_tokens_saved)
+    trace.prompt_tokens_saved = turn_tokens_saved
+    trace.finish()
 
-        except Exception as e:
-            print(f"Fact Checker Error: {e}")
+    # Write better summaries for the turns that will drop out of the window, off the critical path
+    if SUMMARY_MODEL:
+        asyncio.create_task(summarize_transcript(window, list(transcript)))
 
-    cl.user_session.set("transcript", transcript)
+async def summarize_transcript(window, transcript):
+    try:
+        async with scheduler.slot(SUMMARY_MODEL, cl.user_session.get("id"), BACKGROUND):
+            await window.summarize_with_model(client, transcript)
+    except SchedulerBusy:
+        pass
 
 @cl.on_settings_update
 async def setup_agent(settings):
-    cl.user_session.set("settings", settings)
\ No newline at end of file
+    cl.user_session.set("settings", settings)
+    prewarm(settings)
+
+@cl.on_stop
+async def stop():
+    pipeline = cl.user_session.get("fact_check_pipeline")
+    if pipeline:
+        pipeline.cancel()
+
+@cl.on_chat_end
+async def end():
+    print(f"[residency] cold loads per model: {residency.stats()}")
+    print(f"[claim cache] {claim_cache.stats()}")
+    print(f"[tracing] mean seconds per span: {tracer.stats()}")
+    print(f"[scheduler] {scheduler.stats()}")
+    print(f"[pool] {client.stats()}")
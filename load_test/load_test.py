@@ -0,0 +1,282 @@
+"""
+Headless load test of the chat path of frontend.py.
+
+Simulates N Chainlit sessions that each send a few of the prompts from evaluation_prompts.json, calling the
+on_chat_start and on_message handlers directly, with the Chainlit UI objects replaced by recorders. The
+sessions run in one event loop against the mock Ollama server in mock_ollama.py (started as a subprocess) or any
+other server given with --ollama-host, exactly like real sessions share the module-level AsyncClient.
+
+Reported per turn, as mean and percentiles:
+- turn latency: from the user message until on_message returns
+- time to first token per persona: from the user message until the persona's first token is shown
+- sidebar latency: until the first fact-check content and until the final one is shown, and the time the user
+  waits for the final fact check after the last persona has finished
+- event-loop lag: how late a timer firing every LAG_INTERVAL_S is, i.e. how long the loop was blocked
+
+Example:
+    python load_test/load_test.py --sessions 8 --turns 3 --tokens-per-second 30 --latency 0.5
+"""
+
+import argparse
+import asyncio
+import contextlib
+import contextvars
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import types
+from pathlib import Path
+
+from mock_ollama import add_arguments, mock_arguments
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT))
+from percentiles import percentile
+
+PROMPTS_PATH = ROOT / "persona_construction" / "evaluation_prompts.json"
+
+MOCK_SERVER = Path(__file__).resolve().parent / "mock_ollama.py"
+
+LAG_INTERVAL_S = 0.05
+
+# Placeholder the sidebar shows before the fact check has produced anything
+SIDEBAR_PLACEHOLDER = "*Checking"
+
+
+def summary(values: list) -> dict:
+    return {
+        "n": len(values),
+        "mean": sum(values) / len(values) if values else 0,
+        "p50": percentile(values, 50),
+        "p90": percentile(values, 90),
+        "p99": percentile(values, 99),
+        "max": max(values, default=0),
+    }
+
+
+# The state of the simulated session the current task belongs to
+current_session = contextvars.ContextVar("current_session")
+
+
+class Session:
+    def __init__(self, session_id: str, settings: dict):
+        self.data = {"id": session_id}
+        self.settings = settings
+        self.turn = None  # timings of the running turn
+
+    def start_turn(self):
+        self.turn = {"start": time.perf_counter(), "first_token": {}, "persona_done": {}, "sidebar": []}
+        return self.turn
+
+
+# Recorders standing in for the Chainlit objects frontend.py uses
+
+class UserSession:
+    def get(self, key, default=None):
+        return current_session.get().data.get(key, default)
+
+    def set(self, key, value):
+        current_session.get().data[key] = value
+
+
+class Message:
+    def __init__(self, content="", author=None, **kwargs):
+        self.content = content
+        self.author = author
+
+    async def send(self):
+        return self
+
+    async def stream_token(self, token):
+        turn = current_session.get().turn
+        if turn is not None:
+            turn["first_token"].setdefault(self.author, time.perf_counter())
+        self.content += token
+
+    async def update(self):
+        turn = current_session.get().turn
+        if turn is not None and self.author:
+            turn["persona_done"][self.author] = time.perf_counter()
+
+
+class Text:
+    def __init__(self, name=None, content="", **kwargs):
+        self.name = name
+        self.content = content
+
+
+class ElementSidebar:
+    @staticmethod
+    async def set_title(title):
+        pass
+
+    @staticmethod
+    async def set_elements(elements, key=None):
+        turn = current_session.get().turn
+        contents = [getattr(e, "content", "") for e in elements]
+        if turn is not None and contents and contents[0] and not contents[0].startswith(SIDEBAR_PLACEHOLDER):
+            turn["sidebar"].append(time.perf_counter())
+
+
+class ChatSettings:
+    def __init__(self, inputs):
+        self.inputs = inputs
+
+    async def send(self):
+        settings = {i.id: i.values[i.initial_index] for i in self.inputs}
+        settings.update(current_session.get().settings)
+        return settings
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_mock_server(args) -> tuple:
+    port = free_port()
+    process = subprocess.Popen([sys.executable, str(MOCK_SERVER), "--port", str(port), *mock_arguments(args)])
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        with contextlib.suppress(OSError), socket.create_connection(("127.0.0.1", port), timeout=0.2):
+            return process, f"http://127.0.0.1:{port}"
+        time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("the mock Ollama server did not start")
+
+
+async def measure_loop_lag(lags: list, stop: asyncio.Event):
+    while not stop.is_set():
+        expected = time.perf_counter() + LAG_INTERVAL_S
+        await asyncio.sleep(LAG_INTERVAL_S)
+        lags.append(max(0.0, time.perf_counter() - expected))
+
+
+async def run_session(frontend, index: int, prompts: list, args, turns: list):
+    session = Session(f"session-{index}", {"Persona": args.persona, "Execution": args.execution, "FactCheck": args.fact_check})
+    current_session.set(session)
+
+    # spread the session starts over the ramp-up time
+    await asyncio.sleep(args.ramp * index / max(args.sessions - 1, 1))
+    await frontend.start()
+
+    for k in range(args.turns):
+        prompt = prompts[(index * args.turns + k) % len(prompts)]["prompt"]
+        turn = session.start_turn()
+        await frontend.main(types.SimpleNamespace(content=prompt))
+        turn["end"] = time.perf_counter()
+        turns.append(turn)
+
+    await frontend.end()
+
+
+def report(turns: list, lags: list, wall_time: float) -> dict:
+    results = {"turns": len(turns), "wall_time": wall_time, "turns_per_second": len(turns) / wall_time}
+    results["turn_latency"] = summary([t["end"] - t["start"] for t in turns])
+
+    personas = sorted({name for t in turns for name in t["first_token"]})
+    results["time_to_first_token"] = {
+        name: summary([t["first_token"][name] - t["start"] for t in turns if name in t["first_token"]])
+        for name in personas
+    }
+
+    with_sidebar = [t for t in turns if t["sidebar"]]
+    results["sidebar_first"] = summary([t["sidebar"][0] - t["start"] for t in with_sidebar])
+    results["sidebar_final"] = summary([t["sidebar"][-1] - t["start"] for t in with_sidebar])
+    results["sidebar_after_personas"] = summary([
+        t["sidebar"][-1] - max(t["persona_done"].values()) for t in with_sidebar if t["persona_done"]
+    ])
+    results["event_loop_lag"] = summary(lags)
+    return results
+
+
+def print_report(results: dict, args):
+    print("\n" + "=" * 78)
+    print(f"LOAD TEST: {args.sessions} sessions x {args.turns} turns, {args.persona} / {args.execution} / "
+          f"{args.fact_check}")
+    print("=" * 78)
+    print(f"{results['turns']} turns in {results['wall_time']:.1f}s ({results['turns_per_second']:.2f} turns/s)\n")
+    print(f"  {'seconds':<34}{'n':>5}{'mean':>8}{'p50':>8}{'p90':>8}{'p99':>8}{'max':>8}")
+
+    rows = [("turn latency", results["turn_latency"])]
+    rows += [(f"time to first token ({name})", s) for name, s in results["time_to_first_token"].items()]
+    rows += [
+        ("sidebar, first content", results["sidebar_first"]),
+        ("sidebar, final", results["sidebar_final"]),
+        ("sidebar, after the last persona", results["sidebar_after_personas"]),
+        ("event-loop lag", results["event_loop_lag"]),
+    ]
+    for label, s in rows:
+        print(f"  {label:<34}{s['n']:>5}{s['mean']:>8.3f}{s['p50']:>8.3f}{s['p90']:>8.3f}{s['p99']:>8.3f}"
+              f"{s['max']:>8.3f}")
+    print("=" * 78)
+
+
+async def run(args, frontend):
+    with open(args.prompts, "r", encoding="utf-8") as f:
+        prompts = json.load(f)
+
+    turns = []
+    lags = []
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(measure_loop_lag(lags, stop))
+
+    start = time.perf_counter()
+    output = open(os.devnull, "w") if args.quiet else sys.stdout
+    with contextlib.redirect_stdout(output):
+        await asyncio.gather(*[
+            asyncio.create_task(run_session(frontend, i, prompts, args, turns))
+            for i in range(args.sessions)
+        ])
+    wall_time = time.perf_counter() - start
+
+    stop.set()
+    await lag_task
+    return report(turns, lags, wall_time)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test of the frontend chat path against a mock Ollama.")
+    parser.add_argument("--sessions", type=int, default=4, help="number of simulated chat sessions")
+    parser.add_argument("--turns", type=int, default=3, help="messages sent per session")
+    parser.add_argument("--ramp", type=float, default=0.0, help="seconds over which the sessions start")
+    parser.add_argument("--persona", default="Both", choices=["Republican", "Democrat", "Both"])
+    parser.add_argument("--execution", default="Concurrent", choices=["Concurrent", "Sequential"])
+    parser.add_argument("--fact-check", default="Streaming", choices=["Streaming", "Blocking", "Pipelined"])
+    parser.add_argument("--prompts", default=str(PROMPTS_PATH), help="JSON list of objects with a prompt key")
+    add_arguments(parser.add_argument_group("mock Ollama server"))
+    parser.add_argument("--ollama-host", help="use this server instead of starting the mock")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--verbose", dest="quiet", action="store_false", help="show the output of frontend.py")
+    args = parser.parse_args()
+
+    process = None
+    host = args.ollama_host
+    if not host:
+        process, host = start_mock_server(args)
+
+    try:
+        # the Ollama clients read the host when they are created, i.e. when frontend.py is imported
+        os.environ["OLLAMA_HOST"] = host
+        import chainlit as cl
+        cl.Message, cl.Text, cl.ElementSidebar, cl.ChatSettings = Message, Text, ElementSidebar, ChatSettings
+        cl.user_session = UserSession()
+        import frontend
+
+        results = asyncio.run(run(args, frontend))
+    finally:
+        if process:
+            process.terminate()
+
+    print_report(results, args)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
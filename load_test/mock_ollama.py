@@ -0,0 +1,449 @@
+"""
+Stand-in for the Ollama server, for benchmarks and tests that should run without a GPU or a pulled model.
+
+Implements the part of the Ollama API this project uses:
+- /api/chat, streaming and not, including the token counts and durations of the final chunk
+- /api/create, which registers the model with its system prompt and parameters (nothing is downloaded)
+- /api/ps, /api/tags, /api/show and /api/embed, with just enough for the app, the response cache and the
+  claim cache
+
+Timing is modelled on a single-GPU host:
+- at most NUM_PARALLEL requests are processed at the same time, the others wait in a queue
+- a model that is not loaded takes LOAD_DELAY_S to load, at most MAX_LOADED_MODELS stay loaded and they are
+  unloaded after their keep_alive, like Ollama does
+- the prompt is processed at PROMPT_TOKENS_PER_SECOND after a fixed LATENCY_S (with JITTER), the answer is
+  generated at TOKENS_PER_SECOND
+
+Answers are replayed from recorded runs if any are given with --replay, e.g. the eval_results_v*.jsonl files of
+the persona evaluation and fact_checker_results.json of the fact-checker evaluation: a recorded prompt gets its
+recorded answer, any other prompt a recorded answer of the same kind of model (picked by a hash of the request),
+so runs are reproducible. Without recordings, the answers are made up. Requests with a JSON schema as format and
+the Extract:/Judge:/Generate: tasks of fact_checker_persona.py get JSON answers.
+
+Run it on its own and point any entry point at it:
+    python load_test/mock_ollama.py --port 11435 --replay persona_construction/eval_results/eval_results_v3.3.jsonl
+    OLLAMA_HOST=http://127.0.0.1:11435 chainlit run frontend.py
+"""
+
+import argparse
+import asyncio
+import glob
+import hashlib
+import json
+import math
+import random
+import re
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# seconds until the prompt starts being processed
+LATENCY_S = 0.2
+
+# share by which LATENCY_S varies from request to request
+JITTER = 0.1
+
+PROMPT_TOKENS_PER_SECOND = 1000.0
+
+TOKENS_PER_SECOND = 40.0
+
+# seconds to load a model that is not loaded
+LOAD_DELAY_S = 2.0
+
+MAX_LOADED_MODELS = 3
+
+# requests processed at the same time, like OLLAMA_NUM_PARALLEL
+NUM_PARALLEL = 4
+
+# seconds a model stays loaded if the request does not say
+DEFAULT_KEEP_ALIVE_S = 300
+
+MODEL_SIZE_BYTES = 8 * 1024 ** 3
+
+# length of a made-up answer
+RESPONSE_TOKENS = 120
+
+EMBEDDING_SIZE = 64
+
+WORDS = (
+    "the economy healthcare voters policy families taxes border climate jobs wages reform congress states "
+    "budget energy security education prices workers communities federal plan support americans"
+).split()
+
+TASKS = ("Extract:", "Judge:", "Generate:")
+
+app = FastAPI()
+config = {
+    "latency_s": LATENCY_S,
+    "jitter": JITTER,
+    "prompt_tokens_per_second": PROMPT_TOKENS_PER_SECOND,
+    "tokens_per_second": TOKENS_PER_SECOND,
+    "load_delay_s": LOAD_DELAY_S,
+    "max_loaded_models": MAX_LOADED_MODELS,
+    "response_tokens": RESPONSE_TOKENS,
+}
+
+
+def model_kind(model: str) -> str:
+    """Which recordings a model answers from."""
+    name = model.lower()
+    if "fact" in name:
+        return "fact-checker"
+    if "dem" in name:
+        return "dem"
+    if "rep" in name:
+        return "rep"
+    return "other"
+
+
+def full_name(model: str) -> str:
+    return model if ":" in model else f"{model}:latest"
+
+
+def request_rng(model: str, messages: list) -> random.Random:
+    # the same request always gets the same answer
+    seed = hashlib.sha1(json.dumps([model, messages], sort_keys=True).encode("utf-8")).hexdigest()
+    return random.Random(seed)
+
+
+def made_up_text(rng: random.Random, tokens: int) -> str:
+    sentences = []
+    while sum(len(s.split()) for s in sentences) < tokens:
+        sentences.append(" ".join(rng.choices(WORDS, k=rng.randint(8, 16))).capitalize() + ".")
+    return " ".join(sentences)
+
+
+def value_for_schema(schema: dict, rng: random.Random):
+    """A made-up value that matches a JSON schema (objects, arrays, strings and enums)."""
+    kind = schema.get("type")
+    if kind == "object":
+        return {key: value_for_schema(sub, rng) for key, sub in schema.get("properties", {}).items()}
+    if kind == "array":
+        return [value_for_schema(schema.get("items", {}), rng) for _ in range(rng.randint(1, 3))]
+    if "enum" in schema:
+        return rng.choice(schema["enum"])
+    if kind in ("integer", "number"):
+        return rng.randint(0, 100)
+    if kind == "boolean":
+        return rng.random() < 0.5
+    return made_up_text(rng, 10)
+
+
+def task_answer(prompt: str, rng: random.Random) -> str:
+    """JSON answers for the tasks of fact_checker_persona.py."""
+    task, _, text = prompt.partition(" ")
+    if task == "Extract:":
+        sentences = [s for s in re.split(r"(?<=[.!?])\s+", text) if s.strip()] or [text]
+        return json.dumps([{"Claim": s, "Party": "UNK"} for s in sentences[:5]])
+    if task == "Judge:":
+        claims = [text.split("\n")[0]]
+        if "\n[" in text:
+            # several claims in one request, as a JSON list of claims or {"Claim": ..., "Evidence": ...}
+            with_evidence = json.loads(text[text.index("\n[") + 1:])
+            claims = [c["Claim"] if isinstance(c, dict) else c for c in with_evidence]
+        judgements = [
+            {
+                "Claim": c,
+                "Judgement": rng.choice(["TRUE", "FALSE", "UNVERIFIABLE"]),
+                "Explanation": made_up_text(rng, 15)
+            }
+            for c in claims
+        ]
+        return json.dumps(judgements if "\n[" in text else judgements[0])
+    return json.dumps({"Response": made_up_text(rng, 30)})
+
+
+class Recordings:
+    """Recorded answers per kind of model, by prompt."""
+
+    def __init__(self):
+        self.by_prompt = {}  # (kind, prompt) -> answer
+        self.by_kind = {}  # kind -> answers
+
+    def add(self, kind: str, prompt: str, answer: str):
+        if not answer:
+            return
+        self.by_prompt[(kind, prompt.strip())] = answer
+        self.by_kind.setdefault(kind, []).append(answer)
+
+    def load(self, path: str):
+        if path.endswith(".jsonl"):
+            # persona evaluation results: one prompt with the answer of both personas per line
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        self.add("dem", record["prompt"], record.get("dem_response"))
+                        self.add("rep", record["prompt"], record.get("rep_response"))
+        else:
+            # fact-checker evaluation results
+            with open(path, "r", encoding="utf-8") as f:
+                for result in json.load(f)["evaluation_results"]:
+                    self.add("fact-checker", result["claim"], result.get("response"))
+
+    def answer(self, model: str, prompt: str, rng: random.Random):
+        kind = model_kind(model)
+        if (kind, prompt.strip()) in self.by_prompt:
+            return self.by_prompt[(kind, prompt.strip())]
+        answers = self.by_kind.get(kind)
+        return rng.choice(answers) if answers else None
+
+
+def parse_keep_alive(keep_alive) -> float:
+    """keep_alive of a request in seconds, inf for never unloading."""
+    if keep_alive is None:
+        return DEFAULT_KEEP_ALIVE_S
+    if isinstance(keep_alive, str):
+        match = re.fullmatch(r"(-?[\d.]+)\s*([smh]?)", keep_alive.strip())
+        if not match:
+            return DEFAULT_KEEP_ALIVE_S
+        keep_alive = float(match.group(1)) * {"": 1, "s": 1, "m": 60, "h": 3600}[match.group(2)]
+    return math.inf if keep_alive < 0 else float(keep_alive)
+
+
+class Server:
+    def __init__(self):
+        self.created = {}  # model -> what /api/create was given
+        self.loaded = OrderedDict()  # model -> time it is unloaded, least recently used first
+        self.loading = {}  # model -> lock held while it loads
+        self.slots = asyncio.Semaphore(NUM_PARALLEL)
+        self.recordings = Recordings()
+        self.jitter_rng = random.Random(0)
+
+    def expire(self):
+        now = time.monotonic()
+        for model in [m for m, until in self.loaded.items() if until <= now]:
+            del self.loaded[model]
+
+    async def load(self, model: str) -> float:
+        """Loads the model if needed. Returns the seconds spent loading."""
+        lock = self.loading.setdefault(model, asyncio.Lock())
+        async with lock:
+            self.expire()
+            if model in self.loaded:
+                self.loaded.move_to_end(model)
+                return 0.0
+            await asyncio.sleep(config["load_delay_s"])
+            self.loaded[model] = math.inf  # set when the request is done
+            while len(self.loaded) > config["max_loaded_models"]:
+                self.loaded.popitem(last=False)
+            return config["load_delay_s"]
+
+    def release(self, model: str, keep_alive):
+        if model in self.loaded:
+            self.loaded[model] = time.monotonic() + parse_keep_alive(keep_alive)
+            self.expire()
+
+    def answer(self, model: str, messages: list, format) -> str:
+        rng = request_rng(model, messages)
+        prompt = messages[-1].get("content", "") if messages else ""
+        if isinstance(format, dict):
+            return json.dumps(value_for_schema(format, rng))
+        if prompt.startswith(TASKS):
+            return task_answer(prompt, rng)
+        answer = self.recordings.answer(model, prompt, rng) or made_up_text(rng, config["response_tokens"])
+        if format == "json":
+            return json.dumps({"response": answer})
+        if model_kind(model) == "fact-checker" and "fact checker response" not in answer.lower():
+            return f"FACT CHECKER RESPONSE:\n{answer}"
+        return answer
+
+
+server = Server()
+
+
+def split_tokens(text: str) -> list:
+    # one word with its trailing space per token, close enough to a tokenizer for timing
+    words = text.split(" ")
+    return [w + " " for w in words[:-1]] + [words[-1]]
+
+
+def now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def chunk(model: str, content: str, **fields) -> dict:
+    return {"model": model, "created_at": now(), "message": {"role": "assistant", "content": content},
+            "done": False, **fields}
+
+
+@app.post("/api/chat")
+async def chat(request: Request):
+    body = await request.json()
+    model = full_name(body.get("model", ""))
+    messages = body.get("messages") or []
+    keep_alive = body.get("keep_alive")
+    started = time.perf_counter()
+
+    # an empty chat only loads (or with keep_alive 0 unloads) the model, like the prewarm of the app
+    if not messages:
+        async with server.slots:
+            load_seconds = await server.load(model)
+        server.release(model, keep_alive)
+        return JSONResponse(chunk(model, "", done=True, done_reason="load", load_duration=int(load_seconds * 1e9)))
+
+    text = server.answer(model, messages, body.get("format"))
+    tokens = split_tokens(text)
+    prompt_tokens = sum(len(m.get("content", "")) // 4 + 1 for m in messages)
+    interval = 1 / config["tokens_per_second"]
+
+    async def generate():
+        # yields the tokens as they are generated, then the final chunk
+        async with server.slots:
+            load_seconds = await server.load(model)
+            prompt_started = time.perf_counter()
+            latency = config["latency_s"] * (1 + server.jitter_rng.uniform(-config["jitter"], config["jitter"]))
+            await asyncio.sleep(latency + prompt_tokens / config["prompt_tokens_per_second"])
+            first_token = time.perf_counter()
+            for token in tokens:
+                yield token
+                await asyncio.sleep(interval)
+        server.release(model, keep_alive)
+        ended = time.perf_counter()
+        yield {
+            "done": True,
+            "done_reason": "stop",
+            "total_duration": int((ended - started) * 1e9),
+            "load_duration": int(load_seconds * 1e9),
+            "prompt_eval_count": prompt_tokens,
+            "prompt_eval_duration": int((first_token - prompt_started) * 1e9),
+            "eval_count": len(tokens),
+            "eval_duration": int((ended - first_token) * 1e9),
+        }
+
+    if not body.get("stream", True):
+        async for part in generate():
+            if isinstance(part, dict):
+                return JSONResponse(chunk(model, text, **part))
+
+    async def stream():
+        async for part in generate():
+            if isinstance(part, dict):
+                yield json.dumps(chunk(model, "", **part)) + "\n"
+            else:
+                yield json.dumps(chunk(model, part)) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+@app.post("/api/create")
+async def create(request: Request):
+    body = await request.json()
+    model = full_name(body.get("model", ""))
+    server.created[model] = {
+        "from": body.get("from"),
+        "system": body.get("system") or "",
+        "parameters": body.get("parameters") or {},
+        "template": body.get("template") or "",
+        "modified_at": now(),
+    }
+    statuses = ["reading model metadata", "creating system layer", "writing manifest", "success"]
+    if not body.get("stream", True):
+        return {"status": "success"}
+    return StreamingResponse(
+        (json.dumps({"status": status}) + "\n" for status in statuses), media_type="application/x-ndjson"
+    )
+
+
+def digest(model: str) -> str:
+    definition = json.dumps([model, server.created.get(model, {}).get("system")], sort_keys=True)
+    return hashlib.sha256(definition.encode("utf-8")).hexdigest()
+
+
+@app.post("/api/show")
+async def show(request: Request):
+    body = await request.json()
+    created = server.created.get(full_name(body.get("model", "")), {})
+    parameters = "\n".join(f"{key} {value}" for key, value in created.get("parameters", {}).items())
+    return {
+        "modelfile": f'FROM {created.get("from") or "mock"}\nSYSTEM """{created.get("system", "")}"""\n',
+        "parameters": parameters,
+        "template": created.get("template", ""),
+        "details": {"family": "mock"},
+        "model_info": {},
+    }
+
+
+@app.get("/api/tags")
+async def tags():
+    return {"models": [
+        {"name": model, "model": model, "modified_at": info["modified_at"], "size": MODEL_SIZE_BYTES,
+         "digest": digest(model), "details": {"family": "mock"}}
+        for model, info in server.created.items()
+    ]}
+
+
+@app.get("/api/ps")
+async def ps():
+    server.expire()
+    models = []
+    for model, until in server.loaded.items():
+        expires = datetime.now(timezone.utc) + timedelta(seconds=min(until - time.monotonic(), 10 ** 9))
+        models.append({"name": model, "model": model, "size": MODEL_SIZE_BYTES, "size_vram": MODEL_SIZE_BYTES,
+                       "digest": digest(model), "expires_at": expires.isoformat(), "details": {"family": "mock"}})
+    return {"models": models}
+
+
+@app.post("/api/embed")
+async def embed(request: Request):
+    body = await request.json()
+    inputs = body.get("input") or ""
+    inputs = [inputs] if isinstance(inputs, str) else inputs
+    embeddings = []
+    for text in inputs:
+        vector = [0.0] * EMBEDDING_SIZE
+        for word in text.lower().split():
+            vector[int(hashlib.md5(word.encode("utf-8")).hexdigest(), 16) % EMBEDDING_SIZE] += 1
+        embeddings.append(vector)
+    return {"model": body.get("model", ""), "embeddings": embeddings}
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """The options of the mock, also offered by load_test.py."""
+    parser.add_argument("--latency", type=float, default=LATENCY_S,
+                        help="seconds until the prompt is processed")
+    parser.add_argument("--jitter", type=float, default=JITTER, help="share by which the latency varies")
+    parser.add_argument("--prompt-tokens-per-second", type=float, default=PROMPT_TOKENS_PER_SECOND)
+    parser.add_argument("--tokens-per-second", type=float, default=TOKENS_PER_SECOND)
+    parser.add_argument("--load-delay", type=float, default=LOAD_DELAY_S,
+                        help="seconds to load a model that is not loaded")
+    parser.add_argument("--max-loaded-models", type=int, default=MAX_LOADED_MODELS)
+    parser.add_argument("--num-parallel", type=int, default=NUM_PARALLEL,
+                        help="requests processed at the same time")
+    parser.add_argument("--response-tokens", type=int, default=RESPONSE_TOKENS,
+                        help="length of a made-up answer")
+    parser.add_argument("--replay", nargs="*", default=[],
+                        help="recorded results to answer from (eval_results_v*.jsonl, fact_checker_results.json)")
+
+
+def mock_arguments(args) -> list:
+    """The command line for the mock from the parsed options of add_arguments."""
+    command = []
+    for name in ("latency", "jitter", "prompt_tokens_per_second", "tokens_per_second", "load_delay",
+                 "max_loaded_models", "num_parallel", "response_tokens"):
+        command += [f"--{name.replace('_', '-')}", str(getattr(args, name))]
+    return command + (["--replay", *args.replay] if args.replay else [])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock Ollama server for benchmarks and tests.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    config.update(
+        latency_s=args.latency, jitter=args.jitter, prompt_tokens_per_second=args.prompt_tokens_per_second,
+        tokens_per_second=args.tokens_per_second, load_delay_s=args.load_delay,
+        max_loaded_models=args.max_loaded_models, response_tokens=args.response_tokens
+    )
+    server.slots = asyncio.Semaphore(args.num_parallel)
+    for pattern in args.replay:
+        for path in sorted(glob.glob(pattern)):
+            server.recordings.load(path)
+            print(f"[mock] replaying answers from {path}")
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
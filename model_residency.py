@@ -0,0 +1,163 @@
+"""
+Decides how long Ollama should keep each model loaded.
+
+Passing keep_alive=0 on every call unloads dem-model, rep-model and fact-checker after each turn, so every
+turn pays the cold-load cost again. The manager below keeps the models that are actually being used loaded,
+as long as they fit in the configured memory budget:
+- pinned models are kept loaded indefinitely
+- the remaining models are ranked by recent traffic and kept loaded while they fit in the budget
+- the keep_alive of a loaded model follows the gap between its recent requests
+- everything that does not fit is unloaded right after the call (keep_alive=0, the old behaviour)
+
+Cold loads are detected from the load_duration field Ollama returns with the final chunk of every chat call.
+"""
+
+import contextlib
+import os
+import time
+from collections import defaultdict, deque
+
+# total memory (GB) the models may occupy on the Ollama host
+MEMORY_BUDGET_GB = float(os.environ.get("POLITIKAI_MEMORY_BUDGET_GB", 24))
+
+# comma separated list of models that are never unloaded, e.g. "fact-checker:latest"
+PINNED_MODELS = [m.strip() for m in os.environ.get("POLITIKAI_PINNED_MODELS", "").split(",") if m.strip()]
+
+# size assumed for a model until Ollama reports the real one (mistral-nemo 12B in Q4 is about 8GB)
+DEFAULT_MODEL_SIZE_GB = 8.0
+
+# a load that takes longer than this is counted as a cold load (warm calls report a few milliseconds)
+COLD_LOAD_THRESHOLD_S = 0.5
+
+
+class ModelResidencyManager:
+    def __init__(
+            self,
+            memory_budget_gb: float = MEMORY_BUDGET_GB,
+            pinned_models: list = None,
+            traffic_window_s: float = 900,
+            min_keep_alive_s: float = 300,
+            max_keep_alive_s: float = 1800
+    ):
+        """
+        Args:
+            memory_budget_gb: Memory (GB) the loaded models may occupy together
+            pinned_models: Models that are kept loaded no matter the traffic
+            traffic_window_s: Only requests within this window count as recent traffic
+            min_keep_alive_s: Shortest keep_alive given to a model that fits in the budget
+            max_keep_alive_s: Longest keep_alive given to a model that is not pinned
+        """
+        self.memory_budget_gb = memory_budget_gb
+        self.pinned_models = set(PINNED_MODELS if pinned_models is None else pinned_models)
+        self.traffic_window_s = traffic_window_s
+        self.min_keep_alive_s = min_keep_alive_s
+        self.max_keep_alive_s = max_keep_alive_s
+
+        self.requests = defaultdict(deque)  # model -> timestamps of recent requests
+        self.sizes_gb = {}                  # model -> size reported by Ollama
+
+        # instrumentation
+        self.cold_loads = defaultdict(int)
+        self.load_time_s = defaultdict(float)
+
+    def _recent(self, model: str, now: float) -> deque:
+        timestamps = self.requests[model]
+        while timestamps and now - timestamps[0] > self.traffic_window_s:
+            timestamps.popleft()
+        return timestamps
+
+    def size_of(self, model: str) -> float:
+        return self.sizes_gb.get(model, DEFAULT_MODEL_SIZE_GB)
+
+    def resident_set(self, now: float = None) -> set:
+        """Models that should stay loaded: pinned ones first, then the busiest ones that still fit in the budget."""
+        now = time.monotonic() if now is None else now
+
+        busy = [m for m in self.requests if m not in self.pinned_models and self._recent(m, now)]
+        # most requests first, most recently used breaks ties
+        busy.sort(key=lambda m: (len(self.requests[m]), self.requests[m][-1]), reverse=True)
+
+        resident = set()
+        used_gb = 0.0
+        for model in list(self.pinned_models) + busy:
+            if model in self.pinned_models or used_gb + self.size_of(model) <= self.memory_budget_gb:
+                resident.add(model)
+                used_gb += self.size_of(model)
+        return resident
+
+    def keep_alive_for(self, model: str, record: bool = True):
+        """
+        Returns the keep_alive to pass with a request for this model (seconds, -1 keeps the model loaded forever).
+        By default the request is also counted as traffic for the model.
+        """
+        now = time.monotonic()
+        if record:
+            self._recent(model, now).append(now)
+
+        if model in self.pinned_models:
+            return -1
+        if model not in self.resident_set(now):
+            return 0
+
+        # keep the model loaded for about twice the usual gap between its requests
+        timestamps = self.requests[model]
+        if len(timestamps) > 1:
+            mean_gap = (timestamps[-1] - timestamps[0]) / (len(timestamps) - 1)
+        else:
+            mean_gap = 0
+        return int(min(self.max_keep_alive_s, max(self.min_keep_alive_s, 2 * mean_gap)))
+
+    def record_response(self, model: str, response) -> None:
+        """Record the load_duration of a finished call (the final chunk when streaming)."""
+        load_duration_s = (response.get("load_duration") or 0) / 1e9
+        if load_duration_s >= COLD_LOAD_THRESHOLD_S:
+            self.cold_loads[model] += 1
+            self.load_time_s[model] += load_duration_s
+            print(f"[residency] cold load of {model} took {load_duration_s:.2f}s "
+                  f"(cold loads so far: {self.cold_loads[model]})")
+
+    async def refresh_sizes(self, client) -> None:
+        """Update the model sizes with what the Ollama host reports for the currently loaded models."""
+        running = await client.ps()
+        for m in running.get("models", []):
+            self.sizes_gb[m.get("model")] = (m.get("size") or 0) / 1e9
+
+    async def prewarm(self, client, models: list, slot=None) -> None:
+        """
+        Load the given models ahead of the first request. Models that do not fit in the budget next to the
+        resident ones are skipped. Pre-warming is not counted as traffic, so it does not change which models
+        stay loaded.
+
+        Args:
+            slot: Function model -> async context manager held during each load, e.g. a background scheduler slot,
+                so the loads do not compete with user requests
+        """
+        now = time.monotonic()
+        resident = self.resident_set(now)
+        used_gb = sum(self.size_of(m) for m in resident)
+        for model in models:
+            if model in resident:
+                keep_alive = self.keep_alive_for(model, record=False)
+            elif used_gb + self.size_of(model) <= self.memory_budget_gb:
+                keep_alive = int(self.min_keep_alive_s)
+                used_gb += self.size_of(model)
+            else:
+                continue
+            try:
+                async with slot(model) if slot else contextlib.nullcontext():
+                    # an empty message list only loads the model
+                    response = await client.chat(model=model, messages=[], keep_alive=keep_alive)
+                self.record_response(model, response)
+                await self.refresh_sizes(client)
+            except Exception as e:
+                print(f"[residency] could not pre-warm {model}: {e}")
+
+    def stats(self) -> dict:
+        """Cold-load count and total load time per model."""
+        return {
+            model: {
+                "cold_loads": self.cold_loads[model],
+                "load_time_s": round(self.load_time_s[model], 3)
+            }
+            for model in sorted(set(self.requests) | set(self.cold_loads))
+        }
@@ -0,0 +1,316 @@
+"""
+Ollama client spread over several Ollama hosts.
+
+OllamaPool and AsyncOllamaPool have the methods of ollama.Client and ollama.AsyncClient this project uses (chat,
+embed, show, list, ps, create), so they can be passed wherever a client is expected, e.g. to the response cache.
+Every request is routed to one of the hosts in POLITIKAI_OLLAMA_HOSTS:
+- hosts that already have the model loaded come first, so dem-model, rep-model and fact-checker are not loaded
+  on every host, then the host with the fewest requests in flight
+- the hosts are checked every HEALTH_CHECK_S with /api/ps, which also tells which models they have loaded
+- if a host cannot be reached, it is skipped until its next check and the request goes to the next host; a
+  streamed request can only move to another host before its first chunk
+- create is sent to every host, so the models exist everywhere
+
+With a single host (the default, OLLAMA_HOST or localhost), requests go straight to it without health checks.
+"""
+
+import asyncio
+import os
+import time
+
+import httpx
+import ollama
+from ollama import ProcessResponse
+
+from response_cache import full_model_name, response_cache
+
+# comma separated list of Ollama hosts, e.g. "http://gpu-1:11434,http://gpu-2:11434"
+HOSTS = [h.strip() for h in os.environ.get("POLITIKAI_OLLAMA_HOSTS", "").split(",") if h.strip()] or \
+        [os.environ.get("OLLAMA_HOST") or None]
+
+# seconds between two health checks of a host
+HEALTH_CHECK_S = 15.0
+
+HEALTH_CHECK_TIMEOUT_S = 2.0
+
+# errors after which the request is sent to the next host
+FAILOVER_ERRORS = (ConnectionError, httpx.TransportError, ollama.ResponseError)
+
+
+class Backend:
+    """The state of one host, shared by all pools."""
+
+    def __init__(self, host):
+        self.host = host
+        self.healthy = True
+        self.checked_at = float("-inf")
+        self.loaded = set()  # models the host reported as loaded, plus the ones it served since
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+
+    @property
+    def name(self) -> str:
+        return self.host or "default"
+
+    def stale(self) -> bool:
+        return time.monotonic() - self.checked_at >= HEALTH_CHECK_S
+
+    def checked(self, running=None, error=None) -> None:
+        """Record the outcome of a health check: the /api/ps response, or the error."""
+        if error is not None and self.healthy:
+            print(f"[pool] {self.name} is down: {error}")
+        elif error is None and not self.healthy:
+            print(f"[pool] {self.name} is back")
+        self.healthy = error is None
+        self.checked_at = time.monotonic()
+        if running is not None:
+            self.loaded = {m.model for m in running.models}
+
+    def failed(self, error: Exception) -> Exception:
+        """Record a failed request. Returns the error if the request should go to the next host, else raises it."""
+        if isinstance(error, ollama.ResponseError):
+            # the host is up, but does not have the model (404) or could not run it (5xx)
+            if not (error.status_code == 404 or error.status_code >= 500):
+                raise error
+        else:
+            self.checked(error=error)
+        self.failures += 1
+        return error
+
+    def served(self, model: str) -> None:
+        self.requests += 1
+        if model:
+            self.loaded.add(full_model_name(model))
+
+
+BACKENDS = [Backend(host) for host in HOSTS]
+
+
+class BasePool:
+    def __init__(self, backends: list = None):
+        self.backends = BACKENDS if backends is None else backends
+
+    def _order(self, model: str = None) -> list:
+        """
+        Healthy hosts with the model loaded first, then the least busy, then the one with the fewest models loaded,
+        so different models spread over the hosts; unhealthy hosts only as a last resort.
+        """
+        model = full_model_name(model) if model else None
+        ranked = sorted(
+            enumerate(self.backends),
+            key=lambda ib: (not ib[1].healthy, model not in ib[1].loaded, ib[1].in_flight, len(ib[1].loaded), ib[0])
+        )
+        return [backend for _, backend in ranked]
+
+    def stats(self) -> dict:
+        return {
+            b.name: {
+                "healthy": b.healthy,
+                "requests": b.requests,
+                "failures": b.failures,
+                "loaded": sorted(b.loaded),
+            }
+            for b in self.backends
+        }
+
+    def metrics(self) -> list:
+        """The host metrics as lines of the Prometheus text format."""
+        lines = ["# TYPE politikai_backend_up gauge"]
+        lines += [f'politikai_backend_up{{host="{b.name}"}} {int(b.healthy)}' for b in self.backends]
+        lines.append("# TYPE politikai_backend_requests_total counter")
+        lines += [f'politikai_backend_requests_total{{host="{b.name}"}} {b.requests}' for b in self.backends]
+        lines.append("# TYPE politikai_backend_failures_total counter")
+        lines += [f'politikai_backend_failures_total{{host="{b.name}"}} {b.failures}' for b in self.backends]
+        return lines
+
+
+class OllamaPool(BasePool):
+    def __init__(self, backends: list = None):
+        super().__init__(backends)
+        self.clients = {b.host: ollama.Client(host=b.host) for b in self.backends}
+        self.health_clients = {b.host: ollama.Client(host=b.host, timeout=HEALTH_CHECK_TIMEOUT_S)
+                               for b in self.backends}
+
+    def _refresh(self) -> None:
+        if len(self.backends) < 2:
+            return
+        for backend in self.backends:
+            if backend.stale():
+                try:
+                    backend.checked(running=self.health_clients[backend.host].ps())
+                except FAILOVER_ERRORS as e:
+                    backend.checked(error=e)
+
+    def _call(self, model, request):
+        self._refresh()
+        error = None
+        for backend in self._order(model):
+            backend.in_flight += 1
+            try:
+                response = request(self.clients[backend.host])
+            except FAILOVER_ERRORS as e:
+                error = backend.failed(e)
+                continue
+            finally:
+                backend.in_flight -= 1
+            backend.served(model)
+            return response
+        raise error
+
+    def _chat_stream(self, model: str, messages: list, **kwargs):
+        self._refresh()
+        error = None
+        for backend in self._order(model):
+            backend.in_flight += 1
+            try:
+                try:
+                    chunks = self.clients[backend.host].chat(model=model, messages=messages, stream=True, **kwargs)
+                    # the request is only sent once the first chunk is read
+                    first = next(chunks, None)
+                except FAILOVER_ERRORS as e:
+                    error = backend.failed(e)
+                    continue
+                backend.served(model)
+                if first is not None:
+                    yield first
+                    yield from chunks
+                return
+            finally:
+                backend.in_flight -= 1
+        raise error
+
+    def chat(self, model: str = "", messages: list = None, stream: bool = False, **kwargs):
+        if stream:
+            return self._chat_stream(model, messages, **kwargs)
+        return self._call(model, lambda client: client.chat(model=model, messages=messages, **kwargs))
+
+    def embed(self, model: str = "", input="", **kwargs):
+        return self._call(model, lambda client: client.embed(model=model, input=input, **kwargs))
+
+    def show(self, model: str):
+        return self._call(model, lambda client: client.show(model))
+
+    def list(self):
+        return self._call(None, lambda client: client.list())
+
+    def ps(self) -> ProcessResponse:
+        """The loaded models of all reachable hosts."""
+        self._refresh()
+        models = []
+        for backend in self.backends:
+            try:
+                models += self.clients[backend.host].ps().models
+            except FAILOVER_ERRORS as e:
+                backend.failed(e)
+        return ProcessResponse(models=models)
+
+    def create(self, model: str, **kwargs):
+        """Creates the model on every reachable host."""
+        self._refresh()
+        response = None
+        for backend in self.backends:
+            if backend.healthy:
+                response = self.clients[backend.host].create(model=model, **kwargs)
+        # the model may have a new system prompt or parameters, the cached answers of the old one do not apply
+        response_cache.forget_model(model)
+        return response
+
+
+class AsyncOllamaPool(BasePool):
+    def __init__(self, backends: list = None):
+        super().__init__(backends)
+        self.clients = {b.host: ollama.AsyncClient(host=b.host) for b in self.backends}
+        self.health_clients = {b.host: ollama.AsyncClient(host=b.host, timeout=HEALTH_CHECK_TIMEOUT_S)
+                               for b in self.backends}
+
+    async def _check(self, backend: Backend) -> None:
+        try:
+            backend.checked(running=await self.health_clients[backend.host].ps())
+        except FAILOVER_ERRORS as e:
+            backend.checked(error=e)
+
+    async def _refresh(self) -> None:
+        if len(self.backends) < 2:
+            return
+        await asyncio.gather(*[self._check(backend) for backend in self.backends if backend.stale()])
+
+    async def _call(self, model, request):
+        await self._refresh()
+        error = None
+        for backend in self._order(model):
+            backend.in_flight += 1
+            try:
+                response = await request(self.clients[backend.host])
+            except FAILOVER_ERRORS as e:
+                error = backend.failed(e)
+                continue
+            finally:
+                backend.in_flight -= 1
+            backend.served(model)
+            return response
+        raise error
+
+    async def _chat_stream(self, model: str, messages: list, **kwargs):
+        await self._refresh()
+        error = None
+        for backend in self._order(model):
+            backend.in_flight += 1
+            try:
+                try:
+                    chunks = await self.clients[backend.host].chat(
+                        model=model, messages=messages, stream=True, **kwargs
+                    )
+                    # the request is only sent once the first chunk is read
+                    first = await anext(chunks, None)
+                except FAILOVER_ERRORS as e:
+                    error = backend.failed(e)
+                    continue
+                backend.served(model)
+                if first is not None:
+                    yield first
+                    async for chunk in chunks:
+                        yield chunk
+                return
+            finally:
+                backend.in_flight -= 1
+        raise error
+
+    async def chat(self, model: str = "", messages: list = None, stream: bool = False, **kwargs):
+        if stream:
+            return self._chat_stream(model, messages, **kwargs)
+        return await self._call(model, lambda client: client.chat(model=model, messages=messages, **kwargs))
+
+    async def embed(self, model: str = "", input="", **kwargs):
+        return await self._call(model, lambda client: client.embed(model=model, input=input, **kwargs))
+
+    async def show(self, model: str):
+        return await self._call(model, lambda client: client.show(model))
+
+    async def list(self):
+        return await self._call(None, lambda client: client.list())
+
+    async def ps(self) -> ProcessResponse:
+        """The loaded models of all reachable hosts."""
+        await self._refresh()
+        models = []
+        for backend in self.backends:
+            try:
+                models += (await self.clients[backend.host].ps()).models
+            except FAILOVER_ERRORS as e:
+                backend.failed(e)
+        return ProcessResponse(models=models)
+
+    async def create(self, model: str, **kwargs):
+        """Creates the model on every reachable host."""
+        await self._refresh()
+        response = None
+        for backend in self.backends:
+            if backend.healthy:
+                response = await self.clients[backend.host].create(model=model, **kwargs)
+        response_cache.forget_model(model)
+        return response
+
+
+# shared by the synchronous entry points: the persona evaluation, the fact-checker and its evaluation
+ollama_pool = OllamaPool()
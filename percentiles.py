@@ -0,0 +1,12 @@
+"""Nearest-rank percentiles, shared by the fact-checker evaluation, its analysis and the load test."""
+
+import math
+
+
+def percentile(values: list, p: float) -> float:
+    """Nearest-rank percentile, p between 0 and 100: the smallest value with at least p% of the values up to it."""
+    if not values:
+        return 0
+    ordered = sorted(values)
+    # p * n / 100 rather than p / 100 * n, so e.g. p=95 and n=20 is exactly 19 and not rounded up to 20
+    return ordered[max(0, min(len(ordered) - 1, math.ceil(p * len(ordered) / 100) - 1))]
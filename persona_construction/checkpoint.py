@@ -0,0 +1,53 @@
+"""
+Helpers to make evaluation runs resumable.
+
+Every finished record is appended to a JSONL file and fsynced right away, so a crash only loses the requests
+that were still running. A rerun with the same MODEL_TAG reads the file back and only redoes what is missing.
+"""
+
+import json
+import os
+
+# suffix of the file holding records that are finished but cannot be written to the result file yet
+CHECKPOINT_SUFFIX = ".checkpoint"
+
+def checkpoint_path(results_path):
+    return results_path + CHECKPOINT_SUFFIX
+
+def read_jsonl(path):
+    # a missing file simply means nothing has been done yet
+    if not os.path.exists(path):
+        return []
+
+    records = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                # the last line is cut off if the run crashed while writing it
+                break
+    return records
+
+def append_record(f, record):
+    # json.dumps converts the dict to a string
+    f.write(json.dumps(record, ensure_ascii=False) + '\n')
+    f.flush()
+    os.fsync(f.fileno())
+
+def write_jsonl(path, records):
+    # write to a temporary file first, so the old file survives a crash in the middle of the rewrite
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def remove_checkpoint(results_path):
+    if os.path.exists(checkpoint_path(results_path)):
+        os.remove(checkpoint_path(results_path))
@@ -1,7 +1,17 @@
+import asyncio
 import json
+import random
+import sys
+import httpx
 import ollama
 from tqdm import tqdm
 import os
+from checkpoint import append_record, checkpoint_path, read_jsonl, remove_checkpoint, write_jsonl
+
+# the response cache is shared with the chat app and the fact-checker, it lives in the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ollama_pool import AsyncOllamaPool, ollama_pool
+from response_cache import response_cache
 
 MODEL_TAG = "v2"
 
@@ -17,6 +27,14 @@ EVAL_FILE_PATH = "evaluation_prompts.json"
 # this is the file where the prompts + outputs of the finetuned models are stored
 EVAL_OUTPUT_PATH = os.path.join(EVAL_FOLDER, f"eval_results_{MODEL_TAG}.jsonl")
 
+# how many prompt x persona requests are sent to ollama at the same time
+# (ollama itself only runs OLLAMA_NUM_PARALLEL of them in parallel per model)
+CONCURRENCY = 4
+
+# how often a request is retried after a transient error, the first retry waits about BACKOFF_SECONDS
+RETRIES = 3
+BACKOFF_SECONDS = 2
+
 # function to load the evaluation prompts
 def load_prompts(file_path):
     with open(file_path, 'r') as f:
@@ -25,7 +43,8 @@ def load_prompts(file_path):
 
 def llm_response(
         prompt,
-        llm_model
+        llm_model,
+        use_cache = True
 ):
     messages = [
         {
@@ -34,75 +53,178 @@ def llm_response(
         }
     ]
 
-    response = ollama.chat(
+    response = response_cache.chat(
+        ollama_pool,
         model=llm_model, 
-        messages=messages
+        messages=messages,
+        use_cache=use_cache
     )
 
     return response['message']['content']
 
-def generate_eval_responses(
+def is_transient(error):
+    # server overloaded / restarting, or the connection dropped: worth another try
+    if isinstance(error, ollama.ResponseError):
+        return error.status_code == 429 or error.status_code >= 500
+    return isinstance(error, (ConnectionError, httpx.TransportError))
+
+async def async_llm_response(
+        client,
+        prompt,
+        llm_model,
+        retries = RETRIES,
+        use_cache = True
+):
+    messages = [
+        {
+            'role': 'user',
+            'content': prompt
+        }
+    ]
+
+    for attempt in range(retries + 1):
+        try:
+            response = await response_cache.async_chat(
+                client,
+                model=llm_model,
+                messages=messages,
+                use_cache=use_cache
+            )
+            return response['message']['content']
+        except Exception as e:
+            if attempt == retries or not is_transient(e):
+                raise
+            # exponential backoff with jitter, so retries of parallel requests do not arrive together
+            delay = BACKOFF_SECONDS * 2 ** attempt * (1 + random.random())
+            tqdm.write(f"{llm_model} failed ({e}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+PERSONAS = ('dem_response', 'rep_response')
+
+def load_completed(results_path):
+    """
+    Index of the responses a previous run of the same MODEL_TAG already produced.
+
+    Returns:
+        dict mapping prompt id -> {persona: response}
+    """
+    completed = {}
+
+    # items that made it into the result file
+    for item in read_jsonl(results_path):
+        for persona in PERSONAS:
+            if persona in item:
+                completed.setdefault(item['id'], {})[persona] = item[persona]
+
+    # single responses that were finished but still waiting for their item to be written
+    for record in read_jsonl(checkpoint_path(results_path)):
+        completed.setdefault(record['id'], {})[record['persona']] = record['response']
+
+    return completed
+
+async def generate_eval_responses_async(
         eval_prompts_path,
         democrat_model,
         republican_model,
-        results_path
+        results_path,
+        concurrency = CONCURRENCY,
+        retries = RETRIES,
+        resume = True,
+        use_cache = True
 ):
-    # load the evaluation data
-    eval_data = load_prompts(eval_prompts_path)
-
-    results = []
-
-    for item in tqdm(eval_data, desc="Evaluating Personas"):
-        # response from democrat
-        dem_output = llm_response(item['prompt'], llm_model=democrat_model) 
-
-        # response from republican
-        rep_output = llm_response(item['prompt'], llm_model=republican_model)
-
-        # store responses
-        item['dem_response'] = dem_output
-        item['rep_response'] = rep_output
-
-        results.append(item)
-
-    # store in a new jsonl file
-    output_file = results_path
+    # load the evaluation data, the output is written in the order of the prompt ids
+    eval_data = sorted(load_prompts(eval_prompts_path), key=lambda item: item['id'])
+
+    if not resume:
+        remove_checkpoint(results_path)
+
+    # responses of an earlier, interrupted run with the same results path are reused
+    completed = load_completed(results_path) if resume else {}
+    pending = [completed.get(item['id'], {}) for item in eval_data]
+
+    # the result file is rewritten with the longest in-order run of complete items, the rest is appended below
+    next_to_write = 0
+    while next_to_write < len(eval_data) and len(pending[next_to_write]) == 2:
+        eval_data[next_to_write].update(pending[next_to_write])
+        next_to_write += 1
+    write_jsonl(results_path, eval_data[:next_to_write])
+
+    models = {'dem_response': democrat_model, 'rep_response': republican_model}
+    missing = [
+        (index, persona)
+        for index in range(len(eval_data))
+        for persona in PERSONAS
+        if persona not in pending[index]
+    ]
+    if len(missing) < 2 * len(eval_data):
+        print(f"Resuming: {2 * len(eval_data) - len(missing)} responses already done, {len(missing)} to go")
+
+    client = AsyncOllamaPool()
+    semaphore = asyncio.Semaphore(concurrency)
+    progress = tqdm(total=len(missing), desc="Evaluating Personas")
+
+    async def respond(index, persona):
+        async with semaphore:
+            output = await async_llm_response(client, eval_data[index]['prompt'], models[persona], retries, use_cache)
+        progress.update(1)
+        return index, persona, output
+
+    # every missing prompt x persona pair is scheduled at once, the semaphore limits how many run at the same time
+    tasks = [asyncio.create_task(respond(index, persona)) for index, persona in missing]
+
+    try:
+        with open(results_path, 'a', encoding='utf-8') as f, \
+                open(checkpoint_path(results_path), 'a', encoding='utf-8') as checkpoint:
+            for finished in asyncio.as_completed(tasks):
+                index, persona, output = await finished
+                pending[index][persona] = output
+
+                # responses finish in any order: each one is checkpointed right away, and an item is written
+                # once both responses are in and all items before it have been written
+                append_record(checkpoint, {'id': eval_data[index]['id'], 'persona': persona, 'response': output})
+
+                while next_to_write < len(eval_data) and len(pending[next_to_write]) == 2:
+                    # store responses
+                    eval_data[next_to_write].update(pending[next_to_write])
+                    append_record(f, eval_data[next_to_write])
+
+                    pending[next_to_write] = None
+                    next_to_write += 1
+    finally:
+        progress.close()
+        for task in tasks:
+            task.cancel()
+
+    # everything made it into the result file
+    remove_checkpoint(results_path)
+    print(f"Evaluation results successfully saved to {results_path}")
 
-    with open(output_file, 'w', encoding='utf-8') as f:
-        for entry in results:
-            # json.dumps converts the dict to a string
-            json_record = json.dumps(entry, ensure_ascii=False)
-            f.write(json_record + '\n')
-            
-    print(f"Evaluation results successfully saved to {output_file}")
+def generate_eval_responses(
+        eval_prompts_path,
+        democrat_model,
+        republican_model,
+        results_path,
+        concurrency = CONCURRENCY,
+        retries = RETRIES,
+        resume = True,
+        use_cache = True
+):
+    asyncio.run(generate_eval_responses_async(
+        eval_prompts_path,
+        democrat_model,
+        republican_model,
+        results_path,
+        concurrency=concurrency,
+        retries=retries,
+        resume=resume,
+        use_cache=use_cache
+    ))
 
 if __name__ == "__main__":
     os.makedirs(EVAL_FOLDER, exist_ok=True)
-    # load the evaluation data
-    eval_data = load_prompts(EVAL_FILE_PATH)
-
-    results = []
-
-    for item in tqdm(eval_data, desc="Evaluating Personas"):
-        # response from democrat
-        dem_output = llm_response(item['prompt'], llm_model=democrat_model) 
-
-        # response from republican
-        rep_output = llm_response(item['prompt'], llm_model=republican_model)
-
-        # store responses
-        item['dem_response'] = dem_output
-        item['rep_response'] = rep_output
-
-        results.append(item)
-
-    # store in a new jsonl file
-    output_file = EVAL_OUTPUT_PATH
-
-    with open(output_file, 'w', encoding='utf-8') as f:
-        for entry in results:
-            # json.dumps converts the dict to a string
-            json_record = json.dumps(entry, ensure_ascii=False)
-            f.write(json_record + '\n')
-            
-    print(f"Evaluation results successfully saved to {output_file}")
+    generate_eval_responses(
+        eval_prompts_path = EVAL_FILE_PATH,
+        democrat_model = democrat_model,
+        republican_model = republican_model,
+        results_path = EVAL_OUTPUT_PATH
+    )
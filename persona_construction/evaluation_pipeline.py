@@ -1,31 +1,114 @@
 from evaluation import *
 from politics_evalution import *
+import argparse
+import asyncio
 import os
 
-# specify which model you want to evaluate
-MODEL_TAG           = "v3.3"
+# specify which model versions you want to evaluate, they can also be passed on the command line
+MODEL_TAGS          = ["v2", "v3.1", "v3.2", "v3.3"]
 
 EVAL_FOLDER         = "eval_results"
 
 # this is the file where the evaluation prompts are stored
 PROMPTS_PATH        = "evaluation_prompts.json"
 
-# this is the file where the llm responses for the evaluation prompts are stored
-EVAL_OUTPUT_PATH    = os.path.join(EVAL_FOLDER, f"eval_results_{MODEL_TAG}.jsonl")
+# this is the csv file that combines the political leaning of all evaluated model versions
+SUMMARY_CSV_PATH    = os.path.join(EVAL_FOLDER, "politico_results_summary.csv")
 
-# this is the csv file that contains the political leaning of the models
-CSV_RESULTS_PATH    = os.path.join(EVAL_FOLDER, f'politico_results_{MODEL_TAG}.csv')
+LEANINGS            = {"LABEL_0": "left", "LABEL_1": "center", "LABEL_2": "right"}
 
+def eval_output_path(tag):
+    # this is the file where the llm responses for the evaluation prompts are stored
+    return os.path.join(EVAL_FOLDER, f"eval_results_{tag}.jsonl")
 
-if __name__ == "__main__":
-    os.makedirs(EVAL_FOLDER, exist_ok=True)
-    print("Generating LLM responses")
-    generate_eval_responses(
-        eval_prompts_path = PROMPTS_PATH,
-        democrat_model = f"nadinekitzwoegerer/dem-model:{MODEL_TAG}",
-        republican_model = f"nadinekitzwoegerer/rep-model:{MODEL_TAG}",
-        results_path = EVAL_OUTPUT_PATH
+def csv_results_path(tag):
+    # this is the csv file that contains the political leaning of the models
+    return os.path.join(EVAL_FOLDER, f'politico_results_{tag}.csv')
+
+def generation_complete(tag, prompt_count):
+    # a finished run leaves one line per prompt and no checkpoint behind
+    path = eval_output_path(tag)
+    return (
+        os.path.exists(path)
+        and not os.path.exists(checkpoint_path(path))
+        and len(read_jsonl(path)) == prompt_count
     )
 
-    print("Running Evaluation with POLITICO model.")
-    run_evaluation(EVAL_OUTPUT_PATH, CSV_RESULTS_PATH)
\ No newline at end of file
+async def sweep(tags):
+    """
+    Generates and classifies the responses of several model versions.
+
+    Generation runs one tag after the other against ollama (each tag is concurrent internally), while the tags
+    that are already generated are classified in a worker thread at the same time. Tags whose csv already
+    exists are skipped, tags whose responses already exist are only classified.
+    """
+    prompt_count = len(load_prompts(PROMPTS_PATH))
+    ready = asyncio.Queue()
+
+    async def classify_ready_tags():
+        # classifies everything that is ready in one pass, until generation is done (marked by None)
+        done = False
+        while not done:
+            batch = [await ready.get()]
+            while not ready.empty():
+                batch.append(ready.get_nowait())
+            done = None in batch
+            jobs = [(eval_output_path(tag), csv_results_path(tag)) for tag in batch if tag is not None]
+            if jobs:
+                print(f"Running Evaluation with POLITICO model for {[tag for tag in batch if tag is not None]}.")
+                await asyncio.to_thread(run_evaluations, jobs)
+
+    classifier_task = asyncio.create_task(classify_ready_tags())
+
+    try:
+        for tag in tags:
+            if os.path.exists(csv_results_path(tag)):
+                print(f"Skipping {tag}: {csv_results_path(tag)} already exists")
+                continue
+
+            if generation_complete(tag, prompt_count):
+                print(f"Skipping generation for {tag}: {eval_output_path(tag)} already exists")
+            else:
+                print(f"Generating LLM responses for {tag}")
+                await generate_eval_responses_async(
+                    eval_prompts_path = PROMPTS_PATH,
+                    democrat_model = f"nadinekitzwoegerer/dem-model:{tag}",
+                    republican_model = f"nadinekitzwoegerer/rep-model:{tag}",
+                    results_path = eval_output_path(tag)
+                )
+            await ready.put(tag)
+    finally:
+        await ready.put(None)
+        await classifier_task
+
+def summarize(tags):
+    """Combines the csv files of all tags into one table of leaning shares and confidence per persona."""
+    rows = []
+    for tag in tags:
+        if not os.path.exists(csv_results_path(tag)):
+            continue
+        df = pd.read_csv(csv_results_path(tag))
+        for persona, group in df.groupby('persona_type'):
+            shares = group['predicted_leaning'].map(LEANINGS).value_counts(normalize=True)
+            rows.append({
+                'model_tag': tag,
+                'persona_type': persona,
+                'responses': len(group),
+                **{f'{leaning}_share': shares.get(leaning, 0.0) for leaning in LEANINGS.values()},
+                'mean_confidence': group['confidence_score'].mean()
+            })
+
+    summary = pd.DataFrame(rows)
+    summary.to_csv(SUMMARY_CSV_PATH, index=False, encoding='utf-8')
+    print(summary.to_string(index=False))
+    print(f"Combined results saved to {SUMMARY_CSV_PATH}")
+    return summary
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate and classify persona responses for several model tags.")
+    parser.add_argument("tags", nargs="*", default=MODEL_TAGS, help="model tags to evaluate, e.g. v3.2 v3.3")
+    args = parser.parse_args()
+
+    os.makedirs(EVAL_FOLDER, exist_ok=True)
+    asyncio.run(sweep(args.tags))
+    summarize(args.tags)
@@ -1,9 +1,13 @@
+import argparse
+import glob
 import pandas as pd
 import torch
 import json
-from transformers import pipeline
+from transformers import AutoModelForSequenceClassification, AutoTokenizer, pipeline
 from tqdm import tqdm
 import os
+import time
+from checkpoint import append_record, checkpoint_path, read_jsonl, remove_checkpoint
 
 """
 Go to model description: https://huggingface.co/matous-volf/political-leaning-politics
@@ -22,46 +26,275 @@ EVAL_RESULTS_PATH   = os.path.join(EVAL_FOLDER, f"eval_results_{MODEL_TAG}.jsonl
 
 CSV_RESULTS_PATH    = os.path.join(EVAL_FOLDER, f"politico_results_{MODEL_TAG}.csv")
 
-def run_evaluation(input_file, output_csv):
-    # load the classifier
-    # tokenizer 'launch/POLITICS' as recommended by the model author
-    classifier = pipeline(
-        "text-classification", 
-        model=POLITICO_MODEL,
-        tokenizer="launch/POLITICS"
-    )
-
-    results_for_csv = []
-
-    # load the JSONL responses generated earlier
-    with open(input_file, 'r', encoding='utf-8') as f:
-        data = [json.loads(line) for line in f]
-
-    for item in tqdm(data, desc="Classifying Responses"):
-        prompt = item['prompt']
-        
-        # evaluate personas
-        for persona in ['dem', 'rep']:
-            response_text = item[f'{persona}_response']
-            
-            # Run the classifier
-            prediction = classifier(response_text)[0]
-            
-            # Flatten everything for the CSV/Pandas
-            results_for_csv.append({
-                'prompt_id': item.get('id'),
-                'category': item.get('category'),
-                'prompt': prompt,
-                'persona_type': "Democrat" if persona == 'dem' else "Republican",
-                'llm_response': response_text,
-                'predicted_leaning': prediction['label'], # 'left', 'center', or 'right'
-                'confidence_score': prediction['score']
-            })
+# how many responses go through the classifier at once (1 classifies them one by one)
+BATCH_SIZE          = 16
+
+# the POLITICS model is RoBERTa based and cannot read more than 512 tokens
+MAX_LENGTH          = 512
+
+# first GPU if there is one, CPU otherwise
+DEVICE              = 0 if torch.cuda.is_available() else -1
+
+# intra-op threads on CPU-only hosts: one per physical core (cpu_count counts hyper-threads), more only adds contention
+NUM_THREADS         = int(os.environ.get("POLITICS_NUM_THREADS", max(1, (os.cpu_count() or 2) // 2)))
+
+# how the classifier runs:
+# - fp32: the original model, as published
+# - int8: dynamically quantized linear layers, CPU only, needs no extra dependencies
+# - onnx: exported ONNX graph run by onnxruntime, needs `pip install optimum[onnxruntime]`
+BACKENDS            = ["fp32", "int8", "onnx"]
+BACKEND             = os.environ.get("POLITICS_BACKEND", "fp32")
+
+# converted models are stored here after the first conversion
+BACKEND_CACHE_DIR   = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "politics")
+
+def load_classifier(backend=BACKEND):
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend '{backend}', choose one of {BACKENDS}")
+
+    if DEVICE == -1:
+        torch.set_num_threads(NUM_THREADS)
+
+    if backend == "fp32":
+        # tokenizer 'launch/POLITICS' as recommended by the model author
+        return pipeline(
+            "text-classification", 
+            model=POLITICO_MODEL,
+            tokenizer="launch/POLITICS",
+            device=DEVICE
+        )
+
+    cache_dir = os.path.join(BACKEND_CACHE_DIR, backend)
+    converted = os.path.exists(os.path.join(cache_dir, "tokenizer_config.json"))
+    tokenizer = AutoTokenizer.from_pretrained(cache_dir if converted else "launch/POLITICS")
+
+    if backend == "int8":
+        model_path = os.path.join(cache_dir, "model_int8.pt")
+        if converted:
+            # the file is our own conversion, so loading the pickled module is safe
+            model = torch.load(model_path, weights_only=False)
+        else:
+            model = AutoModelForSequenceClassification.from_pretrained(POLITICO_MODEL)
+            model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        # quantized kernels only exist for CPU
+        device = -1
+    else:
+        try:
+            from optimum.onnxruntime import ORTModelForSequenceClassification
+        except ImportError:
+            raise ImportError("The onnx backend needs optimum: pip install optimum[onnxruntime]") from None
+        model = ORTModelForSequenceClassification.from_pretrained(
+            cache_dir if converted else POLITICO_MODEL,
+            export=not converted
+        )
+        device = DEVICE
+
+    if not converted:
+        os.makedirs(cache_dir, exist_ok=True)
+        if backend == "int8":
+            torch.save(model, model_path)
+        else:
+            model.save_pretrained(cache_dir)
+        # saved last, its presence marks a finished conversion
+        tokenizer.save_pretrained(cache_dir)
+
+    return pipeline("text-classification", model=model, tokenizer=tokenizer, device=device)
+
+# classifiers are loaded once per process and backend, and shared by every file classified in it
+_classifiers = {}
+
+# load time and inference time are reported separately
+classifier_stats = {'load_s': 0.0, 'inference_s': 0.0, 'responses': 0}
+
+def get_classifier(backend=BACKEND):
+    if backend not in _classifiers:
+        start = time.perf_counter()
+        _classifiers[backend] = load_classifier(backend)
+        classifier_stats['load_s'] += time.perf_counter() - start
+    return _classifiers[backend]
+
+def print_classifier_stats():
+    inference_s = classifier_stats['inference_s']
+    responses = classifier_stats['responses']
+    print(f"Classifier load time: {classifier_stats['load_s']:.2f}s, "
+          f"inference time: {inference_s:.2f}s for {responses} responses "
+          f"({responses / inference_s if inference_s else 0:.1f} responses/s)")
+
+def classify_batched(classifier, texts, batch_size=BATCH_SIZE):
+    """
+    Classifies all texts in batches. Texts of similar length are batched together, so little compute is spent
+    on padding.
+
+    Yields:
+        (positions of the texts in the batch, their predictions) for every batch
+    """
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+
+    with torch.inference_mode():
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            batch_start = time.perf_counter()
+            predictions = classifier(
+                [texts[i] for i in batch],
+                batch_size=len(batch),
+                truncation=True,
+                max_length=MAX_LENGTH
+            )
+            classifier_stats['inference_s'] += time.perf_counter() - batch_start
+            classifier_stats['responses'] += len(batch)
+            yield batch, predictions
+
+def resolve_inputs(inputs):
+    """
+    Turns model tags (e.g. "v3.3") and paths of eval_results_*.jsonl files into (input_file, output_csv) pairs.
+    """
+    jobs = []
+    for entry in inputs:
+        if entry.endswith(".jsonl"):
+            folder, name = os.path.split(entry)
+            csv_name = name.replace("eval_results_", "politico_results_", 1)[:-len(".jsonl")] + ".csv"
+            jobs.append((entry, os.path.join(folder, csv_name)))
+        else:
+            jobs.append((
+                os.path.join(EVAL_FOLDER, f"eval_results_{entry}.jsonl"),
+                os.path.join(EVAL_FOLDER, f"politico_results_{entry}.csv")
+            ))
+    return jobs
+
+def run_evaluations(jobs, resume=True, batch_size=BATCH_SIZE, backend=BACKEND):
+    """
+    Classifies the responses of several result files in one pass with one classifier.
+
+    Args:
+        jobs: (input_file, output_csv) pairs, see resolve_inputs
+    """
+    results_for_csv = []  # rows per job
+    todo = []             # (job index, item, persona) of every response still to classify
+
+    for job_index, (input_file, output_csv) in enumerate(jobs):
+        # classifications of an earlier, interrupted run for the same csv are reused
+        if not resume:
+            remove_checkpoint(output_csv)
+        results_for_csv.append(read_jsonl(checkpoint_path(output_csv)) if resume else [])
+        completed = {(row['prompt_id'], row['persona_type']) for row in results_for_csv[job_index]}
+
+        # load the JSONL responses generated earlier
+        with open(input_file, 'r', encoding='utf-8') as f:
+            data = [json.loads(line) for line in f]
+
+        job_todo = [
+            (job_index, item, persona)
+            for item in data
+            for persona in ['dem', 'rep']
+            if (item.get('id'), "Democrat" if persona == 'dem' else "Republican") not in completed
+        ]
+        if completed:
+            print(f"Resuming {input_file}: {len(completed)} responses already classified, {len(job_todo)} to go")
+        todo.extend(job_todo)
+
+    if todo:
+        # load the classifier (only the first time in this process)
+        classifier = get_classifier(backend)
+
+        texts = [item[f'{persona}_response'] for _, item, persona in todo]
+
+        checkpoints = [open(checkpoint_path(output_csv), 'a', encoding='utf-8') for _, output_csv in jobs]
+        try:
+            with tqdm(total=len(todo), desc="Classifying Responses") as progress:
+                # Run the classifier, the predictions come back with the positions of their responses in todo
+                for positions, predictions in classify_batched(classifier, texts, batch_size):
+                    for position, prediction in zip(positions, predictions):
+                        job_index, item, persona = todo[position]
+
+                        # Flatten everything for the CSV/Pandas
+                        row = {
+                            'prompt_id': item.get('id'),
+                            'category': item.get('category'),
+                            'prompt': item['prompt'],
+                            'persona_type': "Democrat" if persona == 'dem' else "Republican",
+                            'llm_response': texts[position],
+                            'predicted_leaning': prediction['label'], # 'left', 'center', or 'right'
+                            'confidence_score': prediction['score']
+                        }
+                        append_record(checkpoints[job_index], row)
+                        results_for_csv[job_index].append(row)
+                    progress.update(len(positions))
+        finally:
+            for checkpoint in checkpoints:
+                checkpoint.close()
 
     # 3. Create DataFrame and Save to CSV
-    df = pd.DataFrame(results_for_csv)
-    df.to_csv(output_csv, index=False, encoding='utf-8')
-    print(f"Evaluation complete! Saved to {output_csv}")
+    # rows are sorted back into prompt order, no matter which run classified them
+    persona_order = {"Democrat": 0, "Republican": 1}
+    for (_, output_csv), rows in zip(jobs, results_for_csv):
+        rows.sort(key=lambda row: (row['prompt_id'], persona_order[row['persona_type']]))
+        df = pd.DataFrame(rows)
+        df.to_csv(output_csv, index=False, encoding='utf-8')
+        remove_checkpoint(output_csv)
+        print(f"Evaluation complete! Saved to {output_csv}")
+
+    print_classifier_stats()
+
+def run_evaluation(input_file, output_csv, resume=True, batch_size=BATCH_SIZE, backend=BACKEND):
+    run_evaluations([(input_file, output_csv)], resume=resume, batch_size=batch_size, backend=backend)
+
+def check_parity(backend, results_paths=None, batch_size=BATCH_SIZE):
+    """
+    Compares the labels of a backend with those of the fp32 pipeline on the existing evaluation results.
+
+    Returns:
+        DataFrame with the number of responses, label disagreements and mean score difference per file
+    """
+    if results_paths is None:
+        results_paths = sorted(glob.glob(os.path.join(EVAL_FOLDER, "eval_results_v*.jsonl")))
+
+    reference = get_classifier("fp32")
+    candidate = get_classifier(backend)
+
+    report = []
+    for path in results_paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            texts = [
+                item[f'{persona}_response']
+                for item in (json.loads(line) for line in f)
+                for persona in ['dem', 'rep']
+            ]
+
+        expected = [None] * len(texts)
+        for positions, predictions in classify_batched(reference, texts, batch_size):
+            for position, prediction in zip(positions, predictions):
+                expected[position] = prediction
+
+        disagreements = 0
+        score_diff = 0.0
+        for positions, predictions in tqdm(classify_batched(candidate, texts, batch_size), desc=path):
+            for position, prediction in zip(positions, predictions):
+                disagreements += prediction['label'] != expected[position]['label']
+                score_diff += abs(prediction['score'] - expected[position]['score'])
+
+        report.append({
+            'file': os.path.basename(path),
+            'responses': len(texts),
+            'disagreements': disagreements,
+            'disagreement_rate': disagreements / len(texts) if texts else 0.0,
+            'mean_score_diff': score_diff / len(texts) if texts else 0.0
+        })
+
+    df = pd.DataFrame(report)
+    print(f"Label parity of the {backend} backend against fp32:")
+    print(df.to_string(index=False))
+    return df
 
 if __name__ == "__main__":
-    run_evaluation(EVAL_RESULTS_PATH, CSV_RESULTS_PATH)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Classify the political leaning of the persona responses.")
+    parser.add_argument("inputs", nargs="*", default=[MODEL_TAG],
+                        help="model tags (e.g. v3.3) or eval_results_*.jsonl files, all classified in one pass")
+    parser.add_argument("--backend", choices=BACKENDS, default=BACKEND)
+    parser.add_argument("--parity", action="store_true",
+                        help="compare the labels of --backend with fp32 on all eval_results_v*.jsonl files instead")
+    args = parser.parse_args()
+
+    if args.parity:
+        check_parity(args.backend)
+    else:
+        run_evaluations(resolve_inputs(args.inputs), backend=args.backend)
\ No newline at end of file
@@ -0,0 +1,272 @@
+"""
+On-disk cache for non-streaming Ollama chat calls.
+
+The same prompts are sent to the same models over and over (evaluation runs, fact-checker evaluations, chat
+sessions). The cache stores every response under a key built from everything that determines it:
+- the digest of the model, as reported by Ollama
+- the system prompt and the parameters baked into the model (from its modelfile)
+- the sampling options and the output format of the call
+- the messages
+
+Entries live in a SQLite file and are evicted least-recently-used once the file exceeds its size limit.
+
+Caching assumes that the same request gives an acceptable answer twice. When that is wrong, e.g. when the
+spread of answers at a non-zero temperature is what is being measured, pass use_cache=False or set
+POLITIKAI_RESPONSE_CACHE=0.
+"""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from ollama import ChatResponse
+
+CACHE_ENABLED = os.environ.get("POLITIKAI_RESPONSE_CACHE", "1") != "0"
+
+CACHE_PATH = os.environ.get(
+    "POLITIKAI_RESPONSE_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "responses.sqlite")
+)
+
+CACHE_MAX_MB = float(os.environ.get("POLITIKAI_RESPONSE_CACHE_MB", 256))
+
+# seconds a model's identity is reused before it is resolved again, so that a model re-created by another process
+# (e.g. setup.sh) with a new system prompt is not answered from the entries of the old one
+IDENTITY_TTL_S = 60.0
+
+
+def full_model_name(model: str) -> str:
+    return model if ":" in model else f"{model}:latest"
+
+
+def parse_system_prompt(modelfile: str) -> str:
+    match = re.search(r'^SYSTEM\s+"""(.*?)"""', modelfile, re.DOTALL | re.MULTILINE)
+    if not match:
+        match = re.search(r"^SYSTEM\s+(.+)$", modelfile, re.MULTILINE)
+    return match.group(1).strip() if match else ""
+
+
+def model_identity(show, listing, model: str) -> dict:
+    """Everything about a model that changes its answers, from the /api/show and /api/tags responses."""
+    digest = next(
+        (m.get("digest") for m in listing.get("models", []) if m.get("model") == full_model_name(model)),
+        None
+    )
+    return {
+        "digest": digest,
+        "system": parse_system_prompt(show.get("modelfile") or ""),
+        "parameters": show.get("parameters") or "",
+        "template": show.get("template") or "",
+    }
+
+
+def request_key(identity: dict, messages: list, options=None, format=None) -> str:
+    payload = {
+        "model": identity,
+        "messages": [{"role": m["role"], "content": m["content"]} for m in messages],
+        "options": dict(options or {}),
+        "format": format,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, path: str = CACHE_PATH, max_mb: float = CACHE_MAX_MB, enabled: bool = CACHE_ENABLED):
+        self.path = path
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.enabled = enabled
+        self.identities = {}  # full model name -> (identity, time it was resolved)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._db = None
+
+    @property
+    def db(self):
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+            )
+        return self._db
+
+    def get(self, key: str):
+        with self._lock:
+            row = self.db.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            try:
+                response = ChatResponse.model_validate_json(row[0])
+            except ValueError:
+                # written by an incompatible client version, treat as a miss
+                self.db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.db.commit()
+                self.misses += 1
+                return None
+            self.db.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+            self.db.commit()
+            self.hits += 1
+        return response
+
+    def put(self, key: str, response) -> None:
+        data = response.model_dump_json() if hasattr(response, "model_dump_json") else json.dumps(response)
+        with self._lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, data, len(data), time.time())
+            )
+            self._evict()
+            self.db.commit()
+
+    def _cached_identity(self, model: str):
+        identity, resolved_at = self.identities.get(full_model_name(model), (None, 0.0))
+        return identity if time.monotonic() - resolved_at < IDENTITY_TTL_S else None
+
+    def _identity(self, client, model: str) -> dict:
+        identity = self._cached_identity(model)
+        if identity is None:
+            identity = model_identity(client.show(model), client.list(), model)
+            self.identities[full_model_name(model)] = (identity, time.monotonic())
+        return identity
+
+    async def _async_identity(self, client, model: str) -> dict:
+        identity = self._cached_identity(model)
+        if identity is None:
+            identity = model_identity(await client.show(model), await client.list(), model)
+            self.identities[full_model_name(model)] = (identity, time.monotonic())
+        return identity
+
+    def forget_model(self, model: str) -> None:
+        """Resolves the identity of the model again on its next call, e.g. after it was re-created."""
+        self.identities.pop(full_model_name(model), None)
+
+    def forget(self, model: str, messages: list, options=None, format=None) -> None:
+        """Removes the response to a request, e.g. one that turned out to be unusable."""
+        if full_model_name(model) not in self.identities:
+            return
+        key = request_key(self.identities[full_model_name(model)][0], messages, options, format)
+        with self._lock:
+            self.db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self.db.commit()
+
+    def _evict(self) -> None:
+        total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # drop the least recently used entries until the cache is back to 90% of its limit
+        for key, size in self.db.execute("SELECT key, size FROM responses ORDER BY last_access").fetchall():
+            self.db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            if total <= 0.9 * self.max_bytes:
+                break
+
+    @staticmethod
+    def _call_args(options, format, kwargs) -> dict:
+        # only forward what the caller set, so the call is the same as without the cache
+        if options is not None:
+            kwargs["options"] = options
+        if format is not None:
+            kwargs["format"] = format
+        return kwargs
+
+    def chat(self, client, model: str, messages: list, options=None, format=None, use_cache: bool = True, **kwargs):
+        """
+        Cached version of client.chat(..., stream=False).
+
+        Args:
+            client: An ollama.Client, or the ollama module itself for the module-level functions
+            use_cache: False to always call the model (the response is not stored either)
+        """
+        self._local.hit = False
+        if not (self.enabled and use_cache):
+            return client.chat(model=model, messages=messages, **self._call_args(options, format, kwargs))
+
+        key = request_key(self._identity(client, model), messages, options, format)
+
+        cached = self.get(key)
+        if cached is not None:
+            self._local.hit = True
+            return cached
+
+        response = client.chat(model=model, messages=messages, **self._call_args(options, format, kwargs))
+        self.put(key, response)
+        return response
+
+    def chat_stream(self, client, model: str, messages: list, options=None, format=None, use_cache: bool = True,
+                    **kwargs):
+        """
+        Cached version of client.chat(..., stream=True). Yields the chunks of the response; a cached response is
+        yielded as one chunk. The response is only stored if the stream was consumed to the end.
+        """
+        call_args = self._call_args(options, format, kwargs)
+        self._local.hit = False
+        if not (self.enabled and use_cache):
+            yield from client.chat(model=model, messages=messages, stream=True, **call_args)
+            return
+
+        key = request_key(self._identity(client, model), messages, options, format)
+
+        cached = self.get(key)
+        if cached is not None:
+            self._local.hit = True
+            yield cached
+            return
+
+        content = []
+        final = None
+        for chunk in client.chat(model=model, messages=messages, stream=True, **call_args):
+            content.append(chunk.message.content or "")
+            if chunk.done:
+                final = chunk
+            yield chunk
+        if final is not None:
+            message = final.message.model_copy(update={"content": "".join(content)})
+            self.put(key, final.model_copy(update={"message": message}))
+
+    async def async_chat(self, client, model: str, messages: list, options=None, format=None, use_cache: bool = True,
+                         **kwargs):
+        """Same as chat, for an ollama.AsyncClient."""
+        if not (self.enabled and use_cache):
+            response = await client.chat(model=model, messages=messages, **self._call_args(options, format, kwargs))
+            self._local.hit = False
+            return response
+
+        key = request_key(await self._async_identity(client, model), messages, options, format)
+
+        cached = self.get(key)
+        self._local.hit = cached is not None
+        if cached is not None:
+            return cached
+
+        response = await client.chat(model=model, messages=messages, **self._call_args(options, format, kwargs))
+        self.put(key, response)
+        self._local.hit = False
+        return response
+
+    def last_was_hit(self) -> bool:
+        """
+        Whether the last chat, chat_stream or async_chat call of the current thread was answered from the cache.
+        The coroutines of an event loop share its thread, so after async_chat it has to be read before the next
+        await.
+        """
+        return getattr(self._local, "hit", False)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+# shared by all entry points of the project
+response_cache = ResponseCache()
@@ -0,0 +1,197 @@
+"""
+Decides which of the waiting Ollama requests of all Chainlit sessions runs next.
+
+A plain semaphore served the requests first come, first served: a session fact-checking a long debate could fill
+the queue and the next user waited behind all of it, and the sidebar fact checks competed with the persona
+streams the user is watching. The scheduler keeps one queue per model and, whenever a generation slot is free,
+picks the next request by:
+1. priority: the persona streams first, then the fact checks, then background work like transcript summaries;
+   a request that has waited longer than AGING_S counts as a persona stream, so nothing waits forever
+2. fairness: the session with the fewest requests running, and among those the one served longest ago
+3. the model that is already generating, so the host does not swap models more than needed
+4. arrival order
+
+Once MAX_QUEUE_DEPTH requests are waiting, new requests are refused with SchedulerBusy and new turns get a
+"busy" answer instead of queueing behind everything else. Queue depth, running requests, wait times and refused
+requests are exported with the other metrics of turn_tracing.py; they are read from its HTTP thread while the
+event loop changes them, so every change and every read holds the scheduler's lock.
+"""
+
+import asyncio
+import itertools
+import os
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from contextlib import asynccontextmanager
+
+from turn_tracing import Histogram
+
+# Upper bound on how many generations are sent to Ollama at the same time, across all sessions.
+# A single-GPU host serializes requests anyway (see OLLAMA_NUM_PARALLEL), so raising this above
+# what the server can actually run in parallel only adds memory pressure.
+MAX_CONCURRENT_GENERATIONS = int(os.environ.get("POLITIKAI_MAX_CONCURRENT_GENERATIONS", 2))
+
+# requests waiting for a slot, across all models, above which new requests are refused
+MAX_QUEUE_DEPTH = int(os.environ.get("POLITIKAI_MAX_QUEUE_DEPTH", 32))
+
+# seconds after which a waiting request is served like a persona stream
+AGING_S = 10.0
+
+PERSONA, FACT_CHECK, BACKGROUND = 0, 1, 2
+
+PRIORITY_NAMES = {PERSONA: "persona", FACT_CHECK: "fact_check", BACKGROUND: "background"}
+
+
+class SchedulerBusy(Exception):
+    def __str__(self):
+        return "the server is busy, please try again in a moment"
+
+
+class Request:
+    def __init__(self, model: str, session, priority: int, seq: int):
+        self.model = model
+        self.session = session
+        self.priority = priority
+        self.seq = seq
+        self.enqueued = time.monotonic()
+        self.granted = asyncio.get_running_loop().create_future()
+
+
+class Scheduler:
+    def __init__(self, max_concurrent: int = MAX_CONCURRENT_GENERATIONS, max_queue_depth: int = MAX_QUEUE_DEPTH,
+                 aging_s: float = AGING_S):
+        """
+        Args:
+            max_concurrent: Requests sent to Ollama at the same time
+            max_queue_depth: Waiting requests above which new ones are refused
+            aging_s: Seconds after which a waiting request gets the highest priority
+        """
+        self.max_concurrent = max_concurrent
+        self.max_queue_depth = max_queue_depth
+        self.aging_s = aging_s
+        self.queues = defaultdict(deque)  # model -> waiting requests in arrival order
+        self.running = Counter()  # model -> running requests
+        self.running_per_session = Counter()
+        self.last_served = {}  # session -> time its last request got a slot
+        self.waits = defaultdict(Histogram)  # priority name -> seconds waited for a slot
+        self.refused = Counter()  # priority name -> refused requests
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    def depth(self) -> int:
+        return sum(len(queue) for queue in self.queues.values())
+
+    def busy(self) -> bool:
+        """Whether new requests would be refused."""
+        return self.depth() >= self.max_queue_depth
+
+    @asynccontextmanager
+    async def slot(self, model: str, session=None, priority: int = PERSONA):
+        """
+        Waits for a generation slot for a request to the model and holds it for the duration of the block.
+
+        Raises:
+            SchedulerBusy: if too many requests are already waiting
+        """
+        request = Request(model, session, priority, next(self._seq))
+        with self._lock:
+            queued = sum(self.running.values()) >= self.max_concurrent or self.depth() > 0
+            if not queued:
+                self._grant(request)
+            elif self.busy():
+                self.refused[PRIORITY_NAMES[priority]] += 1
+                raise SchedulerBusy()
+            else:
+                self.queues[model].append(request)
+        if queued:
+            try:
+                await request.granted
+            except asyncio.CancelledError:
+                if request.granted.done() and not request.granted.cancelled():
+                    # the slot was granted just before the cancellation, hand it on
+                    self._release(request)
+                else:
+                    with self._lock:
+                        self.queues[model].remove(request)
+                raise
+
+        try:
+            yield
+        finally:
+            self._release(request)
+
+    def _grant(self, request: Request) -> None:
+        now = time.monotonic()
+        self.running[request.model] += 1
+        self.running_per_session[request.session] += 1
+        self.last_served[request.session] = now
+        self.waits[PRIORITY_NAMES[request.priority]].observe(now - request.enqueued)
+        if not request.granted.done():
+            request.granted.set_result(None)
+
+    def _release(self, request: Request) -> None:
+        with self._lock:
+            self.running[request.model] -= 1
+            self.running_per_session[request.session] -= 1
+            if not self.running_per_session[request.session]:
+                del self.running_per_session[request.session]
+            self._dispatch()
+
+    def _rank(self, request: Request, now: float) -> tuple:
+        priority = PERSONA if now - request.enqueued >= self.aging_s else request.priority
+        return (
+            priority,
+            self.running_per_session[request.session],
+            self.last_served.get(request.session, 0.0),
+            not self.running[request.model],
+            request.seq,
+        )
+
+    def _dispatch(self) -> None:
+        while sum(self.running.values()) < self.max_concurrent and self.depth():
+            now = time.monotonic()
+            request = min(
+                (request for queue in self.queues.values() for request in queue),
+                key=lambda r: self._rank(r, now)
+            )
+            self.queues[request.model].remove(request)
+            self._grant(request)
+
+    def metrics(self) -> list:
+        """The scheduler's metrics as lines of the Prometheus text format. Called from the metrics thread."""
+        with self._lock:
+            depths = {model: len(queue) for model, queue in self.queues.items()}
+            running = dict(self.running)
+            waits = {
+                name: histogram.lines("politikai_queue_wait_seconds", f'priority="{name}"')
+                for name, histogram in self.waits.items()
+            }
+            refused = dict(self.refused)
+
+        lines = ["# TYPE politikai_queue_depth gauge"]
+        for model in sorted(set(depths) | set(running)):
+            lines.append(f'politikai_queue_depth{{model="{model}"}} {depths.get(model, 0)}')
+        lines.append("# TYPE politikai_running_generations gauge")
+        for model in sorted(running):
+            lines.append(f'politikai_running_generations{{model="{model}"}} {running[model]}')
+        lines.append("# TYPE politikai_queue_wait_seconds histogram")
+        for name in sorted(waits):
+            lines += waits[name]
+        lines.append("# TYPE politikai_refused_requests_total counter")
+        for name, count in sorted(refused.items()):
+            lines.append(f'politikai_refused_requests_total{{priority="{name}"}} {count}')
+        return lines
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "queued": self.depth(),
+                "running": sum(self.running.values()),
+                "mean_wait_s": {name: round(h.sum / h.count, 3) for name, h in sorted(self.waits.items())},
+                "refused": dict(self.refused),
+            }
+
+
+# shared by all sessions, since they share the Ollama host
+scheduler = Scheduler()
@@ -17,6 +17,7 @@ fi
 
 echo "Pulling and Creating Ollama models..."
 ollama pull HammerAI/mistral-nemo-uncensored:latest # Foundation model for political personas
+ollama pull nomic-embed-text # Embeddings of the claim cache
 
 ollama create dem-model -f model_files/democrat.mf
 ollama create rep-model -f model_files/republican.mf
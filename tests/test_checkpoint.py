@@ -0,0 +1,30 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, "persona_construction"))
+from checkpoint import append_record, checkpoint_path, read_jsonl, remove_checkpoint, write_jsonl
+
+
+def test_records_are_read_back(tmp_path):
+    path = str(tmp_path / "results.jsonl")
+    write_jsonl(path, [{"id": 1}])
+    with open(path, "a", encoding="utf-8") as f:
+        append_record(f, {"id": 2, "text": "café"})
+
+    assert read_jsonl(path) == [{"id": 1}, {"id": 2, "text": "café"}]
+
+
+def test_truncated_last_line_is_ignored(tmp_path):
+    path = tmp_path / "results.jsonl"
+    path.write_text('{"id": 1}\n\n{"id": 2}\n{"id": 3, "resp', encoding="utf-8")
+
+    assert read_jsonl(str(path)) == [{"id": 1}, {"id": 2}]
+
+
+def test_missing_file_means_nothing_done(tmp_path):
+    results_path = str(tmp_path / "results.jsonl")
+
+    assert read_jsonl(results_path) == []
+    remove_checkpoint(results_path)
+    assert checkpoint_path(results_path) == results_path + ".checkpoint"
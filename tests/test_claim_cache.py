@@ -0,0 +1,60 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import claim_cache
+from claim_cache import ClaimCache
+
+
+class FlakyEmbedder:
+    """Fails the first embedding call, then embeds every text as the same vector."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def embed(self, model, input):
+        self.calls += 1
+        if self.calls == 1:
+            raise ConnectionError("embedding model unavailable")
+        return {"embeddings": [[1.0, 0.0]]}
+
+
+def test_embedding_is_retried_after_an_error(monkeypatch):
+    client = FlakyEmbedder()
+    cache = ClaimCache(embed_model="embedder", client=client)
+    now = [1000.0]
+    monkeypatch.setattr(claim_cache.time, "monotonic", lambda: now[0])
+
+    cache.put("Crime fell last year.", "verdict")
+    assert cache.get("Crime went down last year.") is None
+    assert client.calls == 1
+
+    now[0] += claim_cache.EMBED_RETRY_S
+    cache.put("Crime fell last year.", "verdict")
+    assert cache.get("Crime went down last year.") == "verdict"
+    assert cache.embed_model == "embedder"
+
+
+class SameEmbedder:
+    """Embeds every text as the same vector."""
+
+    def embed(self, model, input):
+        return {"embeddings": [[1.0, 0.0]]}
+
+
+def test_text_only_entries_are_not_matched_by_embedding():
+    cache = ClaimCache(embed_model="embedder", client=SameEmbedder())
+
+    cache.put("The economy grew under our plan.", "verdict", namespace="turns", semantic=False)
+
+    assert cache.get("The economy shrank under their plan.", namespace="turns") is None
+    assert cache.get("the economy grew under our plan", namespace="turns", semantic=False) == "verdict"
+
+
+def test_rejected_verdicts_are_not_counted_as_hits():
+    cache = ClaimCache(embed_model="", client=SameEmbedder())
+    cache.put("Taxes went up.", "sidebar text", seconds=5.0)
+
+    assert cache.get("Taxes went up.", accept=lambda verdict: isinstance(verdict, dict)) is None
+    assert cache.stats()["exact_hits"] == 0
+    assert cache.stats()["seconds_saved"] == 0
@@ -0,0 +1,92 @@
+import asyncio
+import json
+import os
+import sys
+
+import ollama
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, "persona_construction"))
+import evaluation
+from checkpoint import read_jsonl
+
+
+class FakeClient:
+    """Answers with the model and prompt after a short delay, and counts the requests running at once."""
+
+    def __init__(self, failures: int = 0):
+        self.failures = failures
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def chat(self, model, messages, **kwargs):
+        self.requests.append((model, messages[0]["content"]))
+        if self.failures:
+            self.failures -= 1
+            raise ollama.ResponseError("overloaded", 503)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+        return {"message": {"content": f"{model}: {messages[0]['content']}"}}
+
+
+def write_prompts(tmp_path, count: int) -> str:
+    path = tmp_path / "prompts.json"
+    # the prompt file is not sorted by id
+    path.write_text(json.dumps([{"id": i, "prompt": f"prompt {i}"} for i in reversed(range(count))]))
+    return str(path)
+
+
+def generate(tmp_path, client, monkeypatch, prompts: int, **kwargs) -> list:
+    monkeypatch.setattr(evaluation, "AsyncOllamaPool", lambda: client)
+    results_path = str(tmp_path / "results.jsonl")
+    evaluation.generate_eval_responses(write_prompts(tmp_path, prompts), "dem", "rep", results_path,
+                                       use_cache=False, **kwargs)
+    return read_jsonl(results_path)
+
+
+def test_responses_are_generated_concurrently_and_written_in_order(tmp_path, monkeypatch):
+    client = FakeClient()
+
+    results = generate(tmp_path, client, monkeypatch, prompts=5, concurrency=3)
+
+    assert client.max_in_flight == 3
+    assert [r["id"] for r in results] == list(range(5))
+    assert results[2] == {"id": 2, "prompt": "prompt 2", "dem_response": "dem: prompt 2",
+                          "rep_response": "rep: prompt 2"}
+
+
+def test_transient_errors_are_retried(tmp_path, monkeypatch):
+    monkeypatch.setattr(evaluation, "BACKOFF_SECONDS", 0)
+    client = FakeClient(failures=2)
+
+    results = generate(tmp_path, client, monkeypatch, prompts=1, concurrency=1)
+
+    assert len(client.requests) == 4
+    assert results[0]["dem_response"] == "dem: prompt 0"
+
+
+def test_other_errors_are_not_retried():
+    assert evaluation.is_transient(ollama.ResponseError("overloaded", 503))
+    assert evaluation.is_transient(ConnectionError())
+    assert not evaluation.is_transient(ollama.ResponseError("model not found", 404))
+
+
+def test_resume_only_generates_what_is_missing(tmp_path, monkeypatch):
+    results_path = tmp_path / "results.jsonl"
+    results_path.write_text(
+        '{"id": 0, "prompt": "prompt 0", "dem_response": "old", "rep_response": "old"}\n{"id": 1, "pro',
+        encoding="utf-8"
+    )
+    (tmp_path / "results.jsonl.checkpoint").write_text(
+        '{"id": 1, "persona": "dem_response", "response": "old"}\n', encoding="utf-8"
+    )
+    client = FakeClient()
+
+    results = generate(tmp_path, client, monkeypatch, prompts=3)
+
+    assert sorted(client.requests) == [("dem", "prompt 2"), ("rep", "prompt 1"), ("rep", "prompt 2")]
+    assert [(r["id"], r["dem_response"]) for r in results] == [(0, "old"), (1, "old"), (2, "dem: prompt 2")]
+    assert not os.path.exists(str(results_path) + ".checkpoint")
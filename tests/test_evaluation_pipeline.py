@@ -0,0 +1,66 @@
+import asyncio
+import json
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("pandas")
+pytest.importorskip("transformers")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, "persona_construction"))
+import evaluation_pipeline
+from evaluation_pipeline import checkpoint_path, eval_output_path, generation_complete
+
+
+@pytest.fixture
+def eval_folder(tmp_path, monkeypatch):
+    monkeypatch.setattr(evaluation_pipeline, "EVAL_FOLDER", str(tmp_path))
+    prompts_path = tmp_path / "prompts.json"
+    prompts_path.write_text(json.dumps([{"id": 1, "prompt": "p1"}, {"id": 2, "prompt": "p2"}]), encoding="utf-8")
+    monkeypatch.setattr(evaluation_pipeline, "PROMPTS_PATH", str(prompts_path))
+    return tmp_path
+
+
+def write_responses(tag, count):
+    with open(eval_output_path(tag), "w", encoding="utf-8") as f:
+        for i in range(count):
+            f.write(json.dumps({"id": i + 1}) + "\n")
+
+
+def test_generation_is_complete_with_every_prompt_and_no_checkpoint(eval_folder):
+    assert not generation_complete("v1", 2)
+
+    write_responses("v1", 1)
+    assert not generation_complete("v1", 2)
+
+    write_responses("v1", 2)
+    assert generation_complete("v1", 2)
+
+    open(checkpoint_path(eval_output_path("v1")), "w").close()
+    assert not generation_complete("v1", 2)
+
+
+def test_sweep_only_does_what_is_missing(eval_folder, monkeypatch):
+    generated = []
+    classified = []
+
+    async def generate(eval_prompts_path, democrat_model, republican_model, results_path):
+        generated.append(democrat_model)
+        write_responses(os.path.basename(results_path)[len("eval_results_"):-len(".jsonl")], 2)
+
+    def classify(jobs):
+        classified.extend(os.path.basename(input_file) for input_file, _ in jobs)
+
+    monkeypatch.setattr(evaluation_pipeline, "generate_eval_responses_async", generate)
+    monkeypatch.setattr(evaluation_pipeline, "run_evaluations", classify)
+    # v1 is done, v2 is generated but not classified, v3 is still to do
+    (eval_folder / "politico_results_v1.csv").write_text("", encoding="utf-8")
+    write_responses("v2", 2)
+
+    asyncio.run(evaluation_pipeline.sweep(["v1", "v2", "v3"]))
+
+    assert generated == ["nadinekitzwoegerer/dem-model:v3"]
+    assert sorted(classified) == ["eval_results_v2.jsonl", "eval_results_v3.jsonl"]
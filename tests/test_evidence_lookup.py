@@ -0,0 +1,38 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import evidence_lookup
+from evidence_lookup import EvidenceLookup, index_path_for, load_index
+
+
+def write_corpus(path, *claims):
+    path.write_text("".join(f'{{"claim": "{claim}", "rating": "False"}}\n' for claim in claims), encoding="utf-8")
+
+
+def test_each_corpus_has_its_own_index(tmp_path, monkeypatch):
+    monkeypatch.setattr(evidence_lookup, "CACHE_DIR", str(tmp_path / "cache"))
+    write_corpus(tmp_path / "a.jsonl", "Crime fell by 3% in 2023")
+    write_corpus(tmp_path / "b.jsonl", "Taxes went up last year")
+
+    load_index(str(tmp_path / "a.jsonl"))
+    load_index(str(tmp_path / "b.jsonl"))
+
+    assert index_path_for(str(tmp_path / "a.jsonl")) != index_path_for(str(tmp_path / "b.jsonl"))
+    assert load_index(str(tmp_path / "a.jsonl")).search("crime fell")[0]["claim"] == "Crime fell by 3% in 2023"
+
+
+def test_remote_results_do_not_force_a_rebuild(tmp_path, monkeypatch):
+    corpus = tmp_path / "corpus.jsonl"
+    index_path = str(tmp_path / "index.json")
+    write_corpus(corpus, "Crime fell by 3% in 2023")
+    remote = lambda claim: [{"claim": claim, "rating": "True"}]
+    EvidenceLookup(str(corpus), remote=remote, index_path=index_path).lookup("Unemployment is at a record low.")
+
+    def rebuild(self, record):
+        raise AssertionError("index was built again")
+    monkeypatch.setattr(evidence_lookup.BM25Index, "add", rebuild)
+    index = load_index(str(corpus), index_path)
+
+    assert len(index.records) == 2
+    assert index.search("unemployment record low")[0]["rating"] == "True"
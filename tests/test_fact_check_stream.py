@@ -0,0 +1,95 @@
+import json
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fact_check_stream import (
+    FactCheckStreamParser, JsonObjectStream, SentenceChunker, close_truncated, has_corrections, parse_lenient,
+    repair_json
+)
+
+
+def feed_all(parser, tokens):
+    return [parser.feed(token) for token in tokens]
+
+
+def test_response_starts_after_a_heading_split_across_tokens():
+    parser = FactCheckStreamParser()
+
+    partials = feed_all(parser, ["Claims: ...\n**FACT CHE", "CKER RESP", "ONSE**:\n", '"The ACA', " passed in 2010.\""])
+
+    assert partials[:2] == [None, None]
+    assert partials[-1] == "The ACA passed in 2010."
+    assert parser.finish() == "The ACA passed in 2010."
+
+
+def test_whole_output_is_used_without_a_heading():
+    parser = FactCheckStreamParser()
+
+    assert feed_all(parser, ["No verifiable ", "claims in the text."]) == [None, None]
+    assert parser.finish() == "No verifiable claims in the text."
+
+
+
+def test_chunks_are_cut_at_sentence_ends():
+    chunker = SentenceChunker(sentences_per_chunk=2)
+
+    chunks = [chunk for token in "Taxes rose. Mr. Smith said so! Crime fell by 3.5%. It".split(" ")
+              for chunk in chunker.feed(token + " ")]
+
+    assert chunks == ["Taxes rose. Mr. Smith said so!"]
+    assert chunker.flush() == "Crime fell by 3.5%. It"
+
+
+def test_initials_do_not_end_a_sentence():
+    chunker = SentenceChunker(sentences_per_chunk=1)
+
+    assert chunker.feed("The U.S. economy grew. ") == ["The U.S. economy grew."]
+
+
+def test_fixed_answers_have_no_corrections():
+    assert not has_corrections("No false claims in the text.")
+    assert not has_corrections("No verifiable claims in the text.")
+    assert has_corrections("The ACA was signed in 2010, not 2008.")
+
+
+def test_objects_are_returned_when_their_brace_arrives():
+    stream = JsonObjectStream()
+    tokens = ['```json\n{"Claims": [{"Claim": "Taxes', ' went {up}.", "Party": "REP"}', ', {"Claim": "Crime',
+              ' fell."}]}```']
+
+    objects = [stream.feed(token) for token in tokens]
+
+    assert objects == [[], [{"Claim": "Taxes went {up}.", "Party": "REP"}], [], [{"Claim": "Crime fell."}]]
+    assert stream.finish() == []
+    assert stream.errors == 0
+
+
+def test_broken_objects_are_repaired_or_skipped():
+    stream = JsonObjectStream()
+
+    assert stream.feed("{'Claim': 'Taxes went up.', 'Party': 'REP',} {Claim: }") == [
+        {"Claim": "Taxes went up.", "Party": "REP"}
+    ]
+    assert stream.errors == 1
+
+
+def test_truncated_last_object_is_recovered():
+    stream = JsonObjectStream()
+
+    assert stream.feed('[{"Claim": "Taxes went up."}, {"Claim": "Crime fe') == [{"Claim": "Taxes went up."}]
+    assert stream.finish() == [{"Claim": "Crime fe"}]
+
+
+def test_close_truncated():
+    assert json.loads(close_truncated('{"Claims": [{"Claim": "a", ')) == {"Claims": [{"Claim": "a"}]}
+    assert json.loads(close_truncated('{"Claim": "cut [off')) == {"Claim": "cut [off"}
+
+
+def test_repair_json_leaves_strings_alone():
+    text = '{Claim: "True, None of it: yes",\n "Verified": True, "Sources": [None,],}'
+
+    assert json.loads(repair_json(text)) == {"Claim": "True, None of it: yes", "Verified": True, "Sources": [None]}
+    assert parse_lenient("{“Claim”: “Taxes went up.”}") == {"Claim": "Taxes went up."}
+    # a raw line break inside a string
+    assert parse_lenient('{"Explanation": "line one\nline two"}') == {"Explanation": "line one\nline two"}
@@ -0,0 +1,138 @@
+import os
+import sys
+import threading
+
+import pytest
+from ollama import ChatResponse, Message
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import fact_checker_persona
+from evidence_lookup import EvidenceLookup
+from fact_checker_persona import FactChecker, extract_json
+from response_cache import ResponseCache
+
+
+class FakeClient:
+    """Answers every chat call with the next of the given outputs."""
+
+    def __init__(self, *outputs):
+        self.outputs = list(outputs)
+        self.calls = 0
+
+    def chat(self, model, messages, stream=False, **kwargs):
+        self.calls += 1
+        response = ChatResponse(model=model, done=True, eval_count=10, prompt_eval_count=100,
+                                message=Message(role="assistant", content=self.outputs.pop(0)))
+        return iter([response]) if stream else response
+
+    def show(self, model):
+        return {"modelfile": "", "parameters": "", "template": ""}
+
+    def list(self):
+        return {"models": []}
+
+
+@pytest.fixture
+def fact_checker(tmp_path):
+    return FactChecker(use_cache=False, dedup=False,
+                       evidence=EvidenceLookup(str(tmp_path / "corpus.jsonl"), remote=None))
+
+
+def test_extract_json_skips_prose_and_footnotes():
+    text = 'Claims [1]:\n```json\n{"Claim": "Taxes went up.", "Party": "REP",}\n```\nand {"Claim": "Crime fell."}'
+
+    assert extract_json(text) == [{"Claim": "Taxes went up.", "Party": "REP"}, {"Claim": "Crime fell."}]
+    with pytest.raises(ValueError):
+        extract_json("No claims [1].")
+
+
+def test_extract_single_object(fact_checker, monkeypatch):
+    client = FakeClient('{"Claim": "Crime fell by 3% in 2023.", "Party": "DEM"}')
+    monkeypatch.setattr(fact_checker_persona, "ollama_pool", client)
+
+    claims = fact_checker.extract_claims("text")
+
+    assert claims == [{"Claim": "Crime fell by 3% in 2023.", "Party": "DEM"}]
+    assert client.calls == 1
+
+
+def test_extract_keeps_the_claims_next_to_a_malformed_one(fact_checker, monkeypatch):
+    client = FakeClient('[{"Claim": "Crime fell by 3% in 2023.", "Party": "Democrat"}, {"Party": "REP"}, '
+                        '{"Claim": "Taxes went up.", "Party": "rep"}]')
+    monkeypatch.setattr(fact_checker_persona, "ollama_pool", client)
+
+    claims = fact_checker.extract_claims("text")
+
+    assert claims == [{"Claim": "Crime fell by 3% in 2023.", "Party": "UNK"},
+                      {"Claim": "Taxes went up.", "Party": "REP"}]
+    assert client.calls == 1
+
+
+def test_stream_claims_regenerates_an_output_without_claims(fact_checker, monkeypatch):
+    client = FakeClient('{"Claims": "none"}', '[{"Claim": "Taxes went up.", "Party": "Republican"}]')
+    monkeypatch.setattr(fact_checker_persona, "ollama_pool", client)
+
+    assert list(fact_checker.stream_claims("text")) == ["Taxes went up."]
+    assert client.calls == 2
+
+
+def test_extract_no_claims(fact_checker, monkeypatch):
+    client = FakeClient("No verifiable claims in the text.")
+    monkeypatch.setattr(fact_checker_persona, "ollama_pool", client)
+
+    assert fact_checker.extract_claims("text") == []
+    assert client.calls == 1
+
+
+def test_cache_hits_are_not_counted_as_round_trips(tmp_path, monkeypatch):
+    judgement = '{"Claim": "Taxes went up.", "Judgement": "FALSE", "Explanation": "They went down."}'
+    client = FakeClient(judgement)
+    monkeypatch.setattr(fact_checker_persona, "ollama_pool", client)
+    monkeypatch.setattr(fact_checker_persona, "response_cache", ResponseCache(str(tmp_path / "responses.sqlite")))
+    fact_checker = FactChecker(dedup=False, evidence=EvidenceLookup(str(tmp_path / "corpus.jsonl"), remote=None))
+
+    fact_checker.judge_claim("Taxes went up.")
+    fact_checker.judge_claim("Taxes went up.")
+
+    metrics = fact_checker.metrics["per_claim"]
+    assert client.calls == 1
+    assert (metrics["round_trips"], metrics["claims"], metrics["eval_tokens"]) == (1, 1, 10)
+    assert (metrics["cache_hits"], metrics["cached_claims"]) == (1, 1)
+
+
+def test_rated_claim_is_judged_without_the_model(tmp_path, monkeypatch):
+    corpus = tmp_path / "corpus.jsonl"
+    corpus.write_text('{"claim": "Crime fell by 3% in 2023", "rating": "False", "publisher": "PolitiFact", '
+                      '"url": "https://example.org/check"}\n', encoding="utf-8")
+    client = FakeClient()
+    monkeypatch.setattr(fact_checker_persona, "ollama_pool", client)
+    evidence = EvidenceLookup(str(corpus), remote=None, index_path=str(tmp_path / "index.json"))
+    fact_checker = FactChecker(use_cache=False, dedup=False, judge_batch_size=2, evidence=evidence)
+
+    judgement = fact_checker.judge_claim("Crime fell by 3% in 2023.")
+
+    assert judgement["Judgement"] == "FALSE"
+    assert "PolitiFact" in judgement["Explanation"]
+    assert fact_checker.judge_claims(["Crime fell by 3% in 2023."])[0]["Judgement"] == "FALSE"
+    assert client.calls == 0
+
+
+@pytest.mark.parametrize("judge_batch_size", [1, 2])
+def test_results_are_yielded_while_claims_arrive(fact_checker, monkeypatch, judge_batch_size):
+    fact_checker.judge_batch_size = judge_batch_size
+    monkeypatch.setattr(fact_checker, "check_claim", lambda claim: {"Claim": claim})
+    monkeypatch.setattr(fact_checker, "check_claim_batch", lambda claims: [{"Claim": c} for c in claims])
+    first_result = threading.Event()
+
+    def claims():
+        yield from ["a", "b"][:judge_batch_size]
+        # like stream_claims waiting for the model, only goes on once the first result is out
+        assert first_result.wait(timeout=5)
+        yield "c"
+
+    results = []
+    for index, result in fact_checker.check_claims(claims()):
+        results.append((index, result["Claim"]))
+        first_result.set()
+
+    assert sorted(results) == list(enumerate(["a", "b"][:judge_batch_size] + ["c"]))
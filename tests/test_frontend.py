@@ -0,0 +1,76 @@
+import asyncio
+import os
+import sys
+import types
+
+import chainlit as cl
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, "load_test"))
+import load_test
+
+
+class FakeOllama:
+    """Streams a few words per persona, the Democrat more slowly, and counts the streams running at once."""
+
+    DELAYS = {"dem-model:latest": 0.02, "rep-model:latest": 0.01}
+
+    def __init__(self):
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def chat(self, model, messages, stream=False, **kwargs):
+        if stream:
+            return self._stream(model)
+        # pre-warm loads and the blocking fact check
+        return {"message": {"content": "FACT CHECKER RESPONSE: No false claims in the text."}, "done": True}
+
+    async def _stream(self, model):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            for word in ("Answer ", "of ", model):
+                await asyncio.sleep(self.DELAYS.get(model, 0))
+                yield {"message": {"content": word}}
+            yield {"message": {"content": ""}, "done": True}
+        finally:
+            self.in_flight -= 1
+
+    async def ps(self):
+        return {"models": []}
+
+
+@pytest.fixture
+def frontend(monkeypatch):
+    for name in ("Message", "Text", "ElementSidebar", "ChatSettings"):
+        monkeypatch.setattr(cl, name, getattr(load_test, name))
+    monkeypatch.setattr(cl, "user_session", load_test.UserSession())
+    import frontend
+    monkeypatch.setattr(frontend, "client", FakeOllama())
+    monkeypatch.setattr(frontend.tracer, "trace_path", "")
+    return frontend
+
+
+def run_turn(frontend, execution: str) -> list:
+    async def turn():
+        session = load_test.Session("test", {"Persona": "Both", "Execution": execution, "FactCheck": "Blocking"})
+        load_test.current_session.set(session)
+        await frontend.start()
+        await frontend.main(types.SimpleNamespace(content="What about taxes?"))
+        return session.data["transcript"]
+
+    return asyncio.run(turn())
+
+
+@pytest.mark.parametrize("execution, streams_at_once", [("Concurrent", 2), ("Sequential", 1)])
+def test_personas_answer_concurrently(frontend, execution, streams_at_once):
+    transcript = run_turn(frontend, execution)
+
+    assert frontend.client.max_in_flight == streams_at_once
+    # the transcript keeps the agent order even though the Republican finishes first
+    assert [(m["role"], m.get("author")) for m in transcript] == [
+        ("user", None), ("assistant", "Democrat"), ("assistant", "Republican")
+    ]
+    assert transcript[1]["content"] == "Answer of dem-model:latest"
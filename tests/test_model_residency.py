@@ -0,0 +1,89 @@
+import asyncio
+import os
+import sys
+from contextlib import asynccontextmanager
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import model_residency
+from model_residency import ModelResidencyManager
+
+
+class FakeClient:
+    def __init__(self):
+        self.loads = []
+
+    async def chat(self, model, messages, keep_alive):
+        self.loads.append((model, keep_alive))
+        return {"load_duration": 0}
+
+    async def ps(self):
+        return {"models": []}
+
+
+def test_prewarm_is_not_counted_as_traffic():
+    residency = ModelResidencyManager(memory_budget_gb=16, min_keep_alive_s=300)
+    client = FakeClient()
+
+    asyncio.run(residency.prewarm(client, ["dem-model:latest", "rep-model:latest", "fact-checker:latest"]))
+
+    # only two 8GB models fit in the budget
+    assert client.loads == [("dem-model:latest", 300), ("rep-model:latest", 300)]
+    assert not any(residency.requests.values())
+
+
+def test_prewarm_holds_a_slot_per_load():
+    residency = ModelResidencyManager()
+    client = FakeClient()
+    held = []
+
+    @asynccontextmanager
+    async def slot(model):
+        held.append(model)
+        yield
+        assert client.loads[-1][0] == model
+
+    asyncio.run(residency.prewarm(client, ["dem-model:latest"], slot=slot))
+
+    assert held == ["dem-model:latest"]
+
+
+def test_busiest_models_stay_resident_within_the_budget():
+    residency = ModelResidencyManager(memory_budget_gb=16, pinned_models=[])
+    now = 1000.0
+    for model, requests in (("dem-model:latest", 3), ("rep-model:latest", 2), ("fact-checker:latest", 1)):
+        residency.requests[model].extend(now - i for i in range(requests))
+
+    assert residency.resident_set(now) == {"dem-model:latest", "rep-model:latest"}
+
+    # the least used model is unloaded right after its call
+    assert residency.keep_alive_for("fact-checker:latest", record=False) == 0
+
+
+def test_pinned_models_are_kept_loaded():
+    residency = ModelResidencyManager(memory_budget_gb=8, pinned_models=["fact-checker:latest"])
+
+    assert residency.keep_alive_for("fact-checker:latest") == -1
+    # the pinned model fills the budget
+    assert residency.keep_alive_for("dem-model:latest") == 0
+
+
+def test_keep_alive_follows_the_gap_between_requests(monkeypatch):
+    residency = ModelResidencyManager(min_keep_alive_s=300, max_keep_alive_s=1800)
+    now = [1000.0]
+    monkeypatch.setattr(model_residency.time, "monotonic", lambda: now[0])
+
+    assert residency.keep_alive_for("dem-model:latest") == 300
+    now[0] += 600
+    assert residency.keep_alive_for("dem-model:latest") == 1200
+    # the first request is out of the traffic window by now
+    now[0] += 800
+    assert residency.keep_alive_for("dem-model:latest") == 1600
+
+
+def test_cold_loads_are_counted():
+    residency = ModelResidencyManager()
+
+    residency.record_response("dem-model:latest", {"load_duration": 3e9})
+    residency.record_response("dem-model:latest", {"load_duration": 1e6})
+
+    assert residency.stats()["dem-model:latest"] == {"cold_loads": 1, "load_time_s": 3.0}
@@ -0,0 +1,131 @@
+import asyncio
+import os
+import sys
+
+import ollama
+import pytest
+from ollama import ProcessResponse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ollama_pool import AsyncOllamaPool, Backend, OllamaPool
+
+
+class FakeClient:
+    """Answers with its host name, or raises the given error; ps reports the given loaded models."""
+
+    def __init__(self, host, error=None, loaded=()):
+        self.host = host
+        self.error = error
+        self.loaded = loaded
+        self.calls = 0
+
+    def chat(self, model, messages, stream=False, **kwargs):
+        self.calls += 1
+        if self.error:
+            if stream:
+                # like ollama.Client, a streamed request only fails once the first chunk is read
+                return self._failing_stream()
+            raise self.error
+        return iter([self.host, "done"]) if stream else self.host
+
+    def _failing_stream(self):
+        raise self.error
+        yield
+
+    def ps(self):
+        if self.error:
+            raise self.error
+        return ProcessResponse(models=[ProcessResponse.Model(model=m) for m in self.loaded])
+
+
+class FakeAsyncClient(FakeClient):
+    async def chat(self, model, messages, stream=False, **kwargs):
+        response = super().chat(model, messages, stream=stream, **kwargs)
+        return self._stream(response) if stream else response
+
+    async def _stream(self, chunks):
+        for chunk in chunks:
+            yield chunk
+
+    async def ps(self):
+        return super().ps()
+
+
+def make_pool(pool_class, client_class, **clients):
+    pool = pool_class([Backend(host) for host in clients])
+    pool.clients = {host: client_class(host, **kwargs) for host, kwargs in clients.items()}
+    pool.health_clients = pool.clients
+    return pool
+
+
+def test_hosts_with_the_model_loaded_come_first():
+    pool = make_pool(OllamaPool, FakeClient, a={}, b={"loaded": ["dem-model:latest"]}, c={})
+
+    assert pool.chat(model="dem-model", messages=[]) == "b"
+    # without the model anywhere the least busy host wins, then the one with the fewest models loaded
+    pool.backends[0].in_flight = 1
+    assert pool.chat(model="rep-model", messages=[]) == "c"
+    assert pool.stats()["c"]["loaded"] == ["rep-model:latest"]
+
+
+def test_request_moves_to_the_next_host_when_one_is_down():
+    pool = make_pool(OllamaPool, FakeClient, a={"loaded": ["dem-model:latest"]}, b={})
+    for backend in pool.backends:
+        backend.checked_at = float("inf")  # skip the health checks
+    pool.clients["a"].error = ConnectionError("refused")
+
+    assert pool.chat(model="dem-model", messages=[]) == "b"
+    assert pool.stats()["a"]["healthy"] is False
+    assert pool.stats()["a"]["failures"] == 1
+    # the host that is down is only tried as a last resort
+    assert pool.chat(model="dem-model", messages=[]) == "b"
+    assert pool.clients["a"].calls == 1
+
+
+def test_health_check_marks_unreachable_hosts():
+    pool = make_pool(OllamaPool, FakeClient, a={"error": ConnectionError("refused")}, b={})
+
+    assert pool.chat(model="dem-model", messages=[]) == "b"
+    assert pool.clients["a"].calls == 0
+    assert 'politikai_backend_up{host="a"} 0' in pool.metrics()
+
+
+def test_request_errors_are_not_retried_elsewhere():
+    pool = make_pool(OllamaPool, FakeClient, a={"error": ollama.ResponseError("bad request", 400)}, b={})
+    pool.backends[0].checked_at = pool.backends[1].checked_at = float("inf")
+
+    with pytest.raises(ollama.ResponseError):
+        pool.chat(model="dem-model", messages=[])
+    assert pool.clients["b"].calls == 0
+
+
+def test_error_of_the_last_host_is_raised():
+    pool = make_pool(OllamaPool, FakeClient, a={"error": ollama.ResponseError("overloaded", 503)},
+                     b={"error": ollama.ResponseError("not found", 404)})
+    pool.backends[0].checked_at = pool.backends[1].checked_at = float("inf")
+
+    with pytest.raises(ollama.ResponseError, match="not found"):
+        pool.chat(model="dem-model", messages=[])
+
+
+def test_stream_moves_to_the_next_host_before_the_first_chunk():
+    pool = make_pool(OllamaPool, FakeClient, a={"loaded": ["dem-model:latest"]}, b={})
+    pool.backends[0].checked_at = pool.backends[1].checked_at = float("inf")
+    pool.clients["a"].error = ConnectionError("refused")
+
+    assert list(pool.chat(model="dem-model", messages=[], stream=True)) == ["b", "done"]
+    assert [b.in_flight for b in pool.backends] == [0, 0]
+
+
+def test_async_pool_fails_over():
+    pool = make_pool(AsyncOllamaPool, FakeAsyncClient, a={"loaded": ["dem-model:latest"]}, b={})
+
+    async def run():
+        await pool._refresh()
+        pool.clients["a"].error = ConnectionError("refused")
+        response = await pool.chat(model="dem-model", messages=[])
+        chunks = [chunk async for chunk in await pool.chat(model="dem-model", messages=[], stream=True)]
+        return response, chunks
+
+    assert asyncio.run(run()) == ("b", ["b", "done"])
+    assert pool.stats()["a"]["healthy"] is False
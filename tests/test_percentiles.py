@@ -0,0 +1,13 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from percentiles import percentile
+
+
+def test_nearest_rank():
+    assert percentile([1, 2, 3, 4, 5], 50) == 3
+    assert percentile(list(range(1, 21)), 95) == 19
+    assert percentile(list(range(1, 21)), 100) == 20
+    assert percentile([7], 0) == 7
+    assert percentile([], 50) == 0
@@ -0,0 +1,124 @@
+import csv
+import json
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("pandas")
+pytest.importorskip("transformers")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, "persona_construction"))
+import politics_evalution
+from politics_evalution import classify_batched, run_evaluations
+
+
+class FakeClassifier:
+    """Labels every text by its length and records the batches it was called with."""
+
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, texts, batch_size, truncation, max_length):
+        assert len(texts) == batch_size
+        self.batches.append(list(texts))
+        return [{"label": f"LABEL_{len(text) % 3}", "score": len(text) / 100} for text in texts]
+
+
+def write_results(path, items):
+    with open(path, "w", encoding="utf-8") as f:
+        for item in items:
+            f.write(json.dumps(item) + "\n")
+
+
+def read_csv(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return list(csv.DictReader(f))
+
+
+def test_texts_are_batched_by_length():
+    classifier = FakeClassifier()
+    texts = ["aaaa", "a", "aaa", "aa", "aaaaa"]
+
+    predictions = [None] * len(texts)
+    for positions, batch in classify_batched(classifier, texts, batch_size=2):
+        for position, prediction in zip(positions, batch):
+            predictions[position] = prediction
+
+    assert classifier.batches == [["a", "aa"], ["aaa", "aaaa"], ["aaaaa"]]
+    assert [p["score"] for p in predictions] == [len(text) / 100 for text in texts]
+
+
+def test_rows_are_written_in_prompt_order(tmp_path, monkeypatch):
+    input_file = str(tmp_path / "eval_results_v1.jsonl")
+    output_csv = str(tmp_path / "politico_results_v1.csv")
+    write_results(input_file, [
+        {"id": 1, "category": "tax", "prompt": "p1", "dem_response": "long answer", "rep_response": "x"},
+        {"id": 2, "category": "tax", "prompt": "p2", "dem_response": "mid", "rep_response": "longer answer"},
+    ])
+    monkeypatch.setattr(politics_evalution, "get_classifier", lambda backend: FakeClassifier())
+
+    run_evaluations([(input_file, output_csv)], batch_size=3)
+
+    rows = read_csv(output_csv)
+    assert [(row["prompt_id"], row["persona_type"]) for row in rows] == [
+        ("1", "Democrat"), ("1", "Republican"), ("2", "Democrat"), ("2", "Republican")
+    ]
+    assert [row["llm_response"] for row in rows] == ["long answer", "x", "mid", "longer answer"]
+    assert rows[0]["predicted_leaning"] == f"LABEL_{len('long answer') % 3}"
+
+
+def test_unknown_backend_is_refused():
+    with pytest.raises(ValueError, match="Unknown backend"):
+        politics_evalution.load_classifier("fp16")
+
+
+def test_onnx_backend_without_optimum_says_what_to_install(tmp_path, monkeypatch):
+    monkeypatch.setattr(politics_evalution, "BACKEND_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(politics_evalution.AutoTokenizer, "from_pretrained", lambda name: object())
+    # a None entry makes the import fail like a missing package
+    monkeypatch.setitem(sys.modules, "optimum.onnxruntime", None)
+
+    with pytest.raises(ImportError, match="optimum"):
+        politics_evalution.load_classifier("onnx")
+    assert not os.listdir(tmp_path)
+
+
+def test_classifier_is_loaded_once_per_backend(monkeypatch):
+    loads = []
+    monkeypatch.setattr(politics_evalution, "_classifiers", {})
+    monkeypatch.setattr(politics_evalution, "load_classifier",
+                        lambda backend: loads.append(backend) or FakeClassifier())
+
+    first = politics_evalution.get_classifier("fp32")
+    assert politics_evalution.get_classifier("fp32") is first
+    politics_evalution.get_classifier("int8")
+
+    assert loads == ["fp32", "int8"]
+
+
+def test_files_are_classified_in_one_pass_and_resumed(tmp_path, monkeypatch):
+    jobs = []
+    for tag in ["v1", "v2"]:
+        input_file = str(tmp_path / f"eval_results_{tag}.jsonl")
+        write_results(input_file, [{"id": 1, "category": "tax", "prompt": "p", "dem_response": f"dem {tag}",
+                                    "rep_response": f"rep {tag}"}])
+        jobs.append((input_file, str(tmp_path / f"politico_results_{tag}.csv")))
+    # the Democrat response of v1 was classified before the previous run was interrupted
+    with open(politics_evalution.checkpoint_path(jobs[0][1]), "w", encoding="utf-8") as f:
+        f.write(json.dumps({"prompt_id": 1, "category": "tax", "prompt": "p", "persona_type": "Democrat",
+                            "llm_response": "dem v1", "predicted_leaning": "LABEL_0", "confidence_score": 0.9}) + "\n")
+    classifier = FakeClassifier()
+    monkeypatch.setattr(politics_evalution, "get_classifier", lambda backend: classifier)
+
+    run_evaluations(jobs, batch_size=8)
+
+    assert classifier.batches == [["rep v1", "dem v2", "rep v2"]]
+    first, second = read_csv(jobs[0][1]), read_csv(jobs[1][1])
+    assert [(row["persona_type"], row["predicted_leaning"]) for row in first] == [
+        ("Democrat", "LABEL_0"), ("Republican", f"LABEL_{len('rep v1') % 3}")
+    ]
+    assert [row["llm_response"] for row in second] == ["dem v2", "rep v2"]
+    assert not os.path.exists(politics_evalution.checkpoint_path(jobs[0][1]))
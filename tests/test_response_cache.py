@@ -0,0 +1,110 @@
+import asyncio
+import os
+import sys
+
+from ollama import ChatResponse, Message
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import response_cache
+from response_cache import ResponseCache
+
+
+class FakeClient:
+    """Answers with the system prompt of the model, which can be changed like a re-created model."""
+
+    def __init__(self, system="Be brief."):
+        self.system = system
+        self.calls = 0
+
+    def chat(self, model, messages, **kwargs):
+        self.calls += 1
+        return ChatResponse(model=model, done=True, message=Message(role="assistant", content=self.system))
+
+    def show(self, model):
+        return {"modelfile": f'SYSTEM """{self.system}"""', "parameters": "", "template": ""}
+
+    def list(self):
+        return {"models": [{"model": "persona:latest", "digest": "abc"}]}
+
+
+class AsyncFakeClient(FakeClient):
+    async def chat(self, model, messages, **kwargs):
+        return FakeClient.chat(self, model, messages, **kwargs)
+
+    async def show(self, model):
+        return FakeClient.show(self, model)
+
+    async def list(self):
+        return FakeClient.list(self)
+
+
+MESSAGES = [{"role": "user", "content": "Hello"}]
+
+
+def test_recreated_model_is_not_answered_from_the_old_entries(tmp_path):
+    cache = ResponseCache(str(tmp_path / "responses.sqlite"))
+    client = FakeClient()
+    cache.chat(client, "persona", MESSAGES)
+
+    client.system = "Be verbose."
+    cache.forget_model("persona:latest")
+
+    assert cache.chat(client, "persona", MESSAGES).message.content == "Be verbose."
+    assert client.calls == 2
+
+
+def test_identity_is_resolved_again_after_its_ttl(tmp_path, monkeypatch):
+    cache = ResponseCache(str(tmp_path / "responses.sqlite"))
+    client = FakeClient()
+    now = [1000.0]
+    monkeypatch.setattr(response_cache.time, "monotonic", lambda: now[0])
+    cache.chat(client, "persona", MESSAGES)
+
+    client.system = "Be verbose."
+    assert cache.chat(client, "persona", MESSAGES).message.content == "Be brief."
+    now[0] += response_cache.IDENTITY_TTL_S
+    assert cache.chat(client, "persona", MESSAGES).message.content == "Be verbose."
+
+
+def test_async_chat_reports_hits(tmp_path):
+    cache = ResponseCache(str(tmp_path / "responses.sqlite"))
+    client = AsyncFakeClient()
+
+    async def chat_twice():
+        await cache.async_chat(client, "persona", MESSAGES)
+        first = cache.last_was_hit()
+        await cache.async_chat(client, "persona", MESSAGES)
+        return first, cache.last_was_hit()
+
+    assert asyncio.run(chat_twice()) == (False, True)
+    assert cache.stats()["hits"] == 1
+
+
+def test_key_covers_everything_that_changes_the_answer():
+    identity = {"digest": "abc", "system": "Be brief.", "parameters": "", "template": ""}
+    key = response_cache.request_key(identity, MESSAGES)
+
+    assert key == response_cache.request_key(identity, [{"role": "user", "content": "Hello", "images": None}])
+    assert key != response_cache.request_key({**identity, "system": "Be verbose."}, MESSAGES)
+    assert key != response_cache.request_key(identity, MESSAGES, options={"temperature": 0.7})
+    assert key != response_cache.request_key(identity, MESSAGES, format="json")
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = ResponseCache(str(tmp_path / "responses.sqlite"), max_mb=0.001)
+    response = ChatResponse(model="persona", message=Message(role="assistant", content="x" * 400))
+    for key in ("a", "b", "c"):
+        cache.put(key, response)
+
+    assert cache.get("a") is None
+    assert cache.get("c") is not None
+
+
+def test_disabled_cache_always_calls_the_model(tmp_path):
+    cache = ResponseCache(str(tmp_path / "responses.sqlite"), enabled=False)
+    client = FakeClient()
+    cache.chat(client, "persona", MESSAGES)
+    cache.chat(client, "persona", MESSAGES)
+
+    assert client.calls == 2
+    assert not cache.last_was_hit()
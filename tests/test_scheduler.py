@@ -0,0 +1,101 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import scheduler as scheduler_module
+from scheduler import BACKGROUND, FACT_CHECK, PERSONA, Scheduler, SchedulerBusy
+
+
+async def served_order(scheduler, requests):
+    """Holds the only slot while the requests queue up, then returns the order they were served in."""
+    order = []
+    release = asyncio.Event()
+
+    async def hold():
+        async with scheduler.slot("model", "holder"):
+            await release.wait()
+
+    async def request(name, session, priority):
+        async with scheduler.slot("model", session, priority):
+            order.append(name)
+
+    holder = asyncio.create_task(hold())
+    await asyncio.sleep(0)
+    tasks = [asyncio.create_task(request(*r)) for r in requests]
+    await asyncio.sleep(0)
+    release.set()
+    await asyncio.gather(holder, *tasks)
+    return order
+
+
+def test_higher_priority_is_served_first():
+    scheduler = Scheduler(max_concurrent=1)
+    order = asyncio.run(served_order(scheduler, [
+        ("summary", "a", BACKGROUND), ("fact check", "a", FACT_CHECK), ("persona", "a", PERSONA),
+    ]))
+    assert order == ["persona", "fact check", "summary"]
+
+
+def test_session_served_longest_ago_goes_first():
+    scheduler = Scheduler(max_concurrent=1)
+    scheduler.last_served = {"busy": 2.0, "idle": 1.0}
+    order = asyncio.run(served_order(scheduler, [("busy", "busy", FACT_CHECK), ("idle", "idle", FACT_CHECK)]))
+    assert order == ["idle", "busy"]
+
+
+def test_waiting_requests_age_into_the_highest_priority(monkeypatch):
+    scheduler = Scheduler(max_concurrent=1, aging_s=10)
+    now = [1000.0]
+    monkeypatch.setattr(scheduler_module.time, "monotonic", lambda: now[0])
+
+    async def run():
+        release = asyncio.Event()
+        order = []
+
+        async def hold():
+            async with scheduler.slot("model", "holder"):
+                await release.wait()
+
+        async def request(name, priority):
+            async with scheduler.slot("model", name, priority):
+                order.append(name)
+
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        old = asyncio.create_task(request("old summary", BACKGROUND))
+        await asyncio.sleep(0)
+        now[0] += 11
+        new = asyncio.create_task(request("new persona", PERSONA))
+        await asyncio.sleep(0)
+        release.set()
+        await asyncio.gather(holder, old, new)
+        return order
+
+    # both count as persona streams now, the older one arrived first
+    assert asyncio.run(run()) == ["old summary", "new persona"]
+
+
+def test_full_queue_refuses_requests():
+    scheduler = Scheduler(max_concurrent=1, max_queue_depth=1)
+
+    async def run():
+        release = asyncio.Event()
+
+        async def hold():
+            async with scheduler.slot("model", "a"):
+                await release.wait()
+
+        tasks = [asyncio.create_task(hold()), asyncio.create_task(hold())]
+        await asyncio.sleep(0)
+        with pytest.raises(SchedulerBusy):
+            async with scheduler.slot("model", "b"):
+                pass
+        release.set()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(run())
+    assert scheduler.stats()["refused"] == {"persona": 1}
+    assert "politikai_queue_depth" in "\n".join(scheduler.metrics())
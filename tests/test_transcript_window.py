@@ -0,0 +1,51 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from transcript_window import TranscriptWindow, estimate_tokens, message_tokens
+
+
+def transcript(turns: int) -> list:
+    messages = []
+    for i in range(turns):
+        messages.append({"role": "user", "content": f"Question {i}. " + "Why? " * 40})
+        messages.append({"role": "assistant", "author": "Democrat", "content": f"Answer {i}. " + "Because. " * 40})
+    return messages
+
+
+def test_older_turns_are_summarized_into_the_first_user_message():
+    window = TranscriptWindow(budgets={}, default_budget=200)
+    full = transcript(5)
+
+    messages, saved = window.build(full, "dem-model:latest")
+
+    assert messages[1:] == full[-1:]
+    assert messages[0]["role"] == "user"
+    assert messages[0]["content"].startswith("Summary of the earlier conversation:\n- User: Question 0.")
+    assert messages[0]["content"].endswith("\n\n" + full[-2]["content"])
+    assert all(a["role"] != b["role"] for a, b in zip(messages, messages[1:]))
+    assert message_tokens(messages) <= 200
+    assert saved == message_tokens(full) - message_tokens(messages)
+    # the transcript itself is left as it is
+    assert not full[-2]["content"].startswith("Summary")
+
+
+def test_short_transcript_is_sent_in_full():
+    window = TranscriptWindow(budgets={}, default_budget=2048)
+    full = transcript(2)
+    nudge = {"role": "user", "content": "Question 1."}
+
+    messages, saved = window.build(full, "rep-model:latest", nudge)
+
+    assert messages == full + [nudge]
+    assert saved == 0
+
+
+def test_newest_turn_is_kept_even_over_budget():
+    window = TranscriptWindow(budgets={}, default_budget=10)
+    full = transcript(3)
+
+    messages, _ = window.build(full, "dem-model:latest")
+
+    assert messages == full[-2:]
+    assert message_tokens(full[-2:]) > 10 > estimate_tokens("")
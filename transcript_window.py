@@ -0,0 +1,169 @@
+"""
+Keeps the conversation sent to the personas within a token budget.
+
+The full transcript grows with every turn, and resending it makes every prompt longer than the previous one.
+The window below keeps the most recent turns verbatim and replaces everything older with a short summary:
+- a turn is a user message followed by the persona answers to it
+- turns are kept verbatim from the newest to the oldest until the budget of the model is used up
+- older turns are replaced by one summary each; a summary is computed once per turn and cached
+- the summaries are put in front of the first kept user message
+- if even the summaries do not fit, the oldest ones are dropped
+
+By default a summary is extractive (the first sentence of every message in the turn), so it costs no model call.
+If POLITIKAI_SUMMARY_MODEL is set, summaries are additionally written by that model in the background and
+replace the extractive ones once they are ready.
+"""
+
+import hashlib
+import json
+import os
+import re
+
+# tokens of conversation history each persona model gets (the modelfile system prompt comes on top of this)
+DEFAULT_BUDGET_TOKENS = int(os.environ.get("POLITIKAI_CONTEXT_BUDGET_TOKENS", 2048))
+
+CONTEXT_BUDGET_TOKENS = {
+    "dem-model:latest": DEFAULT_BUDGET_TOKENS,
+    "rep-model:latest": DEFAULT_BUDGET_TOKENS,
+}
+
+# model that writes the summaries, empty to only use extractive summaries
+SUMMARY_MODEL = os.environ.get("POLITIKAI_SUMMARY_MODEL", "")
+
+# mistral-nemo averages about 4 characters per token on English text
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def message_tokens(messages: list) -> int:
+    return sum(estimate_tokens(m["content"]) for m in messages)
+
+
+def split_turns(transcript: list) -> list:
+    """Groups the transcript into turns, each starting with a user message."""
+    turns = []
+    for message in transcript:
+        if message["role"] == "user" or not turns:
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+
+def first_sentence(text: str, max_chars: int = 200) -> str:
+    sentence = re.split(r"(?<=[.!?])\s", text.strip(), maxsplit=1)[0]
+    return sentence if len(sentence) <= max_chars else sentence[:max_chars].rstrip() + "..."
+
+
+def extractive_summary(turn: list) -> str:
+    parts = []
+    for message in turn:
+        speaker = "User" if message["role"] == "user" else message.get("author", "Assistant")
+        parts.append(f"{speaker}: {first_sentence(message['content'])}")
+    return " ".join(parts)
+
+
+def turn_key(turn: list) -> str:
+    return hashlib.sha1(json.dumps(turn, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class TranscriptWindow:
+    def __init__(self, budgets: dict = None, default_budget: int = DEFAULT_BUDGET_TOKENS):
+        """
+        Args:
+            budgets: Token budget per persona model
+            default_budget: Budget for models missing from budgets
+        """
+        self.budgets = CONTEXT_BUDGET_TOKENS if budgets is None else budgets
+        self.default_budget = default_budget
+        self.summaries = {}  # turn key -> summary, computed once per turn
+        self.model_summarized = set()  # turn keys whose summary was written by SUMMARY_MODEL
+
+    def budget_for(self, model: str) -> int:
+        return self.budgets.get(model, self.default_budget)
+
+    def summary_of(self, turn: list) -> str:
+        key = turn_key(turn)
+        if key not in self.summaries:
+            self.summaries[key] = extractive_summary(turn)
+        return self.summaries[key]
+
+    def build(self, transcript: list, model: str, nudge: dict = None):
+        """
+        Builds the messages to send to a persona model.
+
+        Args:
+            transcript: The full conversation
+            model: The persona model, selects the budget
+            nudge: Message appended at the end, e.g. the repeated user message for the second agent
+
+        Returns:
+            Tuple of (messages, prompt tokens saved compared to sending the full transcript)
+        """
+        budget = self.budget_for(model)
+        if nudge:
+            budget -= estimate_tokens(nudge["content"])
+
+        turns = split_turns(transcript)
+
+        # the newest turn is always kept, it contains the message being answered
+        recent = []
+        used = 0
+        for turn in reversed(turns):
+            tokens = message_tokens(turn)
+            if recent and used + tokens > budget:
+                break
+            recent.insert(0, turn)
+            used += tokens
+
+        # summaries of the older turns, dropping the oldest ones if they do not fit either
+        summaries = []
+        for turn in reversed(turns[:len(turns) - len(recent)]):
+            summary = self.summary_of(turn)
+            if used + estimate_tokens(summary) > budget:
+                break
+            summaries.insert(0, summary)
+            used += estimate_tokens(summary)
+
+        messages = [message for turn in recent for message in turn]
+        if summaries:
+            summary = "Summary of the earlier conversation:\n" + "\n".join(f"- {s}" for s in summaries)
+            # merged into the first kept user message: two user messages in a row confuse chat templates, and a
+            # system message would replace the persona's system prompt from its modelfile
+            if messages and messages[0]["role"] == "user":
+                messages[0] = {**messages[0], "content": f"{summary}\n\n{messages[0]['content']}"}
+            else:
+                messages.insert(0, {"role": "user", "content": summary})
+        if nudge:
+            messages.append(nudge)
+
+        full = list(transcript) + ([nudge] if nudge else [])
+        saved = message_tokens(full) - message_tokens(messages)
+        return messages, saved
+
+    async def summarize_with_model(self, client, transcript: list, keep_recent: int = 1, model: str = SUMMARY_MODEL):
+        """Replaces the extractive summaries of all but the newest turns with summaries written by a model."""
+        if not model:
+            return
+        for turn in split_turns(transcript)[:-keep_recent]:
+            key = turn_key(turn)
+            if key in self.model_summarized:
+                continue
+            conversation = "\n".join(
+                f"{'User' if m['role'] == 'user' else m.get('author', 'Assistant')}: {m['content']}" for m in turn
+            )
+            try:
+                response = await client.chat(
+                    model=model,
+                    messages=[{
+                        "role": "user",
+                        "content": f"Summarize this exchange in at most two sentences, keeping every speaker's "
+                                   f"position and any facts or numbers they cited:\n\n{conversation}"
+                    }]
+                )
+                self.summaries[key] = response["message"]["content"].strip()
+                self.model_summarized.add(key)
+            except Exception as e:
+                print(f"[context] could not summarize a turn: {e}")
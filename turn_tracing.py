@@ -0,0 +1,257 @@
+"""
+Per-turn tracing of the chat app.
+
+Every turn of frontend.py gets a trace with one span per model call (each persona, the fact checker, every
+chunk of the pipelined fact check), split up into where the time went:
+- queue_wait: waiting for a generation slot
+- model_load, prompt_eval and generation: the load_duration, prompt_eval_duration and eval_duration Ollama
+  returns with the final chunk
+- time_to_first_token: from sending the request until the first token arrived
+- parse: time spent parsing the fact checker's output
+- total: from queueing the call until its last chunk
+along with the prompt and generated token counts, and the error if the call failed, which used to only be printed
+or shown in the chat. Each turn also records the prompt tokens the transcript window saved per persona.
+
+Finished turns are exported:
+- to a JSONL trace file, one line per turn (POLITIKAI_TRACE_FILE, empty to disable)
+- as Prometheus metrics on http://localhost:<POLITIKAI_METRICS_PORT>/metrics if a port is set: a histogram per
+  span, call and model, token, saved token and error counters, and the turn latency, along with the metrics of the
+  collectors registered by other modules (e.g. the queue metrics of scheduler.py)
+"""
+
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+
+TRACE_PATH = os.environ.get("POLITIKAI_TRACE_FILE", os.path.join(CACHE_DIR, "traces.jsonl"))
+
+METRICS_PORT = int(os.environ.get("POLITIKAI_METRICS_PORT", 0))
+
+# upper bounds (seconds) of the histogram buckets
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, float("inf"))
+
+# span name -> field of the final chunk it is read from (nanoseconds)
+OLLAMA_DURATIONS = {
+    "model_load": "load_duration",
+    "prompt_eval": "prompt_eval_duration",
+    "generation": "eval_duration",
+}
+
+
+class CallSpan:
+    """Timing of one model call. Used as a context manager around the call; an exception is recorded and raised."""
+
+    def __init__(self, name: str, model: str):
+        self.name = name
+        self.model = model
+        self.start = time.perf_counter()
+        self.sent_at = None
+        self.first_token_at = None
+        self.durations = {}  # span -> seconds
+        self.tokens = {}
+        self.cached = False
+        self.error = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None:
+            self.error = f"{exc_type.__name__}: {exc}"
+        self.durations["total"] = time.perf_counter() - self.start
+        return False
+
+    def sent(self) -> None:
+        """The call got a generation slot and the request is sent."""
+        self.sent_at = time.perf_counter()
+        self.durations["queue_wait"] = self.sent_at - self.start
+
+    def token(self) -> None:
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+            self.durations["time_to_first_token"] = self.first_token_at - (self.sent_at or self.start)
+
+    def done(self, response) -> None:
+        """Record the durations and token counts of the final chunk (or the whole non-streamed response)."""
+        self.token()
+        for span, field in OLLAMA_DURATIONS.items():
+            if response.get(field) is not None:
+                self.durations[span] = response.get(field) / 1e9
+        self.tokens = {"prompt": response.get("prompt_eval_count") or 0, "eval": response.get("eval_count") or 0}
+
+    @contextmanager
+    def timed(self, span: str):
+        """Adds the time spent in the block to the span, e.g. parsing the output chunk by chunk."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.durations[span] = self.durations.get(span, 0.0) + time.perf_counter() - start
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "model": self.model,
+            "cached": self.cached,
+            **{span: round(seconds, 4) for span, seconds in self.durations.items()},
+            "prompt_tokens": self.tokens.get("prompt", 0),
+            "eval_tokens": self.tokens.get("eval", 0),
+            "error": self.error,
+        }
+
+
+class TurnTrace:
+    def __init__(self, tracer, session_id=None, settings: dict = None):
+        self.tracer = tracer
+        self.session_id = session_id
+        self.settings = settings or {}
+        self.start = time.perf_counter()
+        self.calls = []
+        self.prompt_tokens_saved = {}  # persona -> prompt tokens the transcript window saved
+
+    def call(self, name: str, model: str) -> CallSpan:
+        span = CallSpan(name, model)
+        self.calls.append(span)
+        return span
+
+    def finish(self) -> None:
+        self.tracer.export(self, time.perf_counter() - self.start)
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+
+    def lines(self, metric: str, labels: str) -> list:
+        lines = [
+            f'{metric}_bucket{{{labels}{"," if labels else ""}le="{"+Inf" if bound == float("inf") else bound}"}} '
+            f'{count}'
+            for bound, count in zip(BUCKETS, self.counts)
+        ]
+        labels = f"{{{labels}}}" if labels else ""
+        return lines + [f"{metric}_sum{labels} {self.sum:.6f}", f"{metric}_count{labels} {self.count}"]
+
+
+class Tracer:
+    def __init__(self, trace_path: str = TRACE_PATH, metrics_port: int = METRICS_PORT):
+        """
+        Args:
+            trace_path: JSONL file the finished turns are appended to, empty to not write traces
+            metrics_port: Port of the Prometheus endpoint, 0 to not serve metrics
+        """
+        self.trace_path = trace_path
+        self.spans = defaultdict(Histogram)  # (span, call name, model) -> histogram
+        self.turns = Histogram()
+        self.tokens = defaultdict(int)  # (model, prompt or eval) -> tokens
+        self.tokens_saved = defaultdict(int)  # persona -> prompt tokens saved by the transcript window
+        self.errors = defaultdict(int)  # call name -> failed calls
+        self.cached = defaultdict(int)  # call name -> calls answered from the claim cache
+        self.collectors = []  # functions returning more lines of metrics
+        self._lock = threading.Lock()
+        if metrics_port:
+            self.serve(metrics_port)
+
+    def turn(self, session_id=None, settings: dict = None) -> TurnTrace:
+        return TurnTrace(self, session_id, settings)
+
+    def export(self, turn: TurnTrace, seconds: float) -> None:
+        calls = [call.to_dict() for call in turn.calls]
+        with self._lock:
+            self.turns.observe(seconds)
+            for call in turn.calls:
+                for span, value in call.durations.items():
+                    self.spans[(span, call.name, call.model)].observe(value)
+                for kind, count in call.tokens.items():
+                    self.tokens[(call.model, kind)] += count
+                self.errors[call.name] += call.error is not None
+                self.cached[call.name] += call.cached
+            for persona, saved in turn.prompt_tokens_saved.items():
+                self.tokens_saved[persona] += saved
+
+            if self.trace_path:
+                record = {
+                    "time": datetime.now(timezone.utc).isoformat(),
+                    "session": turn.session_id,
+                    "settings": turn.settings,
+                    "total": round(seconds, 4),
+                    "calls": calls,
+                    "prompt_tokens_saved": turn.prompt_tokens_saved,
+                }
+                os.makedirs(os.path.dirname(os.path.abspath(self.trace_path)), exist_ok=True)
+                with open(self.trace_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def metrics(self) -> str:
+        """The metrics in the Prometheus text format."""
+        lines = ["# TYPE politikai_turn_seconds histogram"]
+        with self._lock:
+            lines += self.turns.lines("politikai_turn_seconds", "")
+            lines.append("# TYPE politikai_call_seconds histogram")
+            for (span, name, model), histogram in sorted(self.spans.items()):
+                lines += histogram.lines("politikai_call_seconds", f'span="{span}",call="{name}",model="{model}"')
+            lines.append("# TYPE politikai_tokens_total counter")
+            for (model, kind), count in sorted(self.tokens.items()):
+                lines.append(f'politikai_tokens_total{{model="{model}",kind="{kind}"}} {count}')
+            lines.append("# TYPE politikai_prompt_tokens_saved_total counter")
+            for persona, count in sorted(self.tokens_saved.items()):
+                lines.append(f'politikai_prompt_tokens_saved_total{{persona="{persona}"}} {count}')
+            lines.append("# TYPE politikai_call_errors_total counter")
+            for name, count in sorted(self.errors.items()):
+                lines.append(f'politikai_call_errors_total{{call="{name}"}} {count}')
+            lines.append("# TYPE politikai_cached_calls_total counter")
+            for name, count in sorted(self.cached.items()):
+                lines.append(f'politikai_cached_calls_total{{call="{name}"}} {count}')
+        for collector in self.collectors:
+            lines += collector()
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int) -> None:
+        """Serve the metrics on /metrics from a background thread."""
+        tracer = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = tracer.metrics().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f"[tracing] serving metrics on http://127.0.0.1:{port}/metrics")
+
+    def stats(self) -> dict:
+        """Mean seconds per span and call, over all turns so far."""
+        with self._lock:
+            stats = {"turns": self.turns.count, "errors": dict(self.errors)}
+            for (span, name, _), histogram in sorted(self.spans.items()):
+                stats.setdefault(name, {})[span] = round(histogram.sum / histogram.count, 3)
+        return stats
+
+
+# shared by all sessions of the frontend
+tracer = Tracer()